@@ -0,0 +1,1114 @@
+import socket
+import threading
+import sys
+import os
+import time
+import selectors
+import contextlib
+import tempfile
+import subprocess
+import random
+import heapq
+import json
+import math
+import queue
+import mchatserver
+import mchatclient
+from mchatprotocol import (CODECS, COMPRESS_MIN, HEADER, TYPED, FrameDecoder, encode_frame, compress_frame,
+                           encode_command)
+
+# the load benchmark's "--name=value" options, and their defaults
+LOAD_OPTIONS = {
+    "users": "100",
+    "per-channel": "5",
+    "capacity": "5",
+    "duration": "10",
+    "warmup": "1",
+    "chat-rate": "1",
+    "whisper-rate": "0",
+    "send-rate": "0",
+    "send-size": "65536",
+    "switch-rate": "0",
+    "coalesce": "0",
+    "compress": "",
+    "chat-size": "0",
+    "payload": "random",
+    "sizes": "100,1000,5000",
+    "server-args": "",
+    "json": "",
+}
+# each simulated action, and the option giving how often a user takes it per second
+LOAD_ACTIONS = {"chat": "chat-rate", "whisper": "whisper-rate", "send": "send-rate", "switch": "switch-rate"}
+# what the files sent by the load benchmark hold: incompressible bytes, or words like a chat log
+PAYLOADS = ("random", "text")
+WORDS = ("the", "channel", "server", "message", "queue", "client", "sent", "file", "hello", "again", "who",
+         "is", "here", "switching", "to", "general", "later", "thanks", "anyone", "seen", "my", "upload")
+
+
+def filler(size) -> str:
+    """
+    Returns:
+        str: Random words adding up to size characters, text that compresses like chat does.
+    """
+    words = []
+    length = 0
+    while length < size:
+        words.append(random.choice(WORDS))
+        length += len(words[-1]) + 1
+    return " ".join(words)[:size]
+
+def drain(peers, expected) -> None:
+    """
+    Reads and discards everything the server writes to the recipients' sockets. Runs in a
+    forked process, so receiving does not compete with the server for the interpreter.
+    Args:
+        peers (list): the client ends of the recipients' socket pairs.
+        expected (int): the total number of bytes to wait for.
+    """
+    selector = selectors.DefaultSelector()
+    for peer in peers:
+        peer.setblocking(False)
+        selector.register(peer, selectors.EVENT_READ)
+    buffer = bytearray(1 << 20)
+    received = 0
+    while received < expected:
+        for key, _ in selector.select(1):
+            try:
+                received += key.fileobj.recv_into(buffer)
+            except BlockingIOError:
+                pass
+
+def fanout(recipients, messages, burst, log_dir=None) -> float:
+    """
+    Broadcasts messages from one member of a channel to every member through the server's own
+    fan-out path (broadcast_in_channel, the client outboxes and the outbound writer) over socket
+    pairs, and prints the messages and deliveries per second. Each burst of messages is handled
+    as if it had been read in one recv.
+    Args:
+        recipients (int): the number of channel members, the sender included.
+        messages (int): the number of messages to broadcast.
+        burst (int): the number of messages handled together.
+        log_dir (str): a directory to log the channel's messages to, as with --log-dir.
+    Returns:
+        float: the messages broadcast per second.
+    """
+    msg = "[user0 (12:00:00)] the quick brown fox jumps over the lazy dog"
+    frame_size = len(mchatserver.encode_frame(msg))
+    pairs = [socket.socketpair() for _ in range(recipients)]
+    done_read, done_write = os.pipe()
+    if os.fork() == 0:
+        drain([client_end for _, client_end in pairs], messages * recipients * frame_size)
+        os.write(done_write, b"\0")
+        os._exit(0)
+
+    # nothing may be dropped, every byte is waited for
+    mchatserver.Outbox.high_watermark = mchatserver.Outbox.low_watermark = 1 << 40
+    writer = mchatserver.OutboundWriter()
+    threading.Thread(target=writer.run, daemon=True).start()
+    channel = mchatserver.Channel("bench", 0, recipients, mchatserver.UserDirectory())
+    for i, (server_end, client_end) in enumerate(pairs):
+        client_end.close()
+        client = mchatserver.Client(f"user{i}", server_end, None, writer=writer)
+        client.in_queue = False
+        channel.clients.append(client)
+    sender = channel.clients.get("user0")
+    log_writer = None
+    if log_dir is not None:
+        log_writer = mchatserver.LogWriter(log_dir)
+        channel.start_log(log_writer)
+        threading.Thread(target=log_writer.run, daemon=True).start()
+
+    start = time.perf_counter()
+    for sent in range(0, messages, burst):
+        with mchatserver.FlushBatch():
+            for _ in range(min(burst, messages - sent)):
+                # as handle_message does for a chat line
+                frame = mchatserver.broadcast_in_channel(sender, channel, msg)
+                if frame is not None:
+                    channel.remember(frame)
+    os.read(done_read, 1)
+    elapsed = time.perf_counter() - start
+    print(f"fanout: 1 -> {recipients}, {messages} messages in bursts of {burst}: "
+          f"{messages / elapsed:.0f} messages/s, {messages * recipients / elapsed:.0f} deliveries/s")
+    if log_writer is not None:
+        # the log only has to keep up, what is still queued is committed after the clock stops
+        log_writer.commit()
+        print(f"log: {messages} messages in {log_writer.commits} commits, {channel.log.size} bytes in the active segment")
+    return messages / elapsed
+
+def log_overhead(recipients, messages, burst) -> None:
+    """
+    Runs the fan-out benchmark without and then with the channel logged to a temporary
+    directory, and prints how much logging costs the broadcast rate.
+    Args:
+        recipients (int): the number of channel members, the sender included.
+        messages (int): the number of messages to broadcast.
+        burst (int): the number of messages handled together.
+    """
+    plain = fanout(recipients, messages, burst)
+    with tempfile.TemporaryDirectory() as log_dir:
+        logged = fanout(recipients, messages, burst, log_dir)
+    print(f"log overhead: {(1 - logged / plain) * 100:.1f}% of the broadcast rate")
+
+def drain_and_rebuild(q, client, remove=False) -> bool:
+    """
+    Looks a client up in a queue.Queue the way the server did before its waiting rooms were
+    indexed: every client is taken out into a temporary queue and put back.
+    Args:
+        q (queue.Queue): The queue of clients.
+        client (Client): The client to look for.
+        remove (bool): Whether to leave the client out when rebuilding the queue.
+    Returns:
+        bool: True if the client was in the queue.
+    """
+    found = False
+    temp_queue = queue.Queue()
+    while not q.empty():
+        queued = q.get()
+        if queued.username == client.username:
+            found = True
+            if remove:
+                continue
+        temp_queue.put(queued)
+    while not temp_queue.empty():
+        q.put(temp_queue.get())
+    return found
+
+def queue_cost(users) -> None:
+    """
+    Measures what a leave from the middle of a channel's queue and a join at its back cost with
+    users clients waiting, the join being the duplicate username check, the enqueue and the
+    position lookup. It compares the WaitingRoom with the queue.Queue the server used to drain
+    and rebuild, and prints the cost of one leave and join, without the notices they send.
+    Args:
+        users (int): The number of waiting clients.
+    """
+    clients = [mchatserver.Client(f"user{index}", None, None) for index in range(users)]
+    room = mchatserver.WaitingRoom()
+    rebuilt = queue.Queue()
+    for client in clients:
+        room.append(client)
+        rebuilt.put(client)
+    for label, rounds in (("WaitingRoom", 10000), ("queue.Queue drain/rebuild", 20)):
+        start = time.perf_counter()
+        for index in range(rounds):
+            # the client leaving from the middle joins again at the back, so the size stays put
+            client = clients[(users // 2 + index) % users]
+            if label == "WaitingRoom":
+                room.remove(client)
+                if client.username not in room:
+                    room.append(client)
+                    room.position(client)
+            else:
+                drain_and_rebuild(rebuilt, client, remove=True)
+                if not drain_and_rebuild(rebuilt, client):
+                    rebuilt.put(client)
+                    # the position came from draining the queue up to the client too
+                    drain_and_rebuild(rebuilt, client)
+        elapsed = time.perf_counter() - start
+        print(f"queue: {users} waiting, {label}: {elapsed / rounds * 1e6:.1f}us per leave and join")
+
+def parse_cost(messages) -> None:
+    """
+    Measures what working out the command of each message costs the server, from the received
+    bytes to the handler chosen (decoding the frame and parse_message), for the same chat lines
+    and commands sent as text frames and as binary frames, and prints the cost per message.
+    Args:
+        messages (int): the number of messages of each kind.
+    """
+    chat = [filler(random.randint(10, 120)) for _ in range(messages)]
+    commands = [random.choice(("/whisper bob hello", "/list", "/send bob notes.txt", "/switch general",
+                               "/resume 5f3a9c0e21d4b7a8 65536", "/received 5f3a9c0e21d4b7a8 " + "0" * 64))
+                for _ in range(messages)]
+    binary = mchatclient.User("bench")
+    for kind, lines in (("chat", chat), ("commands", commands)):
+        for mode, encode in (("text", encode_frame), ("binary", binary.encode_line)):
+            data = b"".join(encode(line) for line in lines)
+            best = None
+            for _ in range(5):
+                decoder = FrameDecoder()
+                decoder.typed = True
+                decoder.feed(data)
+                start = time.perf_counter()
+                for frame in decoder:
+                    mchatserver.parse_message(frame)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"parse {kind} as {mode}: {best / messages * 1e9:.0f}ns per message, "
+                  f"{len(data) / messages:.1f} bytes per message")
+
+class SimUser:
+    """
+    One simulated mchatclient: a framed connection to the server's shared port, the channel it
+    asked for, and whether the server has admitted it yet. Chat and whisper payloads carry the
+    perf_counter_ns at which they were sent, so whoever receives one knows its delivery latency.
+    """
+
+    def __init__(self, name, channel, codec=None):
+        self.name = name
+        self.channel = channel
+        # the codec to offer the server, and the one it agreed on for the current connection
+        self.offer = codec
+        self.codec = None
+        self.sock = None
+        self.decoder = None
+        self.member = False
+        # raw /send file bytes still to arrive behind the last "/send" frame
+        self.skip = 0
+        # file bytes still to arrive as frames behind the last compressed "/send" frame
+        self.chunks = 0
+
+    def connect(self, port) -> None:
+        self.sock = socket.create_connection(("localhost", port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.decoder = FrameDecoder()
+        self.codec = None
+        self.member = False
+        self.skip = 0
+        self.chunks = 0
+        self.sock.sendall(encode_frame(f"{self.name} {self.channel}"))
+        if self.offer is not None:
+            self.sock.sendall(encode_frame(f"/compress {self.offer}"))
+
+    def send(self, msg) -> bool:
+        frame = encode_frame(msg)
+        if self.codec is not None and len(frame) >= COMPRESS_MIN:
+            frame = compress_frame(frame, self.codec)
+        try:
+            self.sock.sendall(frame)
+            return True
+        except OSError:
+            return False
+
+class LoadRun:
+    """
+    Drives simulated users against a server from a single selector loop. Each user's chat,
+    whisper, /send and /switch actions are Poisson processes at the configured rates, kept on
+    one heap of due times.
+    """
+
+    def __init__(self, options, port, channel_names, payload):
+        self.options = options
+        self.port = port
+        self.channel_names = channel_names
+        self.payload = payload
+        self.selector = selectors.DefaultSelector()
+        self.users = []
+        self.members = {name: set() for name in channel_names}
+        self.due = []
+        self.scratch = memoryview(bytearray(1 << 20))
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Starts counting afresh, at the end of the warmup.
+        """
+        self.latency = mchatserver.Histogram()
+        self.sent = dict.fromkeys(LOAD_ACTIONS, 0)
+        self.delivered = 0
+        self.file_bytes = 0
+        self.wire_bytes = 0
+        # what the received bytes hold once decompressed, so the wire bytes can be compared to it
+        self.content_bytes = 0
+        self.disconnects = 0
+
+    def connect(self, user) -> None:
+        user.connect(self.port)
+        self.selector.register(user.sock, selectors.EVENT_READ, user)
+
+    def drop(self, user) -> None:
+        """
+        Forgets a user's connection, which the server closed or told it to replace.
+        """
+        self.selector.unregister(user.sock)
+        user.sock.close()
+        user.sock = None
+        self.members[user.channel].discard(user)
+
+    def schedule(self, user, now) -> None:
+        for action, option in LOAD_ACTIONS.items():
+            rate = float(self.options[option])
+            if rate > 0:
+                heapq.heappush(self.due, (now + random.expovariate(rate), id(user), action, user))
+
+    def act(self, user, action) -> None:
+        """
+        Performs one of a user's actions. Users still waiting in a queue only chat, which the
+        server ignores, so the queue is under the same pressure as the channel.
+        """
+        if user.sock is None:
+            return
+        peers = [peer for peer in self.members[user.channel] if peer is not user]
+        stamp = f"t={time.perf_counter_ns()}"
+        if int(self.options["chat-size"]) > len(stamp):
+            stamp = f"{stamp} {filler(int(self.options['chat-size']) - len(stamp) - 1)}"
+        if action == "chat":
+            ok = user.send(stamp)
+        elif action == "whisper" and user.member and peers:
+            ok = user.send(f"/whisper {random.choice(peers).name} {stamp}")
+        elif action == "send" and user.member and peers:
+            ok = user.send(f"/send {random.choice(peers).name} {self.payload}")
+        elif action == "switch" and len(self.channel_names) > 1:
+            target = random.choice([name for name in self.channel_names if name != user.channel])
+            ok = user.send(f"/switch {target}")
+            if ok:
+                self.members[user.channel].discard(user)
+                user.member = False
+                user.channel = target
+        else:
+            return
+        if ok:
+            self.sent[action] += 1
+
+    def receive(self, user) -> None:
+        try:
+            data = user.sock.recv(1 << 18)
+        except OSError:
+            data = b""
+        if not data:
+            self.disconnects += 1
+            self.drop(user)
+            return
+        self.wire_bytes += len(data)
+        user.decoder.feed(data)
+        while True:
+            while user.skip:
+                taken = user.decoder.take_into(self.scratch[:user.skip])
+                if not taken:
+                    return
+                user.skip -= taken
+                self.file_bytes += taken
+                self.content_bytes += taken
+            frame = user.decoder.next_frame()
+            if frame is None:
+                return
+            self.content_bytes += len(frame) + 4
+            if user.chunks:
+                user.chunks -= len(frame)
+                self.file_bytes += len(frame)
+                continue
+            self.handle(user, frame.decode(errors="replace"))
+
+    def handle(self, user, text) -> None:
+        _, marker, stamp = text.partition("] t=")
+        if marker:
+            self.delivered += 1
+            self.latency.record((time.perf_counter_ns() - int(stamp.split(" ", 1)[0])) / 1e9)
+        elif text.startswith("/send "):
+            split_text = text.split()
+            remaining = int(split_text[2]) - int(split_text[4])
+            # the codec after the offset says the file comes as compressed frames
+            if len(split_text) > 5:
+                user.chunks = remaining
+            else:
+                user.skip = remaining
+        elif text.startswith("/compress "):
+            codec = text.split()[1]
+            user.codec = user.decoder.codec = codec if codec in CODECS else None
+        elif text.startswith("/switch "):
+            # the server wants the user to reconnect to its new channel
+            self.drop(user)
+            self.connect(user)
+        elif text.endswith(f"] {user.name} has joined the channel."):
+            # the welcome is sent to waiting users too, only the join announcement admits
+            user.member = True
+            self.members[user.channel].add(user)
+
+    def run(self, seconds, act=True) -> None:
+        """
+        Serves every user's socket and fires every due action for a number of seconds, or only
+        serves the sockets if act is False.
+        """
+        end = time.monotonic() + seconds
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                return
+            timeout = end - now
+            if self.due and act:
+                timeout = max(0, min(timeout, self.due[0][0] - now))
+            for key, _ in self.selector.select(timeout):
+                if key.data.sock is not None:
+                    self.receive(key.data)
+            now = time.monotonic()
+            while act and self.due and self.due[0][0] <= now:
+                _, _, action, user = heapq.heappop(self.due)
+                self.act(user, action)
+                rate = float(self.options[LOAD_ACTIONS[action]])
+                heapq.heappush(self.due, (now + random.expovariate(rate), id(user), action, user))
+
+def process_tree(pid) -> list:
+    """
+    Returns:
+        list: The pid and the pids of every descendant, from /proc, e.g. a server's workers.
+    """
+    pids = [pid]
+    index = 0
+    while index < len(pids):
+        try:
+            for task in os.listdir(f"/proc/{pids[index]}/task"):
+                with open(f"/proc/{pids[index]}/task/{task}/children") as children:
+                    pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            pass
+        index += 1
+    return pids
+
+def process_usage(pids) -> dict:
+    """
+    Returns:
+        dict: The CPU seconds used so far, the resident and peak resident set sizes in bytes and
+        the number of threads, summed over the processes. Values that /proc does not provide are
+        None.
+    """
+    usage = {"cpu_seconds": 0.0, "rss_bytes": 0, "peak_rss_bytes": 0, "threads": 0}
+    ticks = os.sysconf("SC_CLK_TCK")
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as stat:
+                # the fields after the parenthesised command name, utime and stime are 14 and 15
+                fields = stat.read().rpartition(")")[2].split()
+            usage["cpu_seconds"] += (int(fields[11]) + int(fields[12])) / ticks
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        usage["rss_bytes"] += int(line.split()[1]) * 1024
+                    elif line.startswith("VmHWM:"):
+                        usage["peak_rss_bytes"] += int(line.split()[1]) * 1024
+                    elif line.startswith("Threads:"):
+                        usage["threads"] += int(line.split()[1])
+        except (OSError, IndexError, ValueError):
+            return dict.fromkeys(usage)
+    return usage
+
+def server_counters(admin_socket) -> dict:
+    """
+    Returns:
+        dict: The server's counters from a /stats over its admin socket, summed over its worker
+        processes, or an empty dict if the server cannot be asked.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.settimeout(5)
+            sock.connect(admin_socket)
+            sock.sendall(b"/stats\n")
+            reply = json.loads(sock.makefile().readline())
+    except (OSError, ValueError):
+        return {}
+    counters = {}
+    for metric in reply.get("data") or []:
+        for name, value in metric.items():
+            if isinstance(value, int):
+                counters[name] = counters.get(name, 0) + value
+    return counters
+
+def free_port() -> int:
+    """
+    Returns:
+        int: A port nothing listens on at the moment.
+    """
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+@contextlib.contextmanager
+def running_server(channels, args=()):
+    """
+    Starts a server on a configuration of the given channels, each on a port of its own, waits
+    until it accepts connections and shuts it down afterwards.
+    Args:
+        channels (list): The (name, capacity) of each channel, one or at least three of them.
+        args (list): The server's flags.
+    Yields:
+        tuple: The server process and the port of each channel by name.
+    """
+    ports = {name: free_port() for name, _ in channels}
+    with tempfile.TemporaryDirectory() as work:
+        config = os.path.join(work, "config.txt")
+        with open(config, "w") as out:
+            for name, capacity in channels:
+                out.write(f"channel {name} {ports[name]} {capacity}\n")
+        server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mchatserver.py")
+        server = subprocess.Popen([sys.executable, server_path, config, *args], stdin=subprocess.PIPE,
+                                  stdout=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    socket.create_connection(("localhost", ports[channels[0][0]])).close()
+                    break
+                except OSError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        print("the server did not start")
+                        sys.exit(1)
+                    time.sleep(0.05)
+            yield server, ports
+        finally:
+            try:
+                server.stdin.write(b"/shutdown\n")
+                server.stdin.flush()
+                server.wait(5)
+            except (OSError, subprocess.TimeoutExpired):
+                server.kill()
+
+class Peer:
+    """
+    A bare connection to a channel's port, for the benchmarks and checks that follow a handful
+    of clients message by message.
+    """
+
+    def __init__(self, port, username):
+        self.sock = socket.create_connection(("localhost", port))
+        self.decoder = FrameDecoder()
+        self.decoder.typed = True
+        self.sock.sendall(encode_frame(username))
+
+    def send(self, data) -> None:
+        """
+        Args:
+            data (str | bytes): A message to frame, or bytes to send as they are.
+        """
+        self.sock.sendall(encode_frame(data) if isinstance(data, str) else data)
+
+    def expect(self, text, timeout=5.0):
+        """
+        Reads messages until one contains text.
+        Returns:
+            str: The message, or None if none did within timeout seconds or the server closed
+            the connection.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            for frame in self.decoder:
+                message = frame.decode(errors="replace")
+                if text in message:
+                    return message
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(1 << 16)
+            except (socket.timeout, OSError):
+                return None
+            if not data:
+                return None
+            self.decoder.feed(data)
+
+    def close(self) -> None:
+        self.sock.close()
+
+def channel_name(index) -> str:
+    """
+    Returns:
+        str: An alphabetic channel name, as the server's configuration requires.
+    """
+    letters = ""
+    while True:
+        index, digit = divmod(index, 26)
+        letters = chr(ord("a") + digit) + letters
+        if not index:
+            return "load" + letters
+
+def parse_load_options(args) -> dict:
+    """
+    Parses the load benchmark's "--name=value" options.
+    Args:
+        args (list): The command line arguments after "load".
+    Returns:
+        dict: The options, with defaults filled in for any option not given.
+    Raises:
+        SystemExit: If an option is unknown or has an invalid value.
+    """
+    options = dict(LOAD_OPTIONS)
+    for arg in args:
+        name, sep, value = arg.partition("=")
+        name = name[2:]
+        if not arg.startswith("--") or not sep or name not in options:
+            sys.exit(1)
+        options[name] = value
+    try:
+        counts = [int(options[name]) for name in ("users", "per-channel", "capacity", "send-size", "coalesce",
+                                                  "chat-size")]
+        durations = [float(options[name]) for name in ("duration", "warmup")]
+        rates = [float(options[option]) for option in LOAD_ACTIONS.values()]
+    except ValueError:
+        sys.exit(1)
+    if min(counts[:3]) < 1 or counts[2] > mchatserver.MAX_LARGE_CAPACITY or min(counts[3:]) < 0:
+        sys.exit(1)
+    if durations[0] <= 0 or durations[1] < 0:
+        sys.exit(1)
+    try:
+        sizes = [int(size) for size in options["sizes"].split(",")]
+    except ValueError:
+        sys.exit(1)
+    if min(sizes) < 1 or max(sizes) > mchatserver.MAX_LARGE_CAPACITY:
+        sys.exit(1)
+    if min(rates) < 0:
+        sys.exit(1)
+    if options["payload"] not in PAYLOADS or (options["compress"] and options["compress"] not in CODECS):
+        sys.exit(1)
+    return options
+
+def load(options) -> dict:
+    """
+    Starts a server on a generated configuration, with every channel on one port, and drives
+    the simulated users against it: options["per-channel"] users ask for each channel, so more
+    users than its capacity keeps its queue busy. After the warmup, and once every user that fits
+    has been admitted, measures for the duration and prints the throughput, the delivery latency
+    of chat and whisper lines, the server's CPU time and memory, the write calls it made per
+    delivery, and the bytes the users received.
+    Args:
+        options (dict): The load benchmark's options.
+    Returns:
+        dict: The options and the results, as written to options["json"].
+    """
+    users = int(options["users"])
+    # the configuration parser rejects exactly two channels
+    channels = max(math.ceil(users / int(options["per-channel"])), 1)
+    if channels == 2:
+        channels = 3
+    names = [channel_name(index) for index in range(channels)]
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+
+    with tempfile.TemporaryDirectory() as work:
+        config = os.path.join(work, "config.txt")
+        with open(config, "w") as out:
+            coalesce = f" coalesce={options['coalesce']}" if int(options["coalesce"]) else ""
+            for index, name in enumerate(names):
+                # only the shared port is listened on
+                out.write(f"channel {name} {index + 1} {options['capacity']}{coalesce}\n")
+        payload = os.path.join(work, "payload.bin")
+        with open(payload, "wb") as out:
+            if options["payload"] == "text":
+                out.write(filler(int(options["send-size"])).encode())
+            else:
+                out.write(os.urandom(int(options["send-size"])))
+        server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mchatserver.py")
+        admin_socket = os.path.join(work, "admin.sock")
+        # the server only allows zlib unless told otherwise
+        codecs = [f"--compress={options['compress']}"] if options["compress"] else []
+        # and channels of up to 5
+        capacity = [f"--max-capacity={options['capacity']}"] if int(options["capacity"]) > 5 else []
+        server = subprocess.Popen([sys.executable, server_path, config, f"--listen-port={port}",
+                                   f"--admin-socket={admin_socket}", *codecs, *capacity,
+                                   *options["server-args"].split()],
+                                  stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    socket.create_connection(("localhost", port)).close()
+                    break
+                except OSError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        print("load: the server did not start")
+                        sys.exit(1)
+                    time.sleep(0.05)
+
+            run = LoadRun(options, port, names, payload)
+            now = time.monotonic()
+            for index in range(users):
+                user = SimUser(f"user{index}", names[index % channels], options["compress"] or None)
+                run.users.append(user)
+                run.connect(user)
+                run.schedule(user, now)
+            run.run(float(options["warmup"]))
+            # every join is announced to the members already in, filling a large channel outlasts the
+            # warmup; the users then hold off until it is full and the announcements have arrived
+            admissible = sum(min(users // channels + (index < users % channels), int(options["capacity"]))
+                             for index in range(channels))
+            if sum(map(len, run.members.values())) < admissible:
+                deadline = time.monotonic() + 10 + users / 10
+                while time.monotonic() < deadline:
+                    received = run.wire_bytes
+                    run.run(0.5, act=False)
+                    if sum(map(len, run.members.values())) >= admissible and run.wire_bytes == received:
+                        break
+                run.due.clear()
+                now = time.monotonic()
+                for user in run.users:
+                    run.schedule(user, now)
+
+            pids = process_tree(server.pid)
+            before = process_usage(pids)
+            counters_before = server_counters(admin_socket)
+            run.reset()
+            start = time.monotonic()
+            run.run(float(options["duration"]))
+            elapsed = time.monotonic() - start
+            after = process_usage(pids)
+            counters_after = server_counters(admin_socket)
+        finally:
+            try:
+                server.stdin.write(b"/shutdown\n")
+                server.stdin.flush()
+                server.wait(5)
+            except (OSError, subprocess.TimeoutExpired):
+                server.kill()
+
+    cpu = None if after["cpu_seconds"] is None else after["cpu_seconds"] - before["cpu_seconds"]
+    send_calls = None
+    if "server.send_calls" in counters_before and "server.send_calls" in counters_after:
+        send_calls = counters_after["server.send_calls"] - counters_before["server.send_calls"]
+    results = {
+        "elapsed": elapsed,
+        "channels": channels,
+        "members": sum(len(members) for members in run.members.values()),
+        "waiting": sum(user.sock is not None and not user.member for user in run.users),
+        "sent": run.sent,
+        "delivered": run.delivered,
+        "sent_per_second": sum(run.sent.values()) / elapsed,
+        "delivered_per_second": run.delivered / elapsed,
+        "latency_us": run.latency.snapshot(),
+        "file_bytes": run.file_bytes,
+        "wire_bytes": run.wire_bytes,
+        "wire_bytes_per_second": run.wire_bytes / elapsed,
+        "content_bytes": run.content_bytes,
+        "disconnects": run.disconnects,
+        "server_cpu_seconds": cpu,
+        "server_cpu_percent": None if cpu is None else cpu / elapsed * 100,
+        "server_rss_bytes": after["rss_bytes"],
+        "server_peak_rss_bytes": after["peak_rss_bytes"],
+        "server_send_calls": send_calls,
+        "send_calls_per_delivery": None if send_calls is None or not run.delivered else send_calls / run.delivered,
+    }
+    latency = results["latency_us"]
+    print(f"load: {users} users in {channels} channels ({results['members']} admitted, {results['waiting']} waiting), "
+          f"{elapsed:.1f}s: "
+          f"{results['sent_per_second']:.0f} actions/s, {results['delivered_per_second']:.0f} deliveries/s")
+    print(f"latency: p50 {latency['p50']}us, p99 {latency['p99']}us, p99.9 {latency['p999']}us, "
+          f"max {latency['max']}us over {latency['count']} deliveries")
+    if cpu is not None:
+        print(f"server: {results['server_cpu_percent']:.0f}% CPU, {results['server_rss_bytes'] >> 20} MiB resident "
+              f"(peak {results['server_peak_rss_bytes'] >> 20} MiB)")
+    if send_calls is not None:
+        print(f"writes: {send_calls} sendmsg calls, {results['send_calls_per_delivery']:.2f} per delivery")
+    print(f"received: {run.wire_bytes} bytes on the wire for {run.content_bytes} bytes of frames and files "
+          f"({run.file_bytes} bytes of files)")
+    report = {"options": options, "results": results}
+    if options["json"]:
+        with open(options["json"], "w") as out:
+            json.dump(report, out, indent=2)
+    return report
+
+def coalesce_cost(options) -> None:
+    """
+    Runs the load benchmark with coalescing off and then with options["coalesce"] milliseconds,
+    and prints how many write calls coalescing saves and what it costs in latency.
+    Args:
+        options (dict): The load benchmark's options.
+    """
+    if not int(options["coalesce"]):
+        options["coalesce"] = "5"
+    plain = load(dict(options, coalesce="0", json=""))["results"]
+    coalesced = load(dict(options, json=""))["results"]
+    if plain["send_calls_per_delivery"] and coalesced["send_calls_per_delivery"] is not None:
+        saved = 1 - coalesced["send_calls_per_delivery"] / plain["send_calls_per_delivery"]
+        print(f"coalesce={options['coalesce']}ms: {saved * 100:.0f}% fewer writes per delivery, "
+              f"p50 {plain['latency_us']['p50']} -> {coalesced['latency_us']['p50']}us, "
+              f"p99 {plain['latency_us']['p99']} -> {coalesced['latency_us']['p99']}us")
+    if options["json"]:
+        with open(options["json"], "w") as out:
+            json.dump({"options": options, "plain": plain, "coalesced": coalesced}, out, indent=2)
+
+def compress_cost(options) -> None:
+    """
+    Runs the load benchmark without compression and then with each codec, or only with
+    options["compress"] if one is given, and prints the bytes the users received, relative to
+    what those bytes hold, against the CPU time the server spent.
+    Args:
+        options (dict): The load benchmark's options.
+    """
+    codecs = [options["compress"]] if options["compress"] else list(CODECS)
+    runs = {"none": load(dict(options, compress="", json=""))["results"]}
+    for codec in codecs:
+        runs[codec] = load(dict(options, compress=codec, json=""))["results"]
+    for codec, results in runs.items():
+        ratio = results["wire_bytes"] / results["content_bytes"] if results["content_bytes"] else 0.0
+        cpu = results["server_cpu_seconds"]
+        cost = "n/a" if cpu is None else f"{cpu / max(results['content_bytes'], 1) * 1e9:.0f}ns"
+        print(f"compress {codec}: {results['wire_bytes_per_second'] / 1e6:.2f} MB/s on the wire, "
+              f"{ratio * 100:.0f}% of the content, server CPU {cost} per content byte, "
+              f"p99 {results['latency_us']['p99']}us")
+    if options["json"]:
+        with open(options["json"], "w") as out:
+            json.dump({"options": options, "runs": runs}, out, indent=2)
+
+def large_cost(options) -> None:
+    """
+    Runs the load benchmark on a single channel of each of options["sizes"] members, with the
+    server's fan-out workers off and then with four of them, and prints the delivery latency of
+    chat lines against the channel's size. options["chat-rate"] is the channel's messages per
+    second, shared by its members, so every size broadcasts at the same rate.
+    Args:
+        options (dict): The load benchmark's options.
+    """
+    runs = {}
+    for size in (int(size) for size in options["sizes"].split(",")):
+        sized = dict(options, users=str(size), capacity=str(size), json="")
+        sized["per-channel"] = str(size)
+        sized["chat-rate"] = str(float(options["chat-rate"]) / size)
+        for workers in ("0", "4"):
+            # a member of a large channel chats rarely, it must not go AFK while the channel fills
+            sized["server-args"] = f"{options['server-args']} --afk-timeout=3600 --fanout-workers={workers}"
+            results = load(sized)["results"]
+            runs[f"{size}/{workers}"] = results
+            latency = results["latency_us"]
+            print(f"large: {size} members, {workers} fan-out workers: p50 {latency['p50']}us, "
+                  f"p99 {latency['p99']}us, max {latency['max']}us, "
+                  f"{results['delivered_per_second']:.0f} deliveries/s")
+    if options["json"]:
+        with open(options["json"], "w") as out:
+            json.dump({"options": options, "runs": runs}, out, indent=2)
+
+def mode_cost(clients) -> None:
+    """
+    Connects clients to a server in each mode and prints its threads, resident memory and CPU
+    use while the clients sit idle.
+    Args:
+        clients (int): The number of clients, spread over three channels.
+    """
+    names = ["alpha", "beta", "gamma"]
+    capacity = -(-clients // len(names))
+    args = [f"--max-capacity={capacity}"] if capacity > 5 else []
+    for mode in ("threaded", "eventloop"):
+        with running_server([(name, capacity) for name in names], [f"--mode={mode}", *args]) as (server, ports):
+            peers = [Peer(ports[names[index % len(names)]], f"user{index}") for index in range(clients)]
+            registered = sum(peer.expect("Welcome", timeout=30) is not None for peer in peers)
+            time.sleep(0.5)
+            pids = process_tree(server.pid)
+            before = process_usage(pids)
+            start = time.monotonic()
+            time.sleep(3)
+            after = process_usage(pids)
+            idle = time.monotonic() - start
+            for peer in peers:
+                peer.close()
+        if after["cpu_seconds"] is None:
+            print(f"{mode}: {registered} clients, /proc unavailable")
+            continue
+        cpu = (after["cpu_seconds"] - before["cpu_seconds"]) / idle * 100
+        print(f"{mode}: {registered} clients, {after['threads']} threads, "
+              f"{after['rss_bytes'] / (1 << 20):.1f} MiB resident, idle CPU {cpu:.1f}%")
+
+def read_file_path(path, sock, report) -> None:
+    """
+    Sends a file the way /send used to: the whole file is read into memory and sent at once.
+    Runs in a forked child, so its memory is measured on its own.
+    Args:
+        path (str): The file.
+        sock (socket.socket): The connection to send it on.
+        report (int): A pipe to write the growth of the peak resident set size to, in bytes.
+    """
+    before = process_usage([os.getpid()])
+    with open(path, "rb") as file:
+        data = file.read()
+    sock.sendall(data)
+    after = process_usage([os.getpid()])
+    os.write(report, str(after["peak_rss_bytes"] - before["rss_bytes"]).encode())
+
+def sendfile_cost(mebibytes) -> None:
+    """
+    Sends a file of random bytes over /send to a bare reader in each server mode and prints the
+    throughput and how far the server's peak resident set grew. The same file read into memory
+    and sent with sendall, as /send did before streaming from disk, is the reference.
+    Args:
+        mebibytes (int): The size of the file in MiB.
+    """
+    size = mebibytes << 20
+    with tempfile.TemporaryDirectory() as work:
+        path = os.path.join(work, "payload.bin")
+        with open(path, "wb") as out:
+            for _ in range(mebibytes):
+                out.write(os.urandom(1 << 20))
+        for mode in ("threaded", "eventloop"):
+            with running_server([("alpha", 5), ("beta", 5), ("gamma", 5)], [f"--mode={mode}"]) as (server, ports):
+                sender = Peer(ports["alpha"], "sender")
+                reader = Peer(ports["alpha"], "reader")
+                sender.expect("Welcome")
+                reader.expect("Welcome")
+                pids = process_tree(server.pid)
+                before = process_usage(pids)
+                start = time.perf_counter()
+                sender.send(f"/send reader {path}")
+                # the bytes of the file follow the "/send" frame announcing it, unframed
+                header = reader.expect("/send ", timeout=30)
+                received = reader.decoder.take_into(memoryview(bytearray(min(size, reader.decoder.buffered()))))
+                reader.sock.settimeout(30)
+                while header is not None and received < size:
+                    data = reader.sock.recv(1 << 20)
+                    if not data:
+                        break
+                    received += len(data)
+                elapsed = time.perf_counter() - start
+                after = process_usage(pids)
+                sender.close()
+                reader.close()
+            growth = "n/a" if after["peak_rss_bytes"] is None else \
+                f"{(after['peak_rss_bytes'] - before['rss_bytes']) / (1 << 20):.1f} MiB"
+            print(f"sendfile {mode}: {received >> 20} of {mebibytes} MiB at {received / elapsed / 1e6:.0f} MB/s, "
+                  f"server peak RSS growth {growth}")
+        left, right = socket.socketpair()
+        report, report_to = os.pipe()
+        start = time.perf_counter()
+        child = os.fork()
+        if child == 0:
+            left.close()
+            read_file_path(path, right, report_to)
+            os._exit(0)
+        right.close()
+        os.close(report_to)
+        received = 0
+        while received < size:
+            data = left.recv(1 << 20)
+            if not data:
+                break
+            received += len(data)
+        elapsed = time.perf_counter() - start
+        growth = int(os.read(report, 64) or 0)
+        os.waitpid(child, 0)
+        os.close(report)
+        left.close()
+        print(f"read and sendall: {received >> 20} of {mebibytes} MiB at {received / elapsed / 1e6:.0f} MB/s, "
+              f"peak RSS growth {growth / (1 << 20):.1f} MiB")
+
+def admission_cost(waiting) -> None:
+    """
+    Fills a channel of capacity 5 and queues waiting more clients behind it, in each server mode.
+    Prints the server's CPU use while nobody says anything, and how long the queue takes to
+    refill the channel after every member leaves at once.
+    Args:
+        waiting (int): The number of clients queued behind the members, at least 5.
+    """
+    for mode in ("threaded", "eventloop"):
+        with running_server([("alpha", 5), ("beta", 5), ("gamma", 5)], [f"--mode={mode}"]) as (server, ports):
+            # one at a time, so the queue order is the order of the names
+            members, queued = [], []
+            for index in range(5 + waiting):
+                peer = Peer(ports["alpha"], f"member{index}" if index < 5 else f"queued{index - 5}")
+                peer.expect("Welcome")
+                (members if index < 5 else queued).append(peer)
+            time.sleep(0.5)
+            pids = process_tree(server.pid)
+            before = process_usage(pids)
+            start = time.monotonic()
+            time.sleep(3)
+            after = process_usage(pids)
+            idle = time.monotonic() - start
+            start = time.perf_counter()
+            for peer in members:
+                peer.send("/quit")
+            # the first five in the queue each see their own join announced
+            admitted = sum(peer.expect(f"queued{index} has joined the channel.") is not None
+                           for index, peer in enumerate(queued[:5]))
+            elapsed = time.perf_counter() - start
+            for peer in members + queued:
+                peer.close()
+        cpu = "n/a" if after["cpu_seconds"] is None else \
+            f"{(after['cpu_seconds'] - before['cpu_seconds']) / idle * 100:.1f}%"
+        print(f"admission {mode}: idle CPU {cpu} with 5 members and {waiting} waiting, "
+              f"{admitted} of 5 admitted {elapsed * 1000:.1f}ms after a mass leave "
+              f"({admitted / elapsed:.0f} admissions/s)")
+
+def malformed_check() -> None:
+    """
+    Sends a server frames it cannot decode, text and binary chat that is not UTF-8 and a binary
+    command with a field cut short, and checks each is answered with a notice while the
+    connection stays up, in both server modes. Exits with status 1 if not.
+    """
+    bad_frames = {
+        "text not UTF-8": encode_frame(b"\xff\xfe"),
+        "binary chat not UTF-8": HEADER.pack(3 | TYPED) + b"\x01\xff\xfe",
+        "binary whisper cut short": HEADER.pack(4 | TYPED) + b"\x07\x00\x09b",
+    }
+    failed = False
+    for mode in ("threaded", "eventloop"):
+        with running_server([("alpha", 5)], [f"--mode={mode}"]) as (_, ports):
+            peer = Peer(ports["alpha"], "ann")
+            peer.send("/protocol binary")
+            if peer.expect("/protocol ") != "/protocol binary":
+                print(f"malformed {mode}: binary mode was not agreed on")
+                sys.exit(1)
+            for label, frame in bad_frames.items():
+                try:
+                    peer.send(frame)
+                    notice = peer.expect("Malformed frame")
+                    peer.send(encode_command("chat", f"still here after {label}"))
+                    alive = peer.expect(f"still here after {label}") is not None
+                except OSError:
+                    notice, alive = None, False
+                failed |= notice is None or not alive
+                print(f"malformed {mode}: {label}: {'notice' if notice else 'no notice'}, "
+                      f"{'connected' if alive else 'disconnected'}")
+                if not alive:
+                    break
+            peer.close()
+    if failed:
+        sys.exit(1)
+
+def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "malformed":
+        malformed_check()
+        return
+    if len(sys.argv) >= 2 and sys.argv[1] in ("load", "coalesce", "compress", "large"):
+        options = parse_load_options(sys.argv[2:])
+        if sys.argv[1] == "coalesce":
+            coalesce_cost(options)
+        elif sys.argv[1] == "compress":
+            compress_cost(options)
+        elif sys.argv[1] == "large":
+            large_cost(options)
+        else:
+            load(options)
+        return
+    if len(sys.argv) >= 2 and sys.argv[1] in ("parse", "queue", "admission", "modes", "sendfile"):
+        try:
+            count = int(sys.argv[2]) if len(sys.argv) > 2 else \
+                {"parse": 100000, "queue": 10000, "admission": 50, "modes": 200, "sendfile": 256}[sys.argv[1]]
+        except ValueError:
+            sys.exit(1)
+        if count < 1 or (sys.argv[1] == "admission" and count < 5):
+            sys.exit(1)
+        if sys.argv[1] == "queue":
+            queue_cost(count)
+        elif sys.argv[1] == "admission":
+            admission_cost(count)
+        elif sys.argv[1] == "modes":
+            mode_cost(count)
+        elif sys.argv[1] == "sendfile":
+            sendfile_cost(count)
+        else:
+            parse_cost(count)
+        return
+    if len(sys.argv) < 2 or sys.argv[1] not in ("fanout", "log"):
+        print("Usage: python3 mchatbench.py fanout|log [recipients] [messages] [burst]\n"
+              "       python3 mchatbench.py parse [messages]\n"
+              "       python3 mchatbench.py queue [users]\n"
+              "       python3 mchatbench.py admission [waiting]\n"
+              "       python3 mchatbench.py modes [clients]\n"
+              "       python3 mchatbench.py sendfile [MiB]\n"
+              "       python3 mchatbench.py malformed\n"
+              "       python3 mchatbench.py load [--users=n] [--per-channel=n] [--capacity=n] [--duration=s] "
+              "[--warmup=s] [--chat-rate=r] [--whisper-rate=r] [--send-rate=r] [--send-size=bytes] "
+              "[--switch-rate=r] [--coalesce=ms] [--compress=codec] [--chat-size=bytes] [--payload=random|text] "
+              "[--sizes=n,...] [--server-args=args] [--json=path]\n"
+              "       python3 mchatbench.py coalesce|compress|large [load options]")
+        sys.exit(1)
+    try:
+        values = [int(arg) for arg in sys.argv[2:5]]
+    except ValueError:
+        sys.exit(1)
+    recipients, messages, burst = values + [100, 20000, 1][len(values):]
+    if recipients < 1 or messages < 1 or burst < 1:
+        sys.exit(1)
+    if sys.argv[1] == "log":
+        log_overhead(recipients, messages, burst)
+    else:
+        fanout(recipients, messages, burst)
+
+
+if __name__ == "__main__":
+    main()
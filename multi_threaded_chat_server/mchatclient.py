@@ -1,204 +1,468 @@
-import socket
-import threading
-import sys
-import os
-import time
-
-
-class User():
-    """
-    Holds the chatclient's client socket information. Used for interacting
-    with the connected server.
-    Status: Given
-    """
-
-    def __init__(self, username):
-        """
-        Initialise the user with a given username.
-        Args:
-            username (string): name of the client.
-        """
-        self.username = username
-        self.maxBuffer = 1024
-
-    def connect(self, port):
-        """
-        Initialise the socket connection as a TCP socket on localhost.
-        Args:
-            port (int): channel port to connect to.
-        """
-        # Connect to the port passed as a client
-        self.port = port
-        self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.soc.connect(("localhost", self.port))
-
-    def disconnect(self):
-        """
-        Close the socket connection.
-        """
-        self.soc.close()
-
-    def send(self, data):
-        """
-        Send the string to the socket encoded.
-        Args:
-            data (string): string to be sent to server.
-        Returns: False if a connection reset error occurred, or true on a successful send.
-        """
-        try:
-            self.soc.send(data.encode())
-            return True
-        except (ConnectionResetError, OSError):
-            return False
-
-    def receive(self):
-        """
-        Receive a string from the server. Keeps increasing the
-        size of the buffer holding the data until all data has
-        been received.
-        Returns:
-            string: message from the server.
-        """
-        buffer = bytearray()
-        while True:
-            try:
-                data = self.soc.recv(self.maxBuffer)
-            except (ConnectionResetError, OSError):  # Connection Reset
-                return None
-            buffer.extend(data)
-            size = sys.getsizeof(buffer)
-            if size > self.maxBuffer:
-                self.maxBuffer *= 2
-            else:
-                break
-        # Reset buffer limit
-        self.maxBuffer = 1024
-        return buffer.decode()
-
-    def get_username(self):
-        """
-        Get the username of this user.
-        Returns:
-            string: the username of this user.
-        """
-        return self.username
-
-def input_thread(quitEvent, user):
-    """
-    The input thread for the client, constantly takes in user input
-    from stdin and sends it to the server.
-    Status: Given
-    Args:
-        quitEvent (threading.Event): Event on which the user must exit.
-        user (User): the user object used by this chatclient.
-    """
-    while not quitEvent.is_set():
-        try:
-            message = input().strip()
-        except EOFError:
-            continue
-        if not user.send(message):  # ConnectionResetError occured
-            quitEvent.set()
-
-def output_thread(quitEvent, user):
-    """
-    The output thread handling responses from the server. Receives server
-    messages and handles them accordingly.
-    Status: TODO
-    Args:
-        quitEvent (threading.Event): Event on which the user must exit.
-        user (User): the user object used by this chatclient.
-    """
-    while not quitEvent.is_set():
-        output = user.receive()
-        if not output or output is None:  # Server has exited
-            quitEvent.set()
-            continue
-        # Write your code here...
-        # add elif block to handle instructions from server
-        # NOTE: some commands such as quit is directly sent over to the server
-        # server processes the command and closes then confirms to quit by sending
-        # a code/ message to the client and exits itself. The block of code you're
-        # going to add here is supposed to handle the message/code sent by the server
-        # and close the client as well. similarly for switch, and send!
-        elif output.startswith('/quit'):
-            quitEvent.set()
-            os._exit(1)
-        elif output.startswith('/switch'):
-            port = output.split()[1]
-            user.connect(int(port))
-            user.send(user.username)
-        elif output.startswith('/send'):
-            _, filename, file_size = output.split()
-            file_size = int(file_size)
-            data = user.receive()
-            with open(filename, 'w') as file:
-                file.write(data)
-            file.close()
-        else:
-            print(output, flush=True)  # Send output to stdout
-
-def validate_input(port, username):
-    """
-    Validate port and username properties, exit else.
-    Status: Given
-    Returns:
-        port (int): the port number to connect to.
-        username (string): the username of the client.
-    """
-    try:
-        port = int(port)
-        if (port < 1 or port > 65535):
-            sys.exit(1)
-    except ValueError:
-        sys.exit(1)
-
-    return port, username
-
-
-if __name__ == '__main__':
-    """
-    Main function processing of the chatclient. Creates user object and
-    threads and waits for them to finish.
-    """
-    try:
-        if len(sys.argv) != 3:
-            print("Usage: python mchatclient.py <port> <username>")
-            sys.exit(1)
-
-        port = sys.argv[1]
-        username = sys.argv[2]
-
-        port, username = validate_input(port, username)
-
-        # Create and connect the user
-        user = User(username)
-        try:
-            user.connect(int(port))
-            if not user.send(user.get_username()):
-                sys.exit(1)  # ConnectionResetError happened
-        except:
-            sys.exit(1)
-        # Event for when user types /quit
-        quitEvent = threading.Event()
-
-        # Initialize and begin reading and writing threads
-        inputThread = threading.Thread(
-            target=input_thread, args=(quitEvent, user,))
-        outputThread = threading.Thread(
-            target=output_thread, args=(quitEvent, user,))
-        inputThread.daemon = True
-        outputThread.daemon = True
-        try:
-            inputThread.start()
-            outputThread.start()
-        except:  # exit if threads can't be created
-            sys.exit(1)
-
-        # Wait for threads to complete before exiting the program
-        while not quitEvent.is_set():
-            continue
-        sys.exit(0)  # input thread is daemon and will exit itself
-    except KeyboardInterrupt:
-        print("Ctrl + C Pressed. Exiting...")
-        os._exit(0)
+import socket
+import threading
+import sys
+import os
+import mmap
+import hashlib
+from mchatprotocol import (CODECS, COMMANDS, COMPRESS_MIN, FrameDecoder, FrameError, encode_frame, read_frame,
+                           compress_frame, encode_command)
+
+# bytes of a received file mapped at a time, a multiple of the mapping granularity
+MAP_WINDOW = 1 << 24
+
+class User():
+    """
+    Holds the chatclient's client socket information. Used for interacting
+    with the connected server.
+    Status: Given
+    """
+
+    def __init__(self, username, channel=None, codecs=tuple(CODECS), binary=True):
+        """
+        Initialise the user with a given username.
+        Args:
+            username (string): name of the client.
+            channel (string): the channel to join, when the server serves
+            every channel on one port.
+            codecs (tuple): the compression codecs to offer the server, in
+            order of preference, or none to never compress.
+            binary (bool): whether to ask the server for the binary protocol.
+        """
+        self.username = username
+        self.channel = channel
+        self.codecs = codecs
+        # the codec agreed on with the server for the current connection
+        self.codec = None
+        self.offer_binary = binary
+        # whether the server agreed to binary frames on the current connection
+        self.binary = False
+        self.maxBuffer = 65536
+        # every send goes through it, the output thread sends too (a /switch
+        # handshake, a /received confirmation) while the input thread may be
+        self.send_lock = threading.RLock()
+        # unconfirmed transfers of this session, transfer id to filename
+        self.transfers = {}
+
+    def connect(self, port):
+        """
+        Initialise the socket connection as a TCP socket on localhost.
+        Args:
+            port (int): channel port to connect to.
+        """
+        # Connect to the port passed as a client
+        self.port = port
+        self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.soc.connect(("localhost", self.port))
+        self.decoder = FrameDecoder()
+        self.codec = None
+        self.binary = False
+
+    def disconnect(self):
+        """
+        Shut the socket connection down and close it.
+        """
+        try:
+            self.soc.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.soc.close()
+
+    def send(self, data):
+        """
+        Send the string to the socket encoded as one frame, compressed if a
+        codec was agreed on and the frame is long enough to be worth it.
+        Args:
+            data (string): string to be sent to server.
+        Returns: False if a connection reset error occurred, or true on a successful send.
+        """
+        with self.send_lock:
+            frame = self.encode_line(data) if self.binary else encode_frame(data)
+            if self.codec is not None and len(frame) >= COMPRESS_MIN:
+                frame = compress_frame(frame, self.codec)
+            try:
+                self.soc.sendall(frame)
+                return True
+            except (ConnectionResetError, OSError):
+                return False
+
+    def encode_line(self, line):
+        """
+        Turn a line typed by the user into a binary frame: a command if it
+        starts with "/" and names one with the right fields, and chat
+        otherwise. A line starting with "//" is chat starting with "/".
+        A command that does not fit its fields is sent as text, so the
+        server answers it with the usage as usual.
+        Args:
+            line (string): the line to send.
+        Returns:
+            bytes: the frame.
+        """
+        if line.startswith("//"):
+            return encode_command("chat", line[1:])
+        if not line.startswith("/"):
+            return encode_command("chat", line)
+        name, _, rest = line[1:].partition(" ")
+        kinds = COMMANDS.get(name, (None, None))[1]
+        if kinds is None or name == "chat":
+            return encode_command("chat", line)
+        fields = rest.split(None, len(kinds) - 1) if kinds else []
+        if kinds.endswith("t") and len(fields) == len(kinds) - 1:
+            fields.append("")
+        if len(fields) != len(kinds) or (not kinds and rest.strip()):
+            return encode_frame(line)
+        if any(kind == "s" and len(field.split()) != 1 for kind, field in zip(kinds, fields)):
+            return encode_frame(line)
+        if "q" in kinds:
+            if not all(field.isdigit() for kind, field in zip(kinds, fields) if kind == "q"):
+                return encode_frame(line)
+            fields = [int(field) if kind == "q" else field for kind, field in zip(kinds, fields)]
+        return encode_command(name, *fields)
+
+    def receive(self):
+        """
+        Receive one message from the server. Frames left over from an
+        earlier recv are returned before reading from the socket again.
+        Returns:
+            string: message from the server, or None if the connection closed.
+        """
+        try:
+            frame = read_frame(self.soc, self.decoder, self.maxBuffer)
+        except (ConnectionResetError, OSError, FrameError):  # Connection Reset
+            return None
+        if frame is None:
+            return None
+        return frame.decode()
+
+    def receive_file(self, filename, size, transfer_id, offset):
+        """
+        Receive the unframed bytes following a /send message, i.e. the file
+        content from offset to size, straight into a file. The file is
+        preallocated and memory-mapped one window at a time, and the socket
+        reads into the mapping, so memory use does not grow with the file.
+        Progress is recorded in a "<filename>.transfer" file after every
+        window, so an interrupted transfer can be resumed with /resume.
+        Args:
+            filename (string): the file to write.
+            size (int): the size of the whole file.
+            transfer_id (string): the server's id for the transfer.
+            offset (int): the number of bytes this client already has.
+        Returns:
+            bool: True once all bytes arrived, False if the connection closed
+            first. The file then holds only the bytes that did arrive.
+        """
+        self.transfers[transfer_id] = filename
+        self.save_progress(filename, transfer_id, size, offset)
+        with open(filename, 'rb+' if offset and os.path.exists(filename) else 'wb+') as file:
+            if offset == size:
+                return True
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(file.fileno(), offset, size - offset)
+                except OSError:  # not supported by the filesystem
+                    pass
+            os.ftruncate(file.fileno(), size)
+            received = offset
+            while received < size:
+                # mappings have to start on a granularity boundary
+                start = received - received % mmap.ALLOCATIONGRANULARITY
+                length = min(MAP_WINDOW, size - start)
+                with mmap.mmap(file.fileno(), length, offset=start) as mapping, memoryview(mapping) as view:
+                    received += self.decoder.take_into(view[received - start:])
+                    while received < start + length:
+                        try:
+                            count = self.soc.recv_into(view[received - start:])
+                        except (ConnectionResetError, OSError):  # Connection Reset
+                            break
+                        if not count:
+                            break
+                        received += count
+                self.save_progress(filename, transfer_id, size, received)
+                if received < start + length:
+                    break
+            if received < size:
+                os.ftruncate(file.fileno(), received)
+                return False
+        return True
+
+    def receive_chunks(self, filename, size, transfer_id, offset):
+        """
+        Receive a file sent compressed, i.e. the frames of up to a chunk of
+        content each following a "/send" message that names the codec, and
+        write them into the file from offset. The frames are decompressed by
+        the decoder, and progress is recorded after every one, as for
+        receive_file.
+        Args:
+            filename (string): the file to write.
+            size (int): the size of the whole file.
+            transfer_id (string): the server's id for the transfer.
+            offset (int): where the server resumes the file, at most the
+            number of bytes this client already has.
+        Returns:
+            bool: True once all bytes arrived, False if the connection closed first.
+        """
+        self.transfers[transfer_id] = filename
+        self.save_progress(filename, transfer_id, size, offset)
+        with open(filename, 'rb+' if offset and os.path.exists(filename) else 'wb+') as file:
+            file.seek(offset)
+            received = offset
+            while received < size:
+                try:
+                    chunk = read_frame(self.soc, self.decoder, self.maxBuffer)
+                except (ConnectionResetError, OSError, FrameError):  # Connection Reset
+                    chunk = None
+                if chunk is None:
+                    break
+                file.write(chunk)
+                received += len(chunk)
+                self.save_progress(filename, transfer_id, size, received)
+            file.truncate(received)
+        return received >= size
+
+    def save_progress(self, filename, transfer_id, size, received):
+        """
+        Record how much of a transfer has been received.
+        """
+        with open(f"{filename}.transfer", 'w') as progress:
+            progress.write(f"{transfer_id} {size} {received}\n")
+
+    def verify_file(self, transfer_id, checksum):
+        """
+        Check a received file against the checksum sent after it, and
+        report the result to the server. A corrupt file is requested
+        again from the start.
+        Args:
+            transfer_id (string): the server's id for the transfer.
+            checksum (string): the SHA-256 of the file, as the server read it.
+        """
+        filename = self.transfers.get(transfer_id)
+        if filename is None:
+            return
+        with open(filename, 'rb') as file:
+            digest = hashlib.file_digest(file, 'sha256').hexdigest()
+        self.send(f"/received {transfer_id} {digest}")
+        if digest == checksum:
+            del self.transfers[transfer_id]
+            os.remove(f"{filename}.transfer")
+        else:
+            print(f"{filename} is corrupt, receiving it again.", flush=True)
+            self.send(f"/resume {transfer_id} 0")
+
+    def resume_request(self, message):
+        """
+        Turn "/resume <filename>" into a request for the rest of that
+        file, from the progress recorded while it was being received.
+        Args:
+            message (string): the command typed by the user.
+        Returns:
+            string: the message to send to the server.
+        """
+        split_message = message.split()
+        if len(split_message) != 2:
+            return message
+        try:
+            with open(f"{split_message[1]}.transfer") as progress:
+                transfer_id, _, received = progress.read().split()
+        except (OSError, ValueError):
+            return message
+        self.transfers[transfer_id] = split_message[1]
+        return f"/resume {transfer_id} {received}"
+
+    def get_username(self):
+        """
+        Get the username of this user.
+        Returns:
+            string: the username of this user.
+        """
+        return self.username
+
+    def offer_compression(self):
+        """
+        Offer the server the codecs this user can decompress, sent right
+        after the handshake. Nothing is compressed until the server replies
+        with "/compress <codec>".
+        Returns:
+            bool: False if a connection reset error occurred, or true otherwise.
+        """
+        if not self.codecs:
+            return True
+        return self.send(f"/compress {' '.join(self.codecs)}")
+
+    def offer_protocol(self):
+        """
+        Ask the server for the binary protocol, sent right after the
+        handshake. Lines are sent as text until the server replies with
+        "/protocol binary".
+        Returns:
+            bool: False if a connection reset error occurred, or true otherwise.
+        """
+        if not self.offer_binary:
+            return True
+        return self.send("/protocol binary")
+
+    def set_protocol(self, protocol):
+        """
+        Args:
+            protocol (string): the protocol named in the server's "/protocol" reply.
+        """
+        with self.send_lock:
+            self.binary = protocol == "binary"
+
+    def set_codec(self, codec):
+        """
+        Start compressing with the codec the server agreed on, "none" for no compression.
+        Args:
+            codec (string): the codec named in the server's "/compress" reply.
+        """
+        with self.send_lock:
+            self.codec = codec if codec in CODECS else None
+        self.decoder.codec = self.codec
+
+    def get_handshake(self):
+        """
+        Get the first message to send after connecting: the username, or
+        "<username> <channel>" for a server serving every channel on one port.
+        Returns:
+            string: the handshake for the current channel.
+        """
+        if self.channel is None:
+            return self.username
+        return f"{self.username} {self.channel}"
+
+def input_thread(quitEvent, user):
+    """
+    The input thread for the client, constantly takes in user input
+    from stdin and sends it to the server.
+    Status: Given
+    Args:
+        quitEvent (threading.Event): Event on which the user must exit.
+        user (User): the user object used by this chatclient.
+    """
+    while not quitEvent.is_set():
+        try:
+            message = input().strip()
+        except EOFError:
+            continue
+        if message.startswith('/resume'):
+            message = user.resume_request(message)
+        if not user.send(message):  # ConnectionResetError occured
+            quitEvent.set()
+
+def output_thread(quitEvent, user):
+    """
+    The output thread handling responses from the server. Receives server
+    messages and handles them accordingly.
+    Status: TODO
+    Args:
+        quitEvent (threading.Event): Event on which the user must exit.
+        user (User): the user object used by this chatclient.
+    """
+    while not quitEvent.is_set():
+        output = user.receive()
+        if not output or output is None:  # Server has exited
+            quitEvent.set()
+            continue
+        # Write your code here...
+        # add elif block to handle instructions from server
+        # NOTE: some commands such as quit is directly sent over to the server
+        # server processes the command and closes then confirms to quit by sending
+        # a code/ message to the client and exits itself. The block of code you're
+        # going to add here is supposed to handle the message/code sent by the server
+        # and close the client as well. similarly for switch, and send!
+        elif output.startswith('/quit'):
+            quitEvent.set()
+            os._exit(1)
+        elif output.startswith('/switch'):
+            # "/switch <port>", or "/switch <port> <channel>" on a shared port
+            split_output = output.split()
+            # held until the handshake is out, so the input thread sends nothing
+            # on the new connection ahead of it
+            with user.send_lock:
+                user.channel = split_output[2] if len(split_output) > 2 else None
+                # the old connection is done with, it is not left open until exit
+                user.disconnect()
+                user.connect(int(split_output[1]))
+                user.send(user.get_handshake())
+                user.offer_compression()
+                user.offer_protocol()
+        elif output.startswith('/compress'):
+            user.set_codec(output.split()[1])
+        elif output.startswith('/protocol'):
+            user.set_protocol(output.split()[1])
+        elif output.startswith('/send'):
+            # "/send <filename> <size> <id> <offset>", with the codec at the end when compressed
+            split_output = output.split()
+            _, filename, file_size, transfer_id, offset = split_output[:5]
+            receive = user.receive_chunks if len(split_output) > 5 else user.receive_file
+            if not receive(filename, int(file_size), transfer_id, int(offset)):  # Server has exited
+                quitEvent.set()
+        elif output.startswith('/sent'):
+            _, transfer_id, checksum = output.split()
+            user.verify_file(transfer_id, checksum)
+        else:
+            print(output, flush=True)  # Send output to stdout
+
+def validate_input(port, username):
+    """
+    Validate port and username properties, exit else.
+    Status: Given
+    Returns:
+        port (int): the port number to connect to.
+        username (string): the username of the client.
+    """
+    try:
+        port = int(port)
+        if (port < 1 or port > 65535):
+            sys.exit(1)
+    except ValueError:
+        sys.exit(1)
+
+    return port, username
+
+
+if __name__ == '__main__':
+    """
+    Main function processing of the chatclient. Creates user object and
+    threads and waits for them to finish.
+    """
+    try:
+        if len(sys.argv) not in (3, 4):
+            print("Usage: python mchatclient.py <port> <username> [channel]")
+            sys.exit(1)
+
+        port = sys.argv[1]
+        username = sys.argv[2]
+        channel = sys.argv[3] if len(sys.argv) == 4 else None
+
+        port, username = validate_input(port, username)
+
+        # Create and connect the user
+        user = User(username, channel)
+        try:
+            user.connect(int(port))
+            if not user.send(user.get_handshake()) or not user.offer_compression() or not user.offer_protocol():
+                sys.exit(1)  # ConnectionResetError happened
+        except:
+            sys.exit(1)
+        # Event for when user types /quit
+        quitEvent = threading.Event()
+
+        # Initialize and begin reading and writing threads
+        inputThread = threading.Thread(
+            target=input_thread, args=(quitEvent, user,))
+        outputThread = threading.Thread(
+            target=output_thread, args=(quitEvent, user,))
+        inputThread.daemon = True
+        outputThread.daemon = True
+        try:
+            inputThread.start()
+            outputThread.start()
+        except:  # exit if threads can't be created
+            sys.exit(1)
+
+        # Wait for threads to complete before exiting the program
+        while not quitEvent.is_set():
+            continue
+        sys.exit(0)  # input thread is daemon and will exit itself
+    except KeyboardInterrupt:
+        print("Ctrl + C Pressed. Exiting...")
+        os._exit(0)
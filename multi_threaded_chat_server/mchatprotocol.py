@@ -0,0 +1,270 @@
+import struct
+import zlib
+import bz2
+import lzma
+
+
+# Every message on the wire is a 4 byte big-endian payload length followed by the payload.
+# The only exception is a file transfer: the "/send <filename> <size>" frame is followed by
+# exactly <size> raw, unframed bytes of file content.
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 1 << 20
+
+# After "/compress <codec>" has been agreed on, the top bit of a length header marks a payload
+# compressed with that codec, on its own so it can be decompressed without the frames before it.
+# A "/send" frame ending in the codec's name is then followed by the file as frames of up to
+# COMPRESS_CHUNK bytes, instead of raw bytes.
+COMPRESSED = 1 << 31
+COMPRESS_CHUNK = 1 << 16
+# frames smaller than this are not worth compressing
+COMPRESS_MIN = 512
+# each codec's one-shot compress function and decompressor type, in order of preference
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompressobj),
+    "bz2": (bz2.compress, bz2.BZ2Decompressor),
+    "lzma": (lzma.compress, lzma.LZMADecompressor),
+}
+
+# After "/protocol binary" has been agreed on, the second bit of a length header marks a binary
+# frame: a one byte opcode followed by the command's fields, so chat is its own frame type and
+# never taken for a command. Text frames are still accepted alongside.
+TYPED = 1 << 30
+# each binary command's opcode and fields: "s" is a string prefixed with its 2 byte length, "q"
+# an 8 byte unsigned integer and "t" a string running to the end of the frame
+COMMANDS = {
+    "chat": (0x01, "t"),
+    "quit": (0x02, ""),
+    "send": (0x03, "ss"),
+    "resume": (0x04, "sq"),
+    "received": (0x05, "ss"),
+    "list": (0x06, ""),
+    "whisper": (0x07, "ss"),
+    "switch": (0x08, "s"),
+    "compress": (0x09, "t"),
+}
+OPCODES = {opcode: (name, fields) for name, (opcode, fields) in COMMANDS.items()}
+FIELD = struct.Struct("!H")
+NUMBER = struct.Struct("!Q")
+
+
+class FrameError(ValueError):
+    """
+    Raised when the peer announces a frame larger than MAX_FRAME_SIZE, or sends a compressed
+    frame that does not decompress.
+    """
+
+
+def encode_frame(payload) -> bytes:
+    """
+    Prefix a payload with its length header.
+    Args:
+        payload (bytes | str): the payload, strings are UTF-8 encoded.
+    Returns:
+        bytes: the framed payload, ready to be written to a socket.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    return HEADER.pack(len(payload)) + payload
+
+
+def compress_frame(frame, codec) -> bytes:
+    """
+    Compress a frame's payload on its own.
+    Args:
+        frame (bytes): the frame, as made by encode_frame or encode_command.
+        codec (str): one of CODECS.
+    Returns:
+        bytes: the compressed frame, or frame itself if compressing does not make it smaller.
+    """
+    packed = CODECS[codec][0](memoryview(frame)[HEADER.size:])
+    if len(packed) + HEADER.size >= len(frame):
+        return frame
+    (length,) = HEADER.unpack_from(frame)
+    return HEADER.pack(len(packed) | COMPRESSED | length & TYPED) + packed
+
+
+class BinaryFrame(bytes):
+    """
+    The payload of a binary frame, as returned by FrameDecoder, for decode_command.
+    """
+
+
+def encode_command(name, *fields) -> bytes:
+    """
+    Frame a command for binary mode.
+    Args:
+        name (str): one of COMMANDS.
+        fields: the command's fields, str for "s" and "t" fields and int for "q" ones.
+    Returns:
+        bytes: the binary frame.
+    Raises:
+        ValueError: if the fields do not match the command's, or a string is too long.
+    """
+    opcode, kinds = COMMANDS[name]
+    if len(fields) != len(kinds):
+        raise ValueError(f"{name} takes {len(kinds)} field(s)")
+    parts = [bytes((opcode,))]
+    for kind, value in zip(kinds, fields):
+        if kind == "q":
+            parts.append(NUMBER.pack(value))
+            continue
+        data = value.encode()
+        if kind == "s":
+            parts.append(FIELD.pack(len(data)))
+        parts.append(data)
+    payload = b"".join(parts)
+    return HEADER.pack(len(payload) | TYPED) + payload
+
+
+def decode_command(payload):
+    """
+    Unpack the opcode and fields of a binary frame.
+    Args:
+        payload (bytes): the frame's payload.
+    Returns:
+        tuple: the command's name and the list of its fields.
+    Raises:
+        FrameError: if the opcode is unknown or the fields do not match it.
+    """
+    command = OPCODES.get(payload[0]) if payload else None
+    if command is None:
+        raise FrameError("unknown opcode")
+    name, kinds = command
+    fields = []
+    offset = 1
+    size = len(payload)
+    try:
+        for kind in kinds:
+            if kind == "s":
+                start = offset + FIELD.size
+                offset = start + (payload[offset] << 8 | payload[offset + 1])
+            elif kind == "q":
+                fields.append(NUMBER.unpack_from(payload, offset)[0])
+                offset += NUMBER.size
+                continue
+            else:
+                start, offset = offset, size
+            if offset > size:
+                raise FrameError(f"{name} field cut short")
+            fields.append(payload[start:offset].decode())
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise FrameError(f"malformed {name}: {e}")
+    if offset != size:
+        raise FrameError(f"{name} has trailing bytes")
+    return name, fields
+
+
+class FrameDecoder():
+    """
+    Incremental decoder for the framed protocol. Bytes from any number of
+    recv calls are fed in, and complete frames are taken out one at a time,
+    so a single recv holding several frames (or half of one) is handled.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+        # the codec compressed frames are decompressed with, once one has been agreed on
+        self.codec = None
+        # whether binary frames are accepted, once binary mode has been agreed on
+        self.typed = False
+
+    def feed(self, data):
+        """
+        Append bytes read from the socket.
+        Args:
+            data (bytes): the bytes that were received.
+        """
+        if self.offset and self.offset >= len(self.buffer) // 2:
+            # drop consumed bytes before growing the buffer
+            del self.buffer[:self.offset]
+            self.offset = 0
+        self.buffer += data
+
+    def buffered(self) -> int:
+        """
+        Returns:
+            int: the number of received bytes not yet taken out of the decoder.
+        """
+        return len(self.buffer) - self.offset
+
+    def next_frame(self):
+        """
+        Take the next complete frame out of the buffer.
+        Returns:
+            bytes: the frame payload, decompressed, or None if no complete frame is buffered.
+            The payload of a binary frame is a BinaryFrame.
+        Raises:
+            FrameError: if the announced frame length exceeds MAX_FRAME_SIZE, or a compressed
+            or binary frame is not valid.
+        """
+        if self.buffered() < HEADER.size:
+            return None
+        (length,) = HEADER.unpack_from(self.buffer, self.offset)
+        compressed = length & COMPRESSED
+        typed = length & TYPED
+        length &= ~(COMPRESSED | TYPED)
+        if length > MAX_FRAME_SIZE:
+            raise FrameError(f"frame of {length} bytes exceeds {MAX_FRAME_SIZE}")
+        if compressed and self.codec is None:
+            raise FrameError("compressed frame before a codec was agreed on")
+        if typed and not self.typed:
+            raise FrameError("binary frame before binary mode was agreed on")
+        start = self.offset + HEADER.size
+        if len(self.buffer) - start < length:
+            return None
+        self.offset = start + length
+        if typed:
+            payload = BinaryFrame(self.buffer[start:self.offset])
+        else:
+            payload = bytes(self.buffer[start:self.offset])
+        if not compressed:
+            return payload
+        decompressor = CODECS[self.codec][1]()
+        try:
+            payload = decompressor.decompress(payload, MAX_FRAME_SIZE + 1)
+        except (zlib.error, lzma.LZMAError, OSError, EOFError) as e:
+            raise FrameError(f"compressed frame does not decompress: {e}")
+        if len(payload) > MAX_FRAME_SIZE or not decompressor.eof:
+            raise FrameError(f"compressed frame exceeds {MAX_FRAME_SIZE} bytes or is cut short")
+        return BinaryFrame(payload) if typed else payload
+
+    def __iter__(self):
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame
+            frame = self.next_frame()
+
+    def take_into(self, view) -> int:
+        """
+        Move up to len(view) raw (unframed) bytes out of the buffer into view,
+        used for the file content that follows a "/send" frame.
+        Args:
+            view (memoryview): the writable destination, e.g. a slice of a mapped file.
+        Returns:
+            int: the number of bytes copied, possibly 0.
+        """
+        count = min(len(view), self.buffered())
+        view[:count] = memoryview(self.buffer)[self.offset:self.offset + count]
+        self.offset += count
+        return count
+
+
+def read_frame(sock, decoder, bufsize=65536):
+    """
+    Block until a complete frame has been received on a socket.
+    Args:
+        sock (socket.socket): the socket to read from.
+        decoder (FrameDecoder): the decoder holding bytes already received on sock.
+        bufsize (int): the maximum number of bytes to read per recv call.
+    Returns:
+        bytes: the frame payload, or None if the peer closed the connection first.
+    """
+    frame = decoder.next_frame()
+    while frame is None:
+        data = sock.recv(bufsize)
+        if not data:
+            return None
+        decoder.feed(data)
+        frame = decoder.next_frame()
+    return frame
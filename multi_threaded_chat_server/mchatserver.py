@@ -1,824 +1,4143 @@
-import socket
-import threading
-import sys
-import time
-import queue
-import os
-
-
-class Client:
-    def __init__(self, username, connection, address):
-        self.username = username
-        self.connection = connection
-        self.address = address
-        self.kicked = False
-        self.in_queue = True
-        self.remaining_time = 100 # remaining time before AFK
-        self.muted = False
-        self.mute_duration = 0
-
-class Channel:
-    def __init__(self, name, port, capacity):
-        self.name = name
-        self.port = port
-        self.capacity = capacity
-        self.queue = queue.Queue()
-        self.clients = []
-
-def parse_config(config_file: str) -> list:
-    """
-    Parses lines from a given configuration file and VALIDATE the format of each line. The 
-    function validates each part and if valid returns a list of tuples where each tuple contains
-    (channel_name, channel_port, channel_capacity). The function also ensures that there are no 
-    duplicate channel names or ports. if not valid, exit with status code 1.
-    Status: TODO
-    Args:
-        config_file (str): The path to the configuration file (e.g, config_01.txt).
-    Returns:
-        list: A list of tuples where each tuple contains:
-        (channel_name, channel_port, and channel_capacity)
-    Raises:
-        SystemExit: If there is an error in the configuration file format.
-    """
-    # Write your code here...
-    # try open file
-    try: 
-        with open(config_file, "r") as file:
-            # Read all lines from the file and strip whitespace characters
-            lines = [line.strip().split() for line in file]
-            c_name = 1
-            port = 2
-            capacity = 3
-            config = []
-            c_name_check = []
-            port_check = []
-
-            for line in lines:
-                if len(line) != 4:
-                    # print("bad length")
-                    file.close()
-                    sys.exit(1)
-                elif line[0] == "channel":
-                    if not line[c_name].isalpha():
-                        # print("name not str")
-                        file.close()
-                        sys.exit(1)
-                    elif not line[port].isdigit():
-                        # print("port not digit")
-                        file.close()
-                        sys.exit(1)
-                    elif not line[capacity].isdigit():
-                        # print("capacity not digit")
-                        file.close()
-                        sys.exit(1)
-                    elif int(line[capacity]) < 1 or int(line[capacity]) > 5:
-                        # print("capacity < 1 or > 5")
-                        file.close()
-                        sys.exit(1)
-                    if line[c_name] in c_name_check:
-                        # dup name
-                        file.close()
-                        sys.exit(1)
-                    c_name_check.append(line[c_name])
-                    if line[port] in port_check:
-                        # Exit if the port number already exists
-                        file.close()
-                        sys.exit(1)
-                    port_check.append(line[port])
-                    # Append the validated configuration to the config list
-                    new_config = (line[1], int(line[2]), int(line[3]))
-                    config.append(new_config)
-        file.close()
-        if len(port_check) == 2:
-            sys.exit(1)
-    
-    except FileNotFoundError:
-        # print("file not found")
-        file.close()
-        sys.exit(1)
-    except IOError:
-        # print("io error")
-        file.close()
-        sys.exit(1)
-    # Return the processed lines
-    return config
-
-def get_channels_dictionary(parsed_lines) -> dict:
-    """
-    Creates a dictionary of Channel objects from parsed lines.
-    Status: Given
-    Args:
-        parsed_lines (list): A list of tuples where each tuple contains:
-        (channel_name, channel_port, and channel_capacity)
-    Returns:
-        dict: A dictionary of Channel objects where the key is the channel name.
-    """
-    channels = {}
-
-    for channel_name, channel_port, channel_capacity in parsed_lines:
-        channels[channel_name] = Channel(channel_name, channel_port, channel_capacity)
-
-    return channels
-
-def quit_client(client, channel) -> None:
-    """
-    Implement client quitting function
-    Status: TODO
-    """
-    # if client is in queue
-    if client.in_queue:
-        # Write your code here...
-        # remove, close connection, and print quit message in the server.
-        channel.queue = remove_item(channel.queue, client)
-
-    # if client is in channel
-    if client in channel.clients:
-        # Write your code here...
-        # remove client from the channel, close connection, and broadcast quit message to all clients.
-        channel.clients.remove(client)
-    left_msg = f'[Server message ({time.strftime("%H:%M:%S")})] {client.username} has left the channel.'
-    for cl in channel.clients:
-        cl.connection.send(left_msg.encode())
-    client.connection.close()
-    
-def send_client(client, channel, msg) -> None:
-    """
-    Implement file sending function, if args for /send are valid.
-    Else print appropriate message and return.
-    Status: TODO
-    """
-    # Write your code here...
-    # if in queue, do nothing
-    if client.in_queue:
-        return
-    else:
-        # if muted, send mute message to the client
-        if client.muted:
-            mute_msg = f"[Server message ({time.strftime("%H:%M:%S")})] You are still muted for {client.mute_duration} seconds."
-            client.connection.send(mute_msg.encode())
-            return
-        # if not muted, process the file sending
-        else:
-            # validate the command structure
-            split_msg = msg.split()
-            if len(split_msg) != 3:
-                usage_msg = f"[Server message ({time.strftime("%H:%M:%S")})] Usage /send <target> <file path>."
-                client.connection.send(usage_msg.encode())
-                return
-            target_username = split_msg[1]
-            target_file_path = split_msg[2]
-
-            send_success_msg_client = f"[Server message ({time.strftime("%H:%M:%S")})] You sent {split_msg[2]} to {split_msg[1]}."
-            send_success_msg_server = f"[Server message ({time.strftime("%H:%M:%S")})] {client.username} sent {split_msg[2]} to {split_msg[1]}."
-            non_exist_msg = f"[Server message ({time.strftime("%H:%M:%S")})] {split_msg[1]} is not here."
-            invalid_msg = f"[Server message ({time.strftime("%H:%M:%S")})] {split_msg[2]} does not exist."
-            # check for target existance
-            target_exist = False
-            for c in channel.clients:
-                if c.username == target_username:
-                    target_exist = True
-                    target = c
-            if not target_exist:
-                client.connection.send(non_exist_msg.encode())
-
-            # check for file existence
-            file_exist = True
-            if not os.path.isfile(target_file_path):
-                file_exist = False
-                client.connection.send(invalid_msg.encode())
-            
-            # check if receiver is in the channel, and send the file
-            if target_exist and file_exist:
-                with open(target_file_path, "rb") as file:
-                    data = file.read()  
-                filename = os.path.basename(target_file_path)
-                file_size = os.path.getsize(target_file_path)
-                init_msg = f"/send {filename} {file_size}"
-                target.connection.sendall(init_msg.encode())
-                target.connection.sendall(data)
-                file.close() 
-                print(send_success_msg_server)
-                client.connection.send(send_success_msg_client.encode())
-
-def list_clients(client, channels) -> None:
-    """
-    List all channels and their capacity
-    Status: TODO
-    """
-    # Write your code here...
-    #[ Channel] < channel_name > <channel_port> Capacity: <current >/ < capacity >,Queue: < in_queue>
-    for channel in channels.values():
-        msg = f"[Channel] {channel.name} {channel.port} Capacity: {len(channel.clients)}/ {channel.capacity}, Queue: {channel.queue.qsize()}."
-        client.connection.send(msg.encode())
-
-def whisper_client(client, channel, msg) -> None:
-    """
-    Implement whisper function, if args for /whisper are valid.
-    Else print appropriate message and return.
-    Status: TODO
-    """
-    # Write your code here...
-    # if in queue, do nothing
-    if client.in_queue:
-        return
-    else:
-        # if muted, send mute message to the client
-        if client.muted:
-            pass
-        else:
-            # validate the command structure
-            split_msg = msg.split()
-            if len(split_msg) != 3:
-                usage_msg = f"[Server message ({time.strftime("%H:%M:%S")})] Usage /whisper <username> <message>."
-                client.connection.send(usage_msg.encode())
-                return
-            
-            target_name = split_msg[1]
-            whisper = split_msg[2]
-            target_exist = False
-            # validate if the target user is in the channel
-            for c in channel.clients:
-                if c.username == target_name:
-                    target_exist = True
-                    target = c
-                    # if target user is in the channel, send the whisper message
-                    whisper_msg = f"[{client.username} whispers to you: ({time.strftime("%H:%M:%S")})] {whisper}"
-                    c.connection.send(whisper_msg.encode())
-            
-            # print whisper server message
-            if target_exist:
-                print(f"[{client.username} whispers to {target.username}: ({time.strftime("%H:%M:%S")})] {whisper}")
-            else:
-                failed_whisper = f"[Server message ({time.strftime("%H:%M:%S")})] {target_name} is not here."
-                client.connection.send(failed_whisper.encode())
-
-def switch_channel(client, channel, msg, channels) -> bool:
-    """
-    Implement channel switching function, if args for /switch are valid.
-    Else print appropriate message and return.
-
-    Returns: bool
-    Status: TODO
-    """
-    # Write your code here...
-    # validate the command structure
-    split_msg = msg.split()
-    if len(split_msg) != 2:
-        usage_msg = f"[Server message ({time.strftime("%H:%M:%S")})] Usage /switch <channel_name>."
-        client.connection.send(usage_msg.encode())
-        return False
-    
-    target_channel_name = split_msg[1]
-
-    # check if the new channel exists
-    target_exists = False
-    for chan in channels.values():
-        if chan.name == target_channel_name:
-            target_exists = True
-            target_channel = chan
-    if not target_exists:
-        invalid_target = f"[Server message ({time.strftime("%H:%M:%S")})] {target_channel_name} does not exist."
-        client.connection.send(invalid_target.encode())
-        return
-    # check if there is a client with the same username in the new channel
-    if not check_duplicate_username(client.username, target_channel, client.connection):
-        duplicate_username = f"[Server message ({time.strftime("%H:%M:%S")})] {target_channel.name} already has a user with username {client.username}."
-        client.connection.send(duplicate_username.encode())
-        return
-    user_left_msg = f"[Server message ({time.strftime("%H:%M:%S")})] {client.username} has left the channel."
-    # if all checks are correct, and client in queue
-    if client.in_queue:
-        # remove client from current channel queue
-        remove_item(channel.queue, client)
-        # broadcast queue update message to all clients in the current channel
-
-        # tell client to connect to new channel and close connection
-        switch_msg = f"/switch {target_channel.port}"
-        client.connection.send(switch_msg.encode())
-        client.connection.close()
-        print(user_left_msg)
-
-    # if all checks are correct, and client in channel
-    else:
-        # remove client from current channel
-        channel.clients.remove(client)
-        # tell client to connect to new channel and close connection
-        switch_msg = f"/switch {target_channel.port}"
-        client.connection.send(switch_msg.encode())
-        client.connection.close()
-        print(user_left_msg)
-        for c in channel.clients:
-            c.connection.send(user_left_msg.encode())
-
-def broadcast_in_channel(client, channel, msg) -> None:
-    """
-    Broadcast a message to all clients in the channel.
-    Status: TODO
-    """
-    # Write your code here...
-    # if in queue, do nothing
-    if client.in_queue:
-        return
-
-    # if muted, send mute message to the client
-    if client.muted:
-        mute_msg = f"[Server message ({time.strftime("%H:%M:%S")})] You are still muted for {client.mute_duration} seconds."
-        client.connection.send(mute_msg.encode())
-        return
-
-    # broadcast message to all clients in the channel
-    for cl in channel.clients:
-        cl.connection.send(msg.encode())
-
-def client_handler(client, channel, channels) -> None:
-    """
-    Handles incoming messages from a client in a channel. Supports commands to quit, send, switch, whisper, and list channels. 
-    Manages client"s mute status and remaining time. Handles client disconnection and exceptions during message processing.
-    Status: TODO (check the "# Write your code here..." block in Exception)
-    Args:
-        client (Client): The client to handle.
-        channel (Channel): The channel in which the client is.
-        channels (dict): A dictionary of all channels.
-    """
-    while True:
-        if client.kicked:
-            break
-        try:
-            msg = client.connection.recv(1024).decode()
-
-            # check message for client commands
-            if msg.startswith("/quit"):
-                if len(msg.split()) > 1:
-                    usage_msg = f"[Server message ({time.strftime("%H:%M:%S")})] Usage /quit."
-                    client.connection.send(usage_msg.encode())
-                else:
-                    quit_client(client, channel)
-                    left_msg = f"[Server message ({time.strftime("%H:%M:%S")})] {client.username} has left the channel."
-                    print(left_msg)
-                    break
-            elif msg.startswith("/send"):
-                send_client(client, channel, msg)
-            elif msg.startswith("/list"):
-                if len(msg.split()) > 1:
-                    usage_msg = f"[Server message ({time.strftime("%H:%M:%S")})] Usage /list."
-                    client.connection.send(usage_msg.encode())
-                else:
-                    list_clients(client, channels)
-            elif msg.startswith("/whisper"):
-                whisper_client(client, channel, msg)
-            elif msg.startswith("/switch"):
-                is_valid = switch_channel(client, channel, msg, channels)
-                if is_valid:
-                    break
-                else:
-                    continue
-
-            # if not a command, broadcast message to all clients in the channel
-            else:
-                b_msg = f"[{client.username} ({time.strftime("%H:%M:%S")})] {msg}" 
-                if not client.muted:
-                    print(f"[{client.username} ({time.strftime("%H:%M:%S")})] {msg}")
-                broadcast_in_channel(client, channel, b_msg)
-
-            # reset remaining time before AFK
-            if not client.muted:
-                client.remaining_time = 100
-        except EOFError:
-            continue
-        except OSError:
-            break
-        except Exception as e:
-            print(f"Error in client handler: {e}")
-            # remove client from the channel, close connection
-            # Write your code here...
-            quit_client(client, channel)
-        
-def check_duplicate_username(username, channel, conn) -> bool:
-    """
-    Check if a username is already in a channel or its queue.
-    Status: TODO
-    """
-    # Write your code here...
-    found = False
-    for client in channel.clients:
-        if client.username == username:
-            return found
-    temp_queue = queue.Queue()
-    while not channel.queue.empty():
-        client = channel.queue.get()
-        if client.username == username:
-            found = True
-        temp_queue.put(client)
-    while not temp_queue.empty():
-        channel.queue.put(temp_queue.get())
-    return not found
-
-def position_client(channel, conn, username, new_client) -> None:
-    """
-    Place a client in a channel or queue based on the channel"s capacity.
-    Status: TODO
-    """
-    # Write your code here...
-    if len(channel.clients) < channel.capacity and channel.queue.empty():
-        # put client in channel and reset remaining time before AFK
-        new_client.remaining_time = 100
-        new_client.in_queue = False
-        channel.clients.append(new_client)
-        msg = f"[Server message ({time.strftime("%H:%M:%S")})] {username} has joined the channel."
-        broadcast_in_channel(new_client, channel, msg)
-        print(f"[Server message ({time.strftime("%H:%M:%S")})] {username} has joined the {channel.name} channel.")
-    else:
-        # put client in queue
-        new_client.in_queue = True
-        channel.queue.put(new_client)
-        msg = f"[Server message ({time.strftime("%H:%M:%S")})] Welcome to the {channel.name} waiting room, {username}."
-        conn.sendall(msg.encode())
-        # Message clients in queue
-        count = 0
-        temp_queue = queue.Queue()
-        while not channel.queue.empty():
-            client = channel.queue.get()
-            temp_queue.put(client)
-            msg = f"[Server message ({time.strftime("%H:%M:%S")})] You are in the waiting queue and there are {count} user(s) ahead of you."
-            # client.connection.send(msg.encode())
-            count += 1
-        while not temp_queue.empty():
-            channel.queue.put(temp_queue.get())
-        new_client.connection.send(msg.encode())
-
-def channel_handler(channel, channels) -> None:
-    """
-    Starts a chat server, manage channels, respective queues, and incoming clients.
-    This initiates different threads for chanel queue processing and client handling.
-    Status: Given
-    Args:
-        channel (Channel): The channel for which to start the server.
-    Raises:
-        EOFError: If there is an error in the client-server communication.
-    """
-    # Initialize server socket, bind, and listen
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind(("localhost", channel.port))
-    server_socket.listen(channel.capacity)
-
-    # launch a thread to process client queue
-    queue_thread = threading.Thread(target=process_queue, args=(channel,))
-    queue_thread.start()
-
-    while True:
-        try:
-            # accept a client connection
-            conn, addr = server_socket.accept()
-            username = conn.recv(1024).decode()
-
-            # check duplicate username in channel and channel"s queue
-            is_valid = check_duplicate_username(username, channel, conn)
-            if not is_valid: continue
-
-            welcome_msg = f"[Server message ({time.strftime("%H:%M:%S")})] Welcome to the {channel.name} channel, {username}."
-            conn.send(welcome_msg.encode())
-            time.sleep(0.1)
-            new_client = Client(username, conn, addr)
-
-            # position client in channel or queue
-            position_client(channel, conn, username, new_client)
-
-            # Create a client thread for each connected client, whether they are in the channel or queue
-            client_thread = threading.Thread(target=client_handler, args=(new_client, channel, channels))
-            client_thread.start()
-        except EOFError:
-            continue
-
-def remove_item(q, item_to_remove) -> queue.Queue:
-    """
-    Remove item from queue
-    Status: Given
-    Args:
-        q (queue.Queue): The queue to remove the item from.
-        item_to_remove (Client): The item to remove from the queue.
-    Returns:
-        queue.Queue: The queue with the item removed.
-    """
-    new_q = queue.Queue()
-    while not q.empty():
-        current_item = q.get()
-        if current_item != item_to_remove:
-            new_q.put(current_item)
-    count = 0
-    temp_queue = queue.Queue()
-    while not new_q.empty():
-        client = new_q.get()
-        temp_queue.put(client)
-        msg = f"[Server message ({time.strftime("%H:%M:%S")})] You are in the waiting queue and there are {count} user(s) ahead of you."
-        client.connection.send(msg.encode())
-        count += 1
-    while not temp_queue.empty():
-        new_q.put(temp_queue.get())
-    item_to_remove.in_queue = False
-    return new_q
-
-def process_queue(channel) -> None:
-    """
-    Processes the queue of clients for a channel in an infinite loop. If the channel is not full, 
-    it dequeues a client, adds them to the channel, and updates their status. It then sends updates 
-    to all clients in the channel and queue. The function handles EOFError exceptions and sleeps for 
-    1 second between iterations.
-    Status: TODO
-    Args:
-        channel (Channel): The channel whose queue to process.
-    Returns:
-        None
-    """
-    # Write your code here...
-    while True:
-        try:
-            # print("Queue size: ", channel.queue.qsize(), " Channel space: ", len(channel.clients) < channel.capacity)
-            # time.sleep(1.5)
-            if not channel.queue.empty() and len(channel.clients) < channel.capacity:
-                # Dequeue a client from the queue and add them to the channel
-                new_client = channel.queue.get()
-                new_client.in_queue = False
-                # Send join message to all clients in the channel
-                channel.clients.append(new_client)
-                msg = f"[Server message ({time.strftime("%H:%M:%S")})] {new_client.username} has joined the channel."
-                broadcast_in_channel(new_client, channel, msg)
-                
-                print(f"[Server message ({time.strftime("%H:%M:%S")})] {new_client.username} has joined the {channel.name} room.")
-                # Update the queue messages for remaining clients in the queue
-                count = 0
-                temp_queue = queue.Queue()
-                while not channel.queue.empty():
-                    client = channel.queue.get()
-                    temp_queue.put(client)
-                    msg = f"[Server message ({time.strftime("%H:%M:%S")})] You are in the waiting queue and there are {count} user(s) ahead of you."
-                    client.connection.send(msg.encode())
-                    count += 1
-                while not temp_queue.empty():
-                    channel.queue.put(temp_queue.get())
-                # Reset the remaining time to 100 before AFK
-                new_client.remaining_time = 100
-                time.sleep(1)
-        except EOFError:
-            continue
-
-def kick_user(command, channels) -> None:
-    """
-    Implement /kick function
-    Status: TODO
-    Args:
-        command (str): The command to kick a user from a channel.
-        channels (dict): A dictionary of all channels.
-    Returns:
-        None
-    """
-    # Write your code here...
-    # validate command structure
-    cmd_split = command.split()
-    if len(cmd_split) != 3:
-        return
-    _, target_channel_name, target_name = cmd_split
-    # Check if the channel exists in the dictionary
-    if target_channel_name not in channels:
-        print(f"[Server message ({time.strftime("%H:%M:%S")})] {target_channel_name} does not exist.")
-        return
-    target_channel = channels[target_channel_name]
-    # Check if the user is in the channel
-    target_client_exists = False
-    for client in target_channel.clients:
-        if client.username == target_name:
-            target_client_exists = True
-            target_client = client
-            break
-    if not target_client_exists:
-        print(f"[Server message ({time.strftime("%H:%M:%S")})] {target_name} is not in {target_channel_name}.")
-        return
-    # Kick the user
-    quit_client(target_client, target_channel)
-    print(f"[Server message ({time.strftime("%H:%M:%S")})] Kicked {target_name}.")
-
-def empty(command, channels) -> None:
-    """
-    Implement /empty function
-    Status: TODO
-    Args:
-        command (str): The command to empty a channel.
-        channels (dict): A dictionary of all channels.
-    """
-    # Write your code here...
-    # validate the command structure
-    split_command = command.split()
-    if len(split_command) != 2:
-        return
-    target_channel_name = split_command[1]
-
-    # check if the channel exists in the server
-    if target_channel_name not in channels:
-        print(f"[Server message ({time.strftime("%H:%M:%S")})] {target_channel_name} does not exist.")
-        return
-    target_channel = channels[target_channel_name]
-
-    # if the channel exists, close connections of all clients in the channel
-    while not target_channel.queue.empty():
-        cl = target_channel.queue.get().connection.close()
-    for client in target_channel.clients:
-        target_channel.clients.remove(client)
-        client.connection.close()
-    print(f"[Server message ({time.strftime("%H:%M:%S")})] {target_channel_name} has been emptied.")
-
-def mute_user(command, channels) -> None:
-    """
-    Implement /mute function
-    Status: TODO
-    Args:
-        command (str): The command to mute a user in a channel.
-        channels (dict): A dictionary of all channels.
-    """
-    # Write your code here...
-    # validate the command structure
-    split_command = command.split()
-    if len(split_command) != 4:
-        return
-    _, target_channel_name, target_username, mutetime = split_command
-    # check if the mute time is valid
-    try:
-        mute_time = int(mutetime)
-    except ValueError:
-        print(f"[Server message ({time.strftime("%H:%M:%S")})] Invalid mute time.")
-        return
-    if mute_time <= 0:
-        print(f"[Server message ({time.strftime("%H:%M:%S")})] Invalid mute time.")
-        return
-    # check if the channel exists in the server
-    target_channel_exists = False
-    for channel in channels.values():
-        if channel.name == target_channel_name:
-            target_channel = channel
-            target_channel_exists = True
-
-    # if the channel exists, check if the user is in the channel
-    target_client_exists = False
-    if target_channel_exists:
-        for client in target_channel.clients:
-            if client.username == target_username:
-                target_client_exists = True
-                target_client = client
-
-    # if user is in the channel, mute it and send messages to all clients
-    if target_client_exists:
-        target_client.muted = True
-        target_client.mute_duration = mute_time
-        print(f"[Server message ({time.strftime("%H:%M:%S")})] Muted {target_client.username} for {mute_time} seconds.")
-        mute_msg = f"[Server message ({time.strftime("%H:%M:%S")})] You have been muted for {mute_time} seconds."
-        target_client.connection.send(mute_msg.encode())
-        server_mute_msg = f"[Server message ({time.strftime("%H:%M:%S")})] {target_client.username} has been muted for {mute_time} seconds."
-        # broadcast_in_channel(target_client, target_channel, server_mute_msg)
-        for cl in target_channel.clients:
-            if cl.username != target_client.username:
-                cl.connection.send(server_mute_msg.encode())
-    # if user is not in the channel, print error message
-    else:
-        print(f"[Server message ({time.strftime("%H:%M:%S")})] {target_username} is not here.")
-    
-def shutdown(channels) -> None:
-    """
-    Implement /shutdown function
-    Status: TODO
-    Args:
-        channels (dict): A dictionary of all channels.
-    """
-    # Write your code here...
-    # close connections of all clients in all channels and exit the server
-    for channel in channels.values():
-        # Close connections for all clients in the channel
-        for client in channel.clients:
-            client.connection.close()
-        
-        # Close connections for all clients in the queue
-        while not channel.queue.empty():
-            client = channel.queue.get()
-            client.connection.close()
-    # end of code insertion, keep the os._exit(0) as it is
-    os._exit(0)
-
-def server_commands(channels) -> None:
-    """
-    Implement commands to kick a user, empty a channel, mute a user, and shutdown the server.
-    Each command has its own validation and error handling. 
-    Status: Given
-    Args:
-        channels (dict): A dictionary of all channels.
-    Returns:
-        None
-    """
-    while True:
-        try:
-            command = input()
-            if command.startswith("/kick"):
-                kick_user(command, channels)
-            elif command.startswith("/empty"):
-                empty(command, channels)
-            elif command.startswith("/mute"):
-                mute_user(command, channels)
-            elif command == "/shutdown":
-                shutdown(channels)
-            else:
-                continue
-        except EOFError:
-            continue
-        except Exception as e:
-            print(f"{e}")
-            sys.exit(1)
-
-def check_inactive_clients(channels) -> None:
-    """
-    Continuously manages clients in all channels. Checks if a client is muted, in queue, or has run out of time. 
-    If a client"s time is up, they are removed from the channel and their connection is closed. 
-    A server message is sent to all clients in the channel. The function also handles EOFError exceptions.
-    Status: TODO
-    Args:
-        channels (dict): A dictionary of all channels.
-    """
-    # Write your code here...
-    # parse through all the clients in all the channels
-    for channel in channels.values():
-        for client in channel.clients:
-    # if client is muted or in queue, do nothing
-            if client.in_queue or client.muted:
-                continue
-            if client.remaining_time <= 0:
-                # remove client from the channel and close connection, print AFK message
-                channel.clients.remove(client)
-                client.connection.close()
-                afk_msg = f"[Server message ({time.strftime("%H:%M:%S")})] {client.username} went AFK."
-                broadcast_in_channel(client, channel, afk_msg)
-            # if client is not muted, decrement remaining time
-            # elif client
-            
-def handle_mute_durations(channels) -> None:
-    """
-    Continuously manages the mute status of clients in all channels. If a client"s mute duration has expired, 
-    their mute status is lifted. If a client is still muted, their mute duration is decremented. 
-    The function sleeps for 0.99 seconds between iterations and handles EOFError exceptions.
-    Status: Given
-    Args:
-        channels (dict): A dictionary of all channels.
-    """
-    while True:
-        try:
-            for channel_name in channels:
-                channel = channels[channel_name]
-                for client in channel.clients:
-                    if client.mute_duration <= 0:
-                        client.muted = False
-                        client.mute_duration = 0
-                    if client.muted and client.mute_duration > 0:
-                        client.mute_duration -= 1
-            time.sleep(0.99)
-        except EOFError:
-            continue
-
-def main():
-    try:
-        if len(sys.argv) != 2:
-            print("Usage: python3 chatserver.py configfile")
-            sys.exit(1)
-
-        config_file = sys.argv[1]
-
-        # parsing and creating channels
-        parsed_lines = parse_config(config_file)
-        channels = get_channels_dictionary(parsed_lines)
-
-        # creating individual threads to handle channels connections
-        threads = []
-        for _, channel in channels.items():
-            thread = threading.Thread(target=channel_handler, args=(channel, channels))
-            thread.start()
-            threads.append(thread)
-
-        server_commands_thread = threading.Thread(target=server_commands, args=(channels,))
-        server_commands_thread.start()
-        threads.append(server_commands_thread)
-
-        inactive_clients_thread = threading.Thread(target=check_inactive_clients, args=(channels,))
-        inactive_clients_thread.start()
-        threads.append(inactive_clients_thread)
-
-        mute_duration_thread = threading.Thread(target=handle_mute_durations, args=(channels,))
-        mute_duration_thread.start()
-        threads.append(mute_duration_thread)
-
-        # Wait for all threads to complete
-        for thread in threads:
-            thread.join()
-
-    except KeyboardInterrupt:
-        print("Ctrl + C Pressed. Exiting...")
-        os._exit(0)
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        os._exit(1)
-
-
-if __name__ == "__main__":
-    main()
+import socket
+import threading
+import sys
+import time
+import os
+import selectors
+import collections
+import heapq
+import math
+import select
+import hashlib
+import secrets
+import mmap
+import json
+import struct
+import itertools
+import queue
+import resource
+from mchatprotocol import (HEADER, CODECS, COMMANDS, COMPRESS_CHUNK, COMPRESS_MIN, BinaryFrame, FrameDecoder,
+                           FrameError, encode_frame, read_frame, compress_frame, decode_command)
+
+
+DEFAULT_OPTIONS = {
+    "mode": "threaded",
+    "outbox-high": "262144",
+    "outbox-low": "65536",
+    "slow-policy": "drop",
+    "slow-grace": "5",
+    "afk-timeout": "100",
+    "transfer-ttl": "600",
+    "listen-port": "0",
+    "workers": "1",
+    "switch": "reconnect",
+    "log-dir": "",
+    "log-sync-ms": "50",
+    "log-sync-messages": "256",
+    "log-segment-bytes": "16777216",
+    "log-retain-bytes": "268435456",
+    "stats-file": "",
+    "stats-interval": "10",
+    "admin-socket": "",
+    "coalesce-bytes": "16384",
+    "compress": "zlib",
+    "compress-min": str(COMPRESS_MIN),
+    "binary": "on",
+    "max-capacity": "5",
+    # the writes only run in parallel on spare cores, a single core is better off without the threads
+    "fanout-workers": str(min(4, (os.cpu_count() or 1) - 1)),
+    "fanout-min": "256",
+}
+
+# optional "name=value" settings after a channel's capacity in the configuration file
+CHANNEL_SETTINGS = {"history": 0, "chat": None, "whisper": None, "send": None, "coalesce": 0, "backlog": 0}
+# the kinds of message limited per client, each by a "<kind>=<count>/<seconds>" channel setting
+RATE_LIMITED = ("chat", "whisper", "send")
+# the most recent messages a channel may keep for replay
+MAX_HISTORY = 1000
+# the longest a coalescing channel may hold back a message, in milliseconds
+MAX_COALESCE_MS = 1000
+# the largest capacity a channel may have with --max-capacity, and connections one may have pending
+MAX_LARGE_CAPACITY = 100000
+
+SERVER_MODES = ("threaded", "eventloop")
+SLOW_POLICIES = ("drop", "disconnect")
+SWITCH_MODES = ("reconnect", "inplace")
+BINARY_MODES = ("on", "off")
+# text commands by the prefix that selects them, tried in this order; any other message is chat
+TEXT_COMMANDS = ("/quit", "/send", "/resume", "/compress", "/protocol", "/received", "/list", "/whisper", "/switch")
+CHAT_OPCODE = bytes((COMMANDS["chat"][0],))
+
+# the most file content handed to the kernel per sendfile call
+SENDFILE_CHUNK = 1 << 20
+# the most queued messages handed to the kernel per sendmsg call
+SENDMSG_BATCH = min(os.sysconf("SC_IOV_MAX"), 1024) if hasattr(os, "sysconf") else 16
+# the largest control plane message: a handed over connection carries up to one recv of bytes
+CONTROL_PACKET = 1 << 18
+# seconds an admin socket client has to take a reply before it is disconnected
+ADMIN_REPLY_TIMEOUT = 1.0
+
+# the second the cached timestamp was rendered for, and the rendered "HH:MM:SS"
+_stamp = (None, "")
+
+def timestamp() -> str:
+    """
+    Returns the current wall-clock time as "HH:MM:SS". The text is rendered once per second and
+    shared by every message stamped during that second, rather than by a strftime per message.
+    Returns:
+        str: the current time.
+    """
+    global _stamp
+    now = int(time.time())
+    second, text = _stamp
+    if second != now:
+        text = time.strftime("%H:%M:%S", time.localtime(now))
+        _stamp = (now, text)
+    return text
+
+class Notice:
+    """
+    A server message with a fixed wording, compiled once into a template with the
+    "[Server message (HH:MM:SS)]" prefix so rendering it is a single format call. Notices
+    without fields are only re-rendered when the timestamp changes.
+    """
+
+    def __init__(self, text):
+        self.template = "[Server message ({stamp})] " + text
+        self.fixed = "{" not in text
+        self.rendered = (None, "")
+
+    def render(self, **fields) -> str:
+        """
+        Args:
+            **fields: the values for the notice's fields.
+        Returns:
+            str: the notice, stamped with the current time.
+        """
+        stamp = timestamp()
+        if not self.fixed:
+            return self.template.format(stamp=stamp, **fields)
+        rendered_stamp, text = self.rendered
+        if rendered_stamp is not stamp:
+            text = self.template.format(stamp=stamp)
+            self.rendered = (stamp, text)
+        return text
+
+LEFT = Notice("{username} has left the channel.")
+STILL_MUTED = Notice("You are still muted for {seconds} seconds.")
+SEND_USAGE = Notice("Usage /send <target> <file path>.")
+YOU_SENT = Notice("You sent {path} to {target}.")
+SENT = Notice("{username} sent {path} to {target}.")
+NOT_HERE = Notice("{username} is not here.")
+DOES_NOT_EXIST = Notice("{name} does not exist.")
+RESUME_USAGE = Notice("Usage /resume <file>.")
+NO_TRANSFER = Notice("There is no transfer to resume.")
+NO_LONGER_AVAILABLE = Notice("{filename} is no longer available.")
+RESUMED = Notice("{username} resumed {filename} from byte {offset}.")
+VERIFIED = Notice("{username} verified {filename}.")
+CORRUPT = Notice("{username} received a corrupt {filename}.")
+TRANSFERRING = Notice("Transferring {label}: {quarter}% of {size} bytes.")
+TRANSFERRED = Notice("Transferred {label}: {count} bytes in {elapsed:.2f}s ({rate:.1f} MB/s).")
+ABORTED = Notice("Aborted {label}: {error}.")
+TOO_SLOW = Notice("Disconnected {username}, too slow to keep up.")
+WHISPER_USAGE = Notice("Usage /whisper <username> <message>.")
+SWITCH_USAGE = Notice("Usage /switch <channel_name>.")
+QUIT_USAGE = Notice("Usage /quit.")
+LIST_USAGE = Notice("Usage /list.")
+DUPLICATE_NAME = Notice("{channel} already has a user with username {username}.")
+WELCOME = Notice("Welcome to the {channel} channel, {username}.")
+WAITING_ROOM = Notice("Welcome to the {channel} waiting room, {username}.")
+QUEUE_POSITION = Notice("You are in the waiting queue and there are {count} user(s) ahead of you.")
+JOINED = Notice("{username} has joined the channel.")
+JOINED_CHANNEL = Notice("{username} has joined the {channel} channel.")
+JOINED_ROOM = Notice("{username} has joined the {channel} room.")
+AFK = Notice("{username} went AFK.")
+NOT_IN_CHANNEL = Notice("{username} is not in {channel}.")
+KICKED = Notice("Kicked {username}.")
+EMPTIED = Notice("{channel} has been emptied.")
+INVALID_MUTE = Notice("Invalid mute time.")
+MUTED_LOG = Notice("Muted {username} for {seconds} seconds.")
+YOU_MUTED = Notice("You have been muted for {seconds} seconds.")
+MUTED = Notice("{username} has been muted for {seconds} seconds.")
+BACKLOG = Notice("{username} queued {queued} bytes (peak {peak}), dropped {dropped} message(s).")
+WHERE = Notice("{username} is {state} {channel}.")
+EXPORTED = Notice("Exported {count} message(s) of {channel} to {path}.")
+NOT_LOGGED = Notice("{channel} is not logged.")
+LOG_FAILED = Notice("Could not write the {channel} log: {error}.")
+STATS_UPTIME = Notice("Up {seconds:.0f}s, {threads} thread(s) alive.")
+STAT_COUNT = Notice("{name} {value} ({rate:.1f}/s)")
+STAT_LEVEL = Notice("{name} {value}")
+STAT_LATENCY = Notice("{name} n={count} ({rate:.1f}/s) mean={mean}us p50={p50}us p99={p99}us p99.9={p999}us max={max}us")
+STATS_FAILED = Notice("Could not write stats to {path}: {error}.")
+UNKNOWN_COMMAND = Notice("Unknown command {command}.")
+MALFORMED = Notice("Malformed frame: {error}.")
+THROTTLED = Notice("You are sending {kind} messages too fast, the next one can go in {seconds:.1f} seconds.")
+
+class Counter:
+    """
+    A total that only grows, such as the bytes received from a channel's clients.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def add(self, amount=1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self) -> int:
+        return self.value
+
+class Gauge:
+    """
+    A level that rises and falls, such as the number of handler threads alive. A gauge given a
+    read function takes its level from it when a snapshot is made instead, so it costs nothing
+    to keep up to date.
+    """
+
+    def __init__(self, read=None):
+        self.value = 0
+        self.lock = threading.Lock()
+        self.read = read
+
+    def add(self, amount=1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self) -> int:
+        return self.read() if self.read is not None else self.value
+
+class Histogram:
+    """
+    A latency distribution kept in the manner of an HDR histogram. Values, in whole microseconds,
+    are counted in buckets that widen with their magnitude, 2 ** precision of them per power of
+    two, so recording is a shift and an increment and every percentile is reported to within
+    1 / 2 ** precision of the true value, whatever the range of the values.
+    """
+    precision = 4
+    # values are clamped below 2 ** 40 microseconds, about 12 days
+    limit = 1 << 40
+
+    def __init__(self):
+        self.counts = [0] * ((self.limit.bit_length() - self.precision) << self.precision)
+        self.total = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds) -> None:
+        """
+        Args:
+            seconds (float): The measured duration.
+        """
+        value = int(seconds * 1e6)
+        if value >= self.limit:
+            value = self.limit - 1
+        # values below 2 ** (precision + 1) have a bucket each
+        shift = value.bit_length() - self.precision - 1
+        index = (shift << self.precision) + (value >> shift) if shift > 0 else value
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def highest(self, index) -> int:
+        """
+        Returns:
+            int: The largest value counted in a bucket.
+        """
+        shift = max((index >> self.precision) - 1, 0)
+        return ((index - (shift << self.precision) + 1) << shift) - 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: The number of values recorded, their mean, median, 99th and 99.9th percentile
+            and maximum, in microseconds.
+        """
+        with self.lock:
+            counts = list(self.counts)
+            total, largest = self.total, self.max
+        count = sum(counts)
+        summary = {"count": count, "mean": total // count if count else 0, "max": largest}
+        ranks = [("p50", 0.5), ("p99", 0.99), ("p999", 0.999)]
+        seen = 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            while ranks and seen >= max(1, math.ceil(ranks[0][1] * count)):
+                summary[ranks.pop(0)[0]] = min(self.highest(index), largest)
+        for name, _ in ranks:
+            summary[name] = 0
+        return summary
+
+class MetricsRegistry:
+    """
+    The server's metrics by dotted name: "server.<metric>" for the process as a whole and
+    "channel.<name>.<metric>" for each channel's own. Metrics are registered once and then
+    updated directly by the code they measure; the registry is only consulted for snapshots.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        # the value and time of each counter at the last /stats, for its rate
+        self.reported = {}
+
+    def register(self, name, metric):
+        with self.lock:
+            return self.metrics.setdefault(name, metric)
+
+    def counter(self, name) -> Counter:
+        return self.register(name, Counter())
+
+    def gauge(self, name, read=None) -> Gauge:
+        gauge = self.register(name, Gauge())
+        if read is not None:
+            # the latest object registered under the name is the one measured
+            gauge.read = read
+        return gauge
+
+    def histogram(self, name) -> Histogram:
+        return self.register(name, Histogram())
+
+    def snapshot(self, prefixes) -> dict:
+        """
+        Args:
+            prefixes (list): The name prefixes of the metrics wanted.
+        Returns:
+            dict: The current value of every matching metric, by name.
+        """
+        with self.lock:
+            matching = [(name, metric) for name, metric in sorted(self.metrics.items())
+                        if name.startswith(tuple(prefixes))]
+        return {name: metric.snapshot() for name, metric in matching}
+
+    def rate(self, name, value, now) -> float:
+        """
+        Returns:
+            float: How fast a counter, or a histogram's number of values, grew per second since
+            its last report, or since startup.
+        """
+        last_value, last_time = self.reported.get(name, (0, self.started))
+        self.reported[name] = (value, now)
+        return (value - last_value) / (now - last_time) if now > last_time else 0.0
+
+METRICS = MetricsRegistry()
+HANDLER_THREADS = METRICS.gauge("server.handler_threads")
+SEND_FILES = METRICS.counter("server.send_files")
+SEND_BYTES = METRICS.counter("server.send_bytes")
+# sendmsg calls writing queued messages, the write syscalls that coalescing saves
+SEND_CALLS = METRICS.counter("server.send_calls")
+# the frames compressed for clients that negotiated a codec, before and after
+COMPRESS_RAW = METRICS.counter("server.compress_raw_bytes")
+COMPRESS_PACKED = METRICS.counter("server.compress_packed_bytes")
+# broadcasts whose writes were split across the fan-out workers
+FANOUT_POOLED = METRICS.counter("server.fanout_pooled")
+
+def send_buffer_room(sock) -> int:
+    """
+    Returns how many bytes can be written to a blocking socket without waiting for the client.
+    A TCP socket only polls writable while at least a third of its send buffer is free, so a
+    quarter of the buffer always fits, whatever overhead the kernel charges on top.
+    Args:
+        sock (socket.socket): the client's socket.
+    Returns:
+        int: the number of bytes that can be written, 0 if the send buffer is full.
+    Raises:
+        OSError: if the socket has been closed.
+    """
+    if sock.fileno() == -1:
+        raise OSError("socket is closed")
+    poller = select.poll()
+    poller.register(sock, select.POLLOUT)
+    if not poller.poll(0):
+        return 0
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) // 4
+
+class Transfer:
+    """
+    A file sent with /send, kept until the recipient confirms it so an interrupted transfer can
+    be resumed from the recipient's last offset instead of byte zero. The file's SHA-256 is
+    computed once, on a thread of its own so it overlaps the stream rather than slowing it, and
+    is sent as a "/sent" frame after the last byte once both are done.
+    """
+
+    def __init__(self, transfer_id, path, sender, recipient):
+        self.id = transfer_id
+        self.path = path
+        self.filename = os.path.basename(path)
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+        self.sender = sender
+        self.recipient = recipient
+        self.lock = threading.Lock()
+        self.checksum = None
+        # the furthest any stream of the file has got
+        self.streamed = 0
+        # the recipient whose stream ended before the checksum was ready
+        self.waiting = None
+        self.expiry = None
+
+    def compute_checksum(self, scheduler) -> None:
+        """
+        Hashes the file, then sends the "/sent" frame to a recipient that is already waiting.
+        The frame is handed to the scheduler rather than sent from the hashing thread, so in
+        event-loop mode only the loop's own thread touches its selector.
+        Args:
+            scheduler (Scheduler): the scheduler of the transfer's registry.
+        """
+        try:
+            with open(self.path, "rb") as file:
+                checksum = hashlib.file_digest(file, "sha256").hexdigest()
+        except OSError:
+            checksum = "unreadable"
+        with self.lock:
+            self.checksum = checksum
+            recipient, self.waiting = self.waiting, None
+        if recipient is not None:
+            scheduler.call_later(0, recipient.send_bytes, self.trailer(), False)
+
+    def trailer(self) -> bytes:
+        """
+        Returns:
+            bytes: the "/sent <id> <sha256>" frame the recipient verifies the file against.
+        """
+        return encode_frame(f"/sent {self.id} {self.checksum}")
+
+    def stream_ended(self, recipient):
+        """
+        Called when a stream of the file reaches its end.
+        Args:
+            recipient (Client): the client the file was streamed to.
+        Returns:
+            bytes: the "/sent" frame to queue next, or None if it is sent once the checksum is ready.
+        """
+        with self.lock:
+            if self.checksum is None:
+                self.waiting = recipient
+                return None
+        return self.trailer()
+
+class TransferRegistry:
+    """
+    Server-wide table of unconfirmed transfers by id. A transfer is forgotten once its recipient
+    confirms it, or ttl seconds after it was last started or resumed.
+    """
+    ttl = 600.0
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.transfers = {}
+
+    def create(self, path, sender, recipient) -> Transfer:
+        """
+        Registers a new transfer of a file.
+        Args:
+            path (str): the file to send.
+            sender (str): the sending username.
+            recipient (str): the receiving username, the only one allowed to resume it.
+        Returns:
+            Transfer: the new transfer.
+        Raises:
+            OSError: if the file cannot be read.
+        """
+        transfer = Transfer(secrets.token_hex(8), path, sender, recipient)
+        with self.lock:
+            self.transfers[transfer.id] = transfer
+        self.touch(transfer)
+        threading.Thread(target=transfer.compute_checksum, args=(self.scheduler,), daemon=True).start()
+        return transfer
+
+    def get(self, transfer_id, recipient):
+        """
+        Returns:
+            Transfer: the transfer with that id addressed to recipient, or None.
+        """
+        with self.lock:
+            transfer = self.transfers.get(transfer_id)
+        if transfer is None or transfer.recipient != recipient:
+            return None
+        return transfer
+
+    def touch(self, transfer) -> None:
+        """
+        Restarts a transfer's expiry countdown.
+        """
+        if transfer.expiry is not None:
+            transfer.expiry.cancel()
+        transfer.expiry = self.scheduler.call_later(self.ttl, self.discard, transfer)
+
+    def discard(self, transfer) -> None:
+        if transfer.expiry is not None:
+            transfer.expiry.cancel()
+        with self.lock:
+            if self.transfers.get(transfer.id) is transfer:
+                del self.transfers[transfer.id]
+
+class FileSegment:
+    """
+    The part of a Transfer from offset onwards, queued in a recipient's Outbox behind its "/send"
+    frame. The content is never read into memory: each flush has the kernel copy the next chunk
+    straight from the page cache to the socket with os.sendfile, sized to the free send buffer
+    space so the call does not wait on the client. Progress is printed every quarter, and the
+    throughput once the file is through.
+    """
+
+    def __init__(self, transfer, recipient, offset=0):
+        self.transfer = transfer
+        self.recipient = recipient
+        self.file = open(transfer.path, "rb")
+        stat = os.fstat(self.file.fileno())
+        if stat.st_size != transfer.size or stat.st_mtime_ns != transfer.mtime:
+            self.file.close()
+            raise OSError(f"{transfer.path} changed since the transfer started")
+        self.size = transfer.size
+        self.start = offset
+        self.offset = offset
+        self.label = f"{transfer.filename} to {transfer.recipient}"
+        self.started = None
+        self.reported = offset * 4 // self.size * 25 if self.size else 0
+
+    def __len__(self):
+        return self.size - self.offset
+
+    def announce(self) -> bytes:
+        """
+        Returns:
+            bytes: the "/send <filename> <size> <id> <offset>" frame queued ahead of the segment.
+        """
+        return encode_frame(f"/send {self.transfer.filename} {self.size} {self.transfer.id} {self.start}")
+
+    def send_chunk(self, sock) -> int:
+        """
+        Send the next chunk of the file.
+        Args:
+            sock (socket.socket): the client's socket.
+        Returns:
+            int: the number of bytes sent.
+        Raises:
+            BlockingIOError: if the send buffer has no room.
+            EOFError: if the file was truncated after the transfer was announced.
+        """
+        room = send_buffer_room(sock)
+        if room <= 0:
+            raise BlockingIOError
+        if self.started is None:
+            self.started = time.monotonic()
+        sent = os.sendfile(sock.fileno(), self.file.fileno(), self.offset, min(len(self), room, SENDFILE_CHUNK))
+        if sent == 0:
+            raise EOFError(f"{self.file.name} shrank during the transfer")
+        self.offset += sent
+        SEND_BYTES.add(sent)
+        with self.transfer.lock:
+            self.transfer.streamed = max(self.transfer.streamed, self.offset)
+        self.report()
+        return sent
+
+    def report(self) -> None:
+        """
+        Prints the transfer's progress each time it crosses another quarter of the file.
+        """
+        quarter = self.offset * 4 // self.size * 25
+        if quarter > self.reported and self.offset < self.size:
+            self.reported = quarter
+            print(TRANSFERRING.render(label=self.label, quarter=quarter, size=self.size))
+
+    def finish(self):
+        """
+        Closes the file once it is fully sent and prints the transfer's throughput.
+        Returns:
+            bytes: the "/sent" frame to queue next, or None if the checksum is still being computed.
+        """
+        self.close()
+        now = time.monotonic()
+        elapsed = now - (self.started or now)
+        rate = (self.size - self.start) / elapsed / 1e6 if elapsed > 0 else 0.0
+        print(TRANSFERRED.render(label=self.label, count=self.size - self.start, elapsed=elapsed, rate=rate))
+        return self.transfer.stream_ended(self.recipient)
+
+    def close(self) -> None:
+        self.file.close()
+
+class PackedSegment(FileSegment):
+    """
+    A FileSegment for a recipient that negotiated compression. The file goes out as frames of
+    COMPRESS_CHUNK bytes of content each, compressed on their own, so the stream is compressed
+    one chunk at a time as it is sent and a resume can start at any chunk: the one the
+    recipient's offset falls in. Chunks come from CHUNK_CACHE, so a file sent to several members
+    or resumed is only compressed once.
+    """
+
+    def __init__(self, transfer, recipient, codec, offset=0):
+        super().__init__(transfer, recipient, offset - offset % COMPRESS_CHUNK)
+        self.codec = codec
+        # what is left to send of the current chunk's frame
+        self.pending = None
+
+    def announce(self) -> bytes:
+        return encode_frame(f"/send {self.transfer.filename} {self.size} {self.transfer.id} {self.start} {self.codec}")
+
+    def send_chunk(self, sock) -> int:
+        if self.started is None:
+            self.started = time.monotonic()
+        if self.pending is None:
+            self.pending = memoryview(CHUNK_CACHE.get(self))
+        sent = sock.send(self.pending, socket.MSG_DONTWAIT)
+        self.pending = self.pending[sent:]
+        SEND_BYTES.add(sent)
+        if not self.pending:
+            self.pending = None
+            self.offset = min(self.size, self.offset + COMPRESS_CHUNK)
+            with self.transfer.lock:
+                self.transfer.streamed = max(self.transfer.streamed, self.offset)
+            self.report()
+        return sent
+
+class ChunkCache:
+    """
+    Compressed file chunks by file, codec and offset, so each chunk of a file is compressed once
+    however many recipients it is streamed to. The least recently used chunks are dropped once
+    the cache holds more than max_bytes.
+    """
+    max_bytes = 1 << 26
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chunks = collections.OrderedDict()
+        self.size = 0
+
+    def get(self, segment) -> bytes:
+        """
+        Args:
+            segment (PackedSegment): the segment about to send the chunk at its offset.
+        Returns:
+            bytes: the chunk's frame, compressed if that made it smaller.
+        Raises:
+            EOFError: if the file was truncated after the transfer was announced.
+        """
+        transfer = segment.transfer
+        key = (transfer.path, transfer.mtime, transfer.size, segment.codec, segment.offset)
+        with self.lock:
+            frame = self.chunks.get(key)
+            if frame is not None:
+                self.chunks.move_to_end(key)
+                return frame
+        length = min(COMPRESS_CHUNK, segment.size - segment.offset)
+        chunk = os.pread(segment.file.fileno(), length, segment.offset)
+        if len(chunk) < length:
+            raise EOFError(f"{segment.file.name} shrank during the transfer")
+        frame = pack_frame(encode_frame(chunk), segment.codec)
+        with self.lock:
+            if key not in self.chunks:
+                self.chunks[key] = frame
+                self.size += len(frame)
+            while self.size > self.max_bytes:
+                _, dropped = self.chunks.popitem(last=False)
+                self.size -= len(dropped)
+        return frame
+
+CHUNK_CACHE = ChunkCache()
+
+def pack_frame(frame, codec) -> bytes:
+    """
+    Compresses a frame for clients that negotiated codec, counting the bytes saved.
+    Args:
+        frame (bytes): the frame, as made by encode_frame.
+        codec (str): one of CODECS.
+    Returns:
+        bytes: the compressed frame, or frame itself if compressing does not make it smaller.
+    """
+    packed = compress_frame(frame, codec)
+    COMPRESS_RAW.add(len(frame))
+    COMPRESS_PACKED.add(len(packed))
+    return packed
+
+def open_segment(transfer, recipient, offset=0) -> FileSegment:
+    """
+    Returns:
+        FileSegment: the segment streaming transfer from offset, compressed if the recipient
+        negotiated a codec and the file is not under the compression threshold.
+    Raises:
+        OSError: if the file cannot be read or changed since the transfer started.
+    """
+    if recipient.codec is not None and transfer.size >= Client.compress_min:
+        return PackedSegment(transfer, recipient, recipient.codec, offset)
+    return FileSegment(transfer, recipient, offset)
+
+class Outbox:
+    """
+    Bounded buffer of bytes waiting to be written to one client's socket. Writes never block:
+    whatever the socket does not accept stays queued until the writer drains it. Once more than
+    high_watermark bytes are queued, new chat traffic is dropped until the backlog falls below
+    low_watermark. Under the "disconnect" policy a client that stays over the high watermark for
+    longer than grace seconds is evicted. A FileSegment is streamed from disk when it reaches the
+    head of the queue and does not count towards the watermarks.
+    """
+    high_watermark = 262144
+    low_watermark = 65536
+    policy = "drop"
+    grace = 5.0
+
+    def __init__(self):
+        self.buffers = collections.deque()
+        self.lock = threading.Lock()
+        self.queued_bytes = 0
+        self.peak_bytes = 0
+        self.sent_bytes = 0
+        self.dropped_messages = 0
+        self.dropped_bytes = 0
+        self.congested_since = None
+        self.evicted = False
+        self.closed = False
+
+    def put(self, data, droppable=True) -> bool:
+        """
+        Queue bytes for the client, applying the slow consumer policy.
+        Args:
+            data (bytes | FileSegment): the bytes to queue, or a file to stream.
+            droppable (bool): whether the bytes may be discarded when the client is congested.
+        Returns:
+            bool: True if the bytes were queued.
+        """
+        with self.lock:
+            if self.closed:
+                return False
+            if isinstance(data, FileSegment):
+                self.buffers.append(data)
+                return True
+            if self.congested_since is not None and droppable:
+                self.dropped_messages += 1
+                self.dropped_bytes += len(data)
+                if self.policy == "disconnect" and time.monotonic() - self.congested_since > self.grace:
+                    self.evicted = True
+                return False
+            self.buffers.append(memoryview(data))
+            self.queued_bytes += len(data)
+            self.peak_bytes = max(self.peak_bytes, self.queued_bytes)
+            if self.queued_bytes > self.high_watermark and self.congested_since is None:
+                self.congested_since = time.monotonic()
+            return True
+
+    def flush(self, sock) -> bool:
+        """
+        Write as much of the queue as the socket accepts without blocking.
+        Args:
+            sock (socket.socket): the client's socket.
+        Returns:
+            bool: True if nothing is left queued.
+        """
+        with self.lock:
+            while self.buffers:
+                buffer = self.buffers[0]
+                streaming = isinstance(buffer, FileSegment)
+                if streaming and not len(buffer):
+                    trailer = buffer.finish()
+                    if trailer is None:
+                        self.buffers.popleft()
+                    else:
+                        self.buffers[0] = memoryview(trailer)
+                        self.queued_bytes += len(trailer)
+                    continue
+                if not streaming:
+                    # gather the run of queued messages up to the next file into one write
+                    batch = []
+                    for queued in self.buffers:
+                        if isinstance(queued, FileSegment) or len(batch) == SENDMSG_BATCH:
+                            break
+                        batch.append(queued)
+                try:
+                    if streaming:
+                        sent = buffer.send_chunk(sock)
+                    else:
+                        SEND_CALLS.add()
+                        sent = sock.sendmsg(batch, (), socket.MSG_DONTWAIT)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except (OSError, EOFError) as e:
+                    if isinstance(e, EOFError):
+                        # the client expects more file bytes than exist, the stream cannot recover
+                        print(ABORTED.render(label=buffer.label, error=e))
+                        try:
+                            sock.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+                    # the connection is gone, nothing queued can be delivered
+                    self.closed = True
+                    for queued in self.buffers:
+                        if isinstance(queued, FileSegment):
+                            queued.close()
+                    self.buffers.clear()
+                    self.queued_bytes = 0
+                    break
+                self.sent_bytes += sent
+                if streaming:
+                    continue
+                self.queued_bytes -= sent
+                # drop what was written, a message cut short stays at the head
+                written = sent
+                for queued in batch:
+                    if written < len(queued):
+                        self.buffers[0] = queued[written:]
+                        break
+                    written -= len(queued)
+                    self.buffers.popleft()
+                else:
+                    continue
+                break
+            if self.congested_since is not None and self.queued_bytes <= self.low_watermark:
+                self.congested_since = None
+            return not self.buffers
+
+class Timer:
+    """
+    A callback scheduled on a Scheduler. Cancelling only marks it, the heap entry is discarded
+    when it reaches the top.
+    """
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+class Scheduler:
+    """
+    Heap of deadlines for mute expiry and AFK checks. Timers are scheduled once and fire when
+    due, so an idle server does work proportional to the expiring timers rather than to the
+    number of clients. In threaded mode run() waits for the next deadline on its own thread; the
+    event loop instead uses next_timeout() as its select timeout and calls run_due().
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = 0
+        self.condition = threading.Condition()
+        # set by the event loop, wakes its select when another thread adds the earliest timer
+        self.wake = None
+
+    def call_later(self, delay, callback, *args) -> Timer:
+        """
+        Run callback(*args) after delay seconds.
+        Args:
+            delay (float): Seconds from now.
+            callback (callable): The function to call.
+        Returns:
+            Timer: A handle that can be cancelled.
+        """
+        timer = Timer(time.monotonic() + delay, callback, args)
+        with self.condition:
+            heapq.heappush(self.heap, (timer.deadline, self.counter, timer))
+            self.counter += 1
+            if self.heap[0][2] is timer:
+                # the new timer is the earliest, wake the waiting thread to shorten its wait
+                self.condition.notify()
+                if self.wake is not None:
+                    self.wake()
+        return timer
+
+    def next_timeout(self):
+        """
+        Returns:
+            float: Seconds until the earliest timer is due, or None if nothing is scheduled.
+        """
+        with self.condition:
+            if not self.heap:
+                return None
+            return max(0, self.heap[0][0] - time.monotonic())
+
+    def run_due(self) -> None:
+        """
+        Run every timer whose deadline has passed.
+        """
+        now = time.monotonic()
+        due = []
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap)[2])
+        for timer in due:
+            if not timer.cancelled:
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    print(f"Error in scheduled task: {e}")
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+                if timeout is None or timeout > 0:
+                    self.condition.wait(timeout)
+            self.run_due()
+
+def read_frames(path):
+    """
+    Reads the frames of a log segment through a read-only memory mapping. A frame cut short at
+    the end, by a crash in the middle of a write, ends the segment.
+    Args:
+        path (str): The segment file.
+    Yields:
+        bytes: Each frame, header included.
+    """
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            offset = 0
+            while offset + HEADER.size <= size:
+                (length,) = HEADER.unpack_from(mapping, offset)
+                end = offset + HEADER.size + length
+                if end > size:
+                    return
+                yield mapping[offset:end]
+                offset = end
+
+class ChannelLog:
+    """
+    A channel's durable message log, kept in a directory of its own as numbered append-only
+    segment files. Each record is the message's wire frame, exactly as it was broadcast. The
+    active segment is replaced by a new one once it reaches segment_bytes, and the oldest
+    segments are deleted while the log is over retain_bytes. Writes come only from the
+    LogWriter thread.
+    """
+    segment_bytes = 16 << 20
+    retain_bytes = 256 << 20
+
+    def __init__(self, directory, channel_name):
+        self.channel_name = channel_name
+        self.directory = os.path.join(directory, channel_name)
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.segments = sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                               if name.endswith(".log") and name[:-4].isdigit())
+        if self.segments:
+            # drop a record torn by a crash, so new records start on a frame boundary
+            valid = sum(len(frame) for frame in read_frames(self.segments[-1]))
+            os.truncate(self.segments[-1], valid)
+            self.fd = os.open(self.segments[-1], os.O_WRONLY | os.O_APPEND)
+            self.size = valid
+        else:
+            self.fd = None
+            self.rotate()
+
+    def segment_path(self, index) -> str:
+        return os.path.join(self.directory, f"{index:08d}.log")
+
+    def rotate(self) -> None:
+        """
+        Starts a new active segment.
+        """
+        index = int(os.path.basename(self.segments[-1])[:-4]) + 1 if self.segments else 0
+        path = self.segment_path(index)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        # the new file's name has to survive a crash too
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        if self.fd is not None:
+            os.close(self.fd)
+        with self.lock:
+            self.segments.append(path)
+        self.fd = fd
+        self.size = 0
+
+    def compact(self) -> None:
+        """
+        Deletes the oldest segments while the log is larger than retain_bytes, never the active one.
+        """
+        with self.lock:
+            sizes = [os.path.getsize(path) for path in self.segments]
+            while len(self.segments) > 1 and sum(sizes) > self.retain_bytes:
+                os.remove(self.segments.pop(0))
+                sizes.pop(0)
+
+    def write(self, frames) -> None:
+        """
+        Appends frames and makes them durable with one fsync.
+        Args:
+            frames (list): The encoded messages, oldest first.
+        """
+        data = memoryview(b"".join(frames))
+        while data:
+            data = data[os.write(self.fd, data):]
+        self.size += sum(len(frame) for frame in frames)
+        os.fsync(self.fd)
+        if self.size >= self.segment_bytes:
+            self.rotate()
+            self.compact()
+
+    def frames(self):
+        """
+        Yields:
+            bytes: Every logged frame, oldest first.
+        """
+        with self.lock:
+            segments = list(self.segments)
+        for path in segments:
+            try:
+                yield from read_frames(path)
+            except FileNotFoundError:
+                # compacted away while reading
+                continue
+
+    def tail(self, count) -> list:
+        """
+        Args:
+            count (int): The number of frames wanted.
+        Returns:
+            list: The last count logged frames, oldest first.
+        """
+        with self.lock:
+            segments = list(self.segments)
+        frames = []
+        for path in reversed(segments):
+            if len(frames) >= count:
+                break
+            try:
+                frames[:0] = list(read_frames(path))[-(count - len(frames)):]
+            except FileNotFoundError:
+                break
+        return frames
+
+class LogWriter:
+    """
+    Commits the messages of every logged channel to disk from one thread, as a group: a commit
+    writes and fsyncs whatever arrived since the last one, once sync_messages are waiting or
+    sync_interval has passed. Broadcasting only appends to a list, so it never waits for the
+    disk, and the fsync cost is shared by all messages of a commit.
+    """
+    sync_interval = 0.05
+    sync_messages = 256
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.ready = threading.Condition()
+        self.pending = []
+        # serialises commits from the writer thread with those forced by /export and /shutdown
+        self.commit_lock = threading.Lock()
+        self.commits = 0
+
+    def open(self, channel_name) -> ChannelLog:
+        return ChannelLog(self.directory, channel_name)
+
+    def append(self, log, frame) -> None:
+        """
+        Queues a frame for the next commit.
+        Args:
+            log (ChannelLog): The channel's log.
+            frame (bytes): The encoded message.
+        """
+        with self.ready:
+            self.pending.append((log, frame))
+            if len(self.pending) == self.sync_messages:
+                self.ready.notify()
+
+    def commit(self) -> None:
+        """
+        Writes and fsyncs every queued frame.
+        """
+        with self.commit_lock:
+            with self.ready:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return
+            by_log = {}
+            for log, frame in batch:
+                by_log.setdefault(log, []).append(frame)
+            for log, frames in by_log.items():
+                try:
+                    log.write(frames)
+                except OSError as e:
+                    print(LOG_FAILED.render(channel=log.channel_name, error=e))
+            self.commits += 1
+
+    def run(self) -> None:
+        while True:
+            with self.ready:
+                self.ready.wait_for(lambda: len(self.pending) >= self.sync_messages, self.sync_interval)
+            self.commit()
+
+class FlushBatch:
+    """
+    Defers the flushes of every send made on the current thread until the outermost batch ends.
+    Messages queued for one client in the meantime, such as the fan-out of several frames read
+    in one recv, then leave in a single sendmsg call instead of one write each.
+    """
+    local = threading.local()
+
+    def __enter__(self):
+        self.outermost = getattr(FlushBatch.local, "clients", None) is None
+        if self.outermost:
+            FlushBatch.local.clients = {}
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.outermost:
+            clients = FlushBatch.local.clients
+            FlushBatch.local.clients = None
+            flush_clients(list(clients))
+
+    @staticmethod
+    def active() -> bool:
+        """
+        Returns:
+            bool: True if a batch is open on this thread.
+        """
+        return getattr(FlushBatch.local, "clients", None) is not None
+
+    @staticmethod
+    def defer(client) -> bool:
+        """
+        Args:
+            client (Client): a client that has just had bytes queued.
+        Returns:
+            bool: True if a batch is open on this thread and will flush the client when it ends.
+        """
+        clients = getattr(FlushBatch.local, "clients", None)
+        if clients is None:
+            return False
+        clients[client] = None
+        return True
+
+class Coalescer:
+    """
+    Holds back a busy channel's broadcasts so each member's queued messages leave in one write
+    per window instead of one write per message. A broadcast is only held when the previous one
+    was less than window seconds earlier, so a quiet channel still sends every message at once
+    and the latency cost is paid only under load. Held messages are flushed when the window
+    that started with the first of them ends, or as soon as max_bytes are held.
+    """
+    max_bytes = 16384
+
+    def __init__(self, window, scheduler):
+        self.window = window
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.last_broadcast = 0.0
+        # the members with messages held back, and the bytes held for each of them at most
+        self.pending = {}
+        self.pending_bytes = 0
+        self.timer = None
+
+    def busy(self) -> bool:
+        """
+        Records a broadcast.
+        Returns:
+            bool: True if the channel is busy and the broadcast should be held back.
+        """
+        now = time.monotonic()
+        with self.lock:
+            busy = self.timer is not None or now - self.last_broadcast < self.window
+            self.last_broadcast = now
+        return busy
+
+    def hold(self, clients, size) -> None:
+        """
+        Args:
+            clients (list): The members that have just had a message queued without a flush.
+            size (int): The size of the message.
+        """
+        with self.lock:
+            for client in clients:
+                self.pending[client] = None
+            self.pending_bytes += size
+            full = self.pending_bytes >= self.max_bytes
+            if not full and self.timer is None:
+                self.timer = self.scheduler.call_later(self.window, self.flush)
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes out every held message.
+        """
+        with self.lock:
+            clients, self.pending, self.pending_bytes = self.pending, {}, 0
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        flush_clients(list(clients))
+
+class FanoutPool:
+    """
+    Writer threads that flush a large channel's broadcasts in parallel. The broadcasting thread
+    still queues the message in every member's outbox, so each member gets messages in the order
+    they were said, and only the flushes are split: one slice per worker and one the
+    broadcasting thread writes itself before waiting for the others. A sendmsg call runs without
+    the interpreter lock, so the writes to thousands of members go out on several threads at
+    once, and because the broadcast only returns once written, a busy channel cannot queue
+    messages faster than they leave. Only used in threaded mode, the event loop's selector is
+    touched by its own thread alone.
+    """
+    workers = 0
+    # the fewest recipients a broadcast needs to be split across the workers
+    min_members = 256
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = None
+
+    def covers(self, count) -> bool:
+        """
+        Args:
+            count (int): The number of clients a broadcast goes to.
+        Returns:
+            bool: True if their flushes are split across the workers.
+        """
+        return self.workers > 0 and count >= self.min_members
+
+    def flush(self, clients) -> bool:
+        """
+        Flushes a broadcast's recipients together with the workers, started on first use, and
+        returns once every slice has been written or handed to the outbound writer.
+        Args:
+            clients (list): The recipients with the message queued but not yet written.
+        Returns:
+            bool: True if the workers flush the clients, False if there are too few of them, or
+            no workers, and the caller has to.
+        """
+        if not self.covers(len(clients)):
+            return False
+        with self.lock:
+            if self.queues is None:
+                self.queues = [queue.SimpleQueue() for _ in range(self.workers)]
+                for jobs in self.queues:
+                    threading.Thread(target=self.run, args=(jobs,), daemon=True).start()
+        FANOUT_POOLED.add()
+        slices = len(self.queues) + 1
+        done = threading.Semaphore(0)
+        for index, jobs in enumerate(self.queues, 1):
+            jobs.put((clients[index::slices], done))
+        for client in clients[::slices]:
+            client.flush()
+        for _ in self.queues:
+            done.acquire()
+        return True
+
+    def run(self, jobs) -> None:
+        while True:
+            clients, done = jobs.get()
+            try:
+                for client in clients:
+                    client.flush()
+            finally:
+                done.release()
+
+FANOUT_POOL = FanoutPool()
+
+def flush_clients(clients) -> None:
+    """
+    Flushes clients that have had bytes queued without a flush, across the fan-out workers when
+    there are enough of them.
+    Args:
+        clients (list): The clients to flush.
+    """
+    if not FANOUT_POOL.flush(clients):
+        for client in clients:
+            client.flush()
+
+class TokenBucket:
+    """
+    Lets a client send count messages of one kind per seconds, in bursts of up to count. The
+    tokens are topped up from the time elapsed whenever one is taken, so a bucket costs a few
+    arithmetic operations per message and needs no timer or thread.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        count, seconds = limit
+        self.capacity = count
+        self.rate = count / seconds
+        self.tokens = float(count)
+        self.updated = time.monotonic()
+        # set once the client has been told it is sending too fast, until it may send again
+        self.throttled = False
+
+    def take(self) -> bool:
+        """
+        Returns:
+            bool: True if a token was available, and has been taken.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.throttled = False
+        return True
+
+    def wait(self) -> float:
+        """
+        Returns:
+            float: Seconds until the next token.
+        """
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class Client:
+    afk_timeout = 100  # seconds without activity before going AFK
+    # the codecs a client may negotiate with "/compress", and the smallest frame compressed
+    codecs = ("zlib",)
+    compress_min = COMPRESS_MIN
+    # whether a client may switch to the binary protocol with "/protocol binary"
+    binary = True
+
+    def __init__(self, username, connection, address, decoder=None, writer=None):
+        self.username = username
+        self.connection = connection
+        self.address = address
+        # holds bytes received from the client that do not yet form a whole frame
+        self.decoder = decoder if decoder is not None else FrameDecoder()
+        # bytes waiting to be written, drained by the writer when the socket is full
+        self.outbox = Outbox()
+        self.writer = writer
+        self.kicked = False
+        self.in_queue = True
+        self.queued_at = time.monotonic() # queue wait is measured from here
+        self.last_active = time.monotonic() # AFK is measured from here
+        self.idle_timer = None
+        self.muted = False
+        self.mute_until = 0
+        self.mute_timer = None
+        # the channel the client is in or waiting for, which an in-place /switch changes
+        self.channel = None
+        # a TokenBucket per rate limited kind of message, made when the first one is sent
+        self.buckets = {}
+        # the codec frames to the client are compressed with, once negotiated
+        self.codec = None
+
+    def mute_remaining(self) -> int:
+        """
+        Returns:
+            int: Whole seconds left on the client's mute, 0 if not muted.
+        """
+        if not self.muted:
+            return 0
+        return max(0, math.ceil(self.mute_until - time.monotonic()))
+
+    def send(self, msg):
+        """
+        Queue one framed message for the client.
+        Args:
+            msg (str | bytes): the message to send.
+        """
+        frame = encode_frame(msg)
+        if self.codec is not None and len(frame) >= self.compress_min:
+            frame = pack_frame(frame, self.codec)
+        self.send_bytes(frame)
+
+    def send_bytes(self, data, droppable=True, deferred=False):
+        """
+        Queue raw bytes for the client and write as much as possible without blocking, or when
+        the enclosing FlushBatch ends. The rest is handed to the writer. A client evicted by the
+        slow consumer policy is shut down, which its reader sees as a disconnect.
+        Args:
+            data (bytes | FileSegment): the bytes to send, or a file to stream.
+            droppable (bool): whether the bytes may be discarded when the client is congested.
+            deferred (bool): whether the caller flushes the client later, as a Coalescer does.
+        """
+        if not self.outbox.put(data, droppable):
+            if self.outbox.evicted and not self.outbox.closed:
+                self.outbox.closed = True
+                print(TOO_SLOW.render(username=self.username))
+                try:
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            return
+        if not deferred and not FlushBatch.defer(self):
+            self.flush()
+
+    def flush(self):
+        """
+        Write as much of the client's queue as possible without blocking, and hand the rest to
+        the writer.
+        """
+        if not self.outbox.flush(self.connection) and self.writer is not None:
+            self.writer.watch(self)
+
+class UserDirectory:
+    """
+    Server-wide index of where every username is, as {username: {channel name: Client}},
+    covering both channel members and waiting clients. It is kept up to date by the Roster and
+    WaitingRoom of each channel, so every join, leave, switch, kick, AFK and empty is reflected.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+        # called with every change when other worker processes replicate this server's channels
+        self.publish = None
+
+    def add(self, channel_name, client) -> None:
+        with self.lock:
+            self.users.setdefault(client.username, {})[channel_name] = client
+            if self.publish is not None:
+                self.publish(f"+ {channel_name} {client.username} {"waiting" if client.in_queue else "in"}")
+
+    def discard(self, channel_name, client) -> None:
+        with self.lock:
+            places = self.users.get(client.username)
+            if places is not None and places.get(channel_name) is client:
+                del places[channel_name]
+                if not places:
+                    del self.users[client.username]
+                if self.publish is not None:
+                    self.publish(f"- {channel_name} {client.username}")
+
+    def find(self, username, channel_name=None):
+        """
+        Args:
+            username (str): The username to look up.
+            channel_name (str): Restrict the lookup to one channel.
+        Returns:
+            Client | dict: The client in the given channel (or None), or without a channel,
+            a {channel name: Client} dict of everywhere the username is.
+        """
+        with self.lock:
+            places = self.users.get(username, {})
+            if channel_name is not None:
+                return places.get(channel_name)
+            return dict(places)
+
+class Roster:
+    """
+    The clients admitted to a channel, indexed by username so targets of /whisper, /send, /kick
+    and /mute resolve in O(1). It supports the list operations the handlers use (append, remove,
+    len, in) and iterates over a snapshot in join order, so it may be changed while iterating.
+    """
+
+    def __init__(self, channel_name=None, directory=None, on_leave=None):
+        self.channel_name = channel_name
+        self.directory = directory
+        self.on_leave = on_leave  # called after a member is removed, a slot has opened
+        self.members = {}
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, client):
+        return self.members.get(client.username) is client
+
+    def __iter__(self):
+        return iter(list(self.members.values()))
+
+    def get(self, username):
+        """
+        Args:
+            username (str): The username to look up.
+        Returns:
+            Client: The member with that username, or None.
+        """
+        return self.members.get(username)
+
+    def append(self, client) -> None:
+        self.members[client.username] = client
+        if self.directory is not None:
+            self.directory.add(self.channel_name, client)
+
+    def remove(self, client) -> None:
+        if self.members.get(client.username) is not client:
+            raise ValueError(f"{client.username} is not in the channel")
+        del self.members[client.username]
+        if self.directory is not None:
+            self.directory.discard(self.channel_name, client)
+        if self.on_leave is not None:
+            self.on_leave()
+
+class WaitingRoom:
+    """
+    A channel's queue of waiting clients, indexed by username. Enqueue, dequeue and removal of
+    any client are O(1); a client's position is an O(log n) rank query on a Fenwick tree over
+    the arrival tickets. Iteration yields a snapshot in queue order.
+    """
+
+    def __init__(self, channel_name=None, directory=None, on_join=None):
+        self.channel_name = channel_name
+        self.directory = directory
+        self.on_join = on_join  # called after a client is enqueued
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # username -> (ticket, client)
+        self.tree = [0] * 65
+        self.next_ticket = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, username):
+        return username in self.entries
+
+    def __iter__(self):
+        with self.lock:
+            return iter([client for _, client in self.entries.values()])
+
+    def empty(self) -> bool:
+        return not self.entries
+
+    def _update(self, ticket, delta):
+        index = ticket + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def _rank(self, ticket) -> int:
+        # number of clients holding an earlier ticket
+        index, ahead = ticket, 0
+        while index > 0:
+            ahead += self.tree[index]
+            index -= index & -index
+        return ahead
+
+    def _renumber(self):
+        # tickets ran past the tree, hand out fresh ones to the clients still waiting
+        self.tree = [0] * (max(64, 2 * len(self.entries)) + 1)
+        for ticket, (username, (_, client)) in enumerate(self.entries.items()):
+            self.entries[username] = (ticket, client)
+            self._update(ticket, 1)
+        self.next_ticket = len(self.entries)
+
+    def append(self, client) -> None:
+        """
+        Put a client at the back of the queue.
+        Args:
+            client (Client): The client to enqueue.
+        """
+        with self.lock:
+            if self.next_ticket + 1 >= len(self.tree):
+                self._renumber()
+            self.entries[client.username] = (self.next_ticket, client)
+            self._update(self.next_ticket, 1)
+            self.next_ticket += 1
+        if self.directory is not None:
+            self.directory.add(self.channel_name, client)
+        if self.on_join is not None:
+            self.on_join()
+
+    def popleft(self):
+        """
+        Take the client at the front of the queue.
+        Returns:
+            Client: The dequeued client, or None if the queue is empty.
+        """
+        with self.lock:
+            if not self.entries:
+                return None
+            _, (ticket, client) = self.entries.popitem(last=False)
+            self._update(ticket, -1)
+        if self.directory is not None:
+            self.directory.discard(self.channel_name, client)
+        return client
+
+    def remove(self, client):
+        """
+        Take a client out of the queue wherever it is.
+        Args:
+            client (Client): The client to remove.
+        Returns:
+            int: The position the client had, or None if it was not waiting.
+        """
+        with self.lock:
+            entry = self.entries.get(client.username)
+            if entry is None or entry[1] is not client:
+                return None
+            ticket = entry[0]
+            position = self._rank(ticket)
+            del self.entries[client.username]
+            self._update(ticket, -1)
+        if self.directory is not None:
+            self.directory.discard(self.channel_name, client)
+        return position
+
+    def position(self, client):
+        """
+        Args:
+            client (Client): A waiting client.
+        Returns:
+            int: The number of clients ahead of it, or None if it is not waiting.
+        """
+        with self.lock:
+            entry = self.entries.get(client.username)
+            if entry is None or entry[1] is not client:
+                return None
+            return self._rank(entry[0])
+
+class Channel:
+    # the port every channel is reached through when the server listens on a single port
+    shared_port = None
+    # whether /switch moves the client over its open connection rather than having it reconnect
+    switch_in_place = False
+
+    def __init__(self, name, port, capacity, directory=None, scheduler=None, transfers=None, history=0, limits=None,
+                 coalesce=0, backlog=0):
+        self.name = name
+        self.port = port
+        self.capacity = capacity
+        # the connections the kernel may hold before they are accepted, the capacity if not set
+        self.backlog = backlog or capacity
+        # (count, seconds) of each rate limited kind of message, per client; other kinds are unlimited
+        self.limits = limits if limits is not None else {}
+        # the last messages said in the channel as encoded frames, replayed to every client admitted
+        self.history = collections.deque(maxlen=history) if history else None
+        # the durable log and the writer committing it, when logging is enabled
+        self.log = None
+        self.log_writer = None
+        self.directory = directory
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.transfers = transfers if transfers is not None else TransferRegistry(self.scheduler)
+        # holds back broadcasts for up to coalesce milliseconds while the channel is busy
+        self.coalescer = Coalescer(coalesce / 1000, self.scheduler) if coalesce else None
+        # signalled whenever a client starts waiting or a member leaves
+        self.admission = threading.Condition()
+        self.admission_listener = None
+        self.queue = WaitingRoom(name, directory, self.admission_changed)
+        self.clients = Roster(name, directory, self.admission_changed)
+        # set when another worker process serves the channel
+        self.replica = None
+        # this channel's metrics, listed by /stats
+        self.metrics_prefix = f"channel.{name}."
+        # counts the messages broadcast too
+        self.fanout_latency = METRICS.histogram(self.metrics_prefix + "fanout_us")
+        self.received_bytes = METRICS.counter(self.metrics_prefix + "received_bytes")
+        self.throttled = METRICS.counter(self.metrics_prefix + "throttled")
+        self.queue_wait = METRICS.histogram(self.metrics_prefix + "queue_wait_us")
+        METRICS.gauge(self.metrics_prefix + "members", lambda: len(self.clients))
+        METRICS.gauge(self.metrics_prefix + "queue", lambda: len(self.queue))
+
+    def admission_changed(self):
+        """
+        Wakes whatever admits this channel's waiting clients: the process_queue thread, or the
+        event loop through admission_listener.
+        """
+        with self.admission:
+            self.admission.notify()
+        if self.admission_listener is not None:
+            self.admission_listener(self)
+
+    def can_admit(self) -> bool:
+        """
+        Returns:
+            bool: True if a client is waiting and the channel has a free slot.
+        """
+        return not self.queue.empty() and len(self.clients) < self.capacity
+
+    def remember(self, frame) -> None:
+        """
+        Keeps a message for replay, dropping the oldest once the history is full, and queues it
+        for the channel's log.
+        Args:
+            frame (bytes): The encoded message.
+        """
+        if self.history is not None:
+            self.history.append(frame)
+        if self.log is not None:
+            self.log_writer.append(self.log, frame)
+
+    def start_log(self, writer) -> None:
+        """
+        Opens the channel's log, and fills its history from the messages logged before a restart.
+        Args:
+            writer (LogWriter): The writer committing the log.
+        """
+        self.log = writer.open(self.name)
+        self.log_writer = writer
+        if self.history is not None:
+            self.history.extend(self.log.tail(self.history.maxlen))
+
+    def replay(self, client) -> None:
+        """
+        Sends a newly admitted client the channel's history in a single write, queued like any
+        other message so a slow client cannot hold up the channel.
+        Args:
+            client (Client): The admitted client.
+        """
+        if self.history:
+            client.send_bytes(b"".join(tuple(self.history)))
+
+    def counts(self) -> tuple:
+        """
+        Returns:
+            tuple: the number of members and of waiting clients, as last published by the
+            worker serving the channel when that is another process.
+        """
+        if self.replica is not None:
+            return len(self.replica.members), len(self.replica.waiting)
+        return len(self.clients), len(self.queue)
+
+    def switch_message(self) -> str:
+        """
+        Returns:
+            str: the "/switch" instruction telling a client how to connect to this channel,
+            "/switch <port> <channel>" when all channels share one port.
+        """
+        if Channel.shared_port is None:
+            return f"/switch {self.port}"
+        return f"/switch {Channel.shared_port} {self.name}"
+
+class ShardReplica:
+    """
+    What a worker process knows of a channel another worker serves: the usernames in it and
+    waiting for it, kept up to date from the changes the owner publishes over the control plane.
+    """
+
+    def __init__(self, link):
+        self.link = link
+        self.members = set()
+        self.waiting = set()
+
+    def apply(self, change) -> None:
+        """
+        Args:
+            change (list): A published change, ["+", channel, username, "in" | "waiting"]
+            or ["-", channel, username].
+        """
+        username = change[2]
+        self.members.discard(username)
+        self.waiting.discard(username)
+        if change[0] == "+":
+            (self.waiting if change[3] == "waiting" else self.members).add(username)
+
+    def state(self, username):
+        """
+        Returns:
+            str: "in" or "waiting for" the channel, or None if the username is not there.
+        """
+        if username in self.members:
+            return "in"
+        if username in self.waiting:
+            return "waiting for"
+        return None
+
+def parse_config(config_file: str, max_capacity: int = 5) -> list:
+    """
+    Parses lines from a given configuration file and VALIDATE the format of each line. The 
+    function validates each part and if valid returns a list of tuples where each tuple contains
+    (channel_name, channel_port, channel_capacity, channel_history, channel_limits, channel_coalesce, channel_backlog).
+    The function also ensures that there are no duplicate channel names or ports. if not valid, exit with status code 1.
+    A channel line may end with "name=value" settings, e.g.
+    "channel general 9000 5 history=50 chat=10/5 send=2/60 coalesce=5 backlog=128".
+    Status: TODO
+    Args:
+        config_file (str): The path to the configuration file (e.g, config_01.txt).
+        max_capacity (int): The largest capacity a channel may have, above 5 for large channels.
+    Returns:
+        list: A list of tuples where each tuple contains:
+        (channel_name, channel_port, channel_capacity, channel_history, channel_limits, channel_coalesce, and
+        channel_backlog)
+    Raises:
+        SystemExit: If there is an error in the configuration file format.
+    """
+    # Write your code here...
+    # try open file
+    try: 
+        with open(config_file, "r") as file:
+            # Read all lines from the file and strip whitespace characters
+            lines = [line.strip().split() for line in file]
+            c_name = 1
+            port = 2
+            capacity = 3
+            config = []
+            c_name_check = []
+            port_check = []
+
+            for line in lines:
+                if len(line) < 4 or (len(line) > 4 and line[0] != "channel"):
+                    # print("bad length")
+                    file.close()
+                    sys.exit(1)
+                elif line[0] == "channel":
+                    if not line[c_name].isalpha():
+                        # print("name not str")
+                        file.close()
+                        sys.exit(1)
+                    elif not line[port].isdigit():
+                        # print("port not digit")
+                        file.close()
+                        sys.exit(1)
+                    elif not line[capacity].isdigit():
+                        # print("capacity not digit")
+                        file.close()
+                        sys.exit(1)
+                    elif int(line[capacity]) < 1 or int(line[capacity]) > max_capacity:
+                        # print("capacity < 1 or > max_capacity")
+                        file.close()
+                        sys.exit(1)
+                    if line[c_name] in c_name_check:
+                        # dup name
+                        file.close()
+                        sys.exit(1)
+                    c_name_check.append(line[c_name])
+                    if line[port] in port_check:
+                        # Exit if the port number already exists
+                        file.close()
+                        sys.exit(1)
+                    port_check.append(line[port])
+                    settings = parse_channel_settings(line[4:])
+                    if settings is None:
+                        file.close()
+                        sys.exit(1)
+                    # Append the validated configuration to the config list
+                    limits = {kind: settings[kind] for kind in RATE_LIMITED if settings[kind] is not None}
+                    new_config = (line[1], int(line[2]), int(line[3]), settings["history"], limits,
+                                  settings["coalesce"], settings["backlog"])
+                    config.append(new_config)
+        file.close()
+        if len(port_check) == 2:
+            sys.exit(1)
+    
+    except FileNotFoundError:
+        # print("file not found")
+        file.close()
+        sys.exit(1)
+    except IOError:
+        # print("io error")
+        file.close()
+        sys.exit(1)
+    # Return the processed lines
+    return config
+
+def parse_channel_settings(tokens):
+    """
+    Parses the optional "name=value" settings of a channel line. A rate limit's value is
+    "<count>/<seconds>", the others are whole numbers.
+    Args:
+        tokens (list): The tokens after the channel's capacity.
+    Returns:
+        dict: Every setting in CHANNEL_SETTINGS, defaults filled in, or None if a token is
+        not a known setting with a valid value.
+    """
+    settings = dict(CHANNEL_SETTINGS)
+    for token in tokens:
+        name, sep, value = token.partition("=")
+        if not sep or name not in settings:
+            return None
+        if name in RATE_LIMITED:
+            count, slash, seconds = value.partition("/")
+            if not slash or not count.isdigit() or not seconds.isdigit() or int(count) < 1 or int(seconds) < 1:
+                return None
+            settings[name] = (int(count), int(seconds))
+        elif value.isdigit():
+            settings[name] = int(value)
+        else:
+            return None
+    if settings["history"] > MAX_HISTORY or settings["coalesce"] > MAX_COALESCE_MS or \
+            settings["backlog"] > MAX_LARGE_CAPACITY:
+        return None
+    return settings
+
+def get_channels_dictionary(parsed_lines, scheduler=None) -> dict:
+    """
+    Creates a dictionary of Channel objects from parsed lines.
+    Status: Given
+    Args:
+        parsed_lines (list): A list of tuples where each tuple contains:
+        (channel_name, channel_port, channel_capacity, channel_history, channel_limits, channel_coalesce, and
+        channel_backlog)
+        scheduler (Scheduler): The timer scheduler shared by the channels, a new one if not given.
+    Returns:
+        dict: A dictionary of Channel objects where the key is the channel name.
+    """
+    channels = {}
+    # one username index, one timer heap and one transfer table shared by every channel
+    directory = UserDirectory()
+    if scheduler is None:
+        scheduler = Scheduler()
+    transfers = TransferRegistry(scheduler)
+
+    for (channel_name, channel_port, channel_capacity, channel_history, channel_limits, channel_coalesce,
+         channel_backlog) in parsed_lines:
+        channels[channel_name] = Channel(channel_name, channel_port, channel_capacity, directory, scheduler, transfers,
+                                         channel_history, channel_limits, channel_coalesce, channel_backlog)
+
+    return channels
+
+def quit_client(client, channel) -> None:
+    """
+    Implement client quitting function
+    Status: TODO
+    """
+    # if client is in queue
+    if client.in_queue:
+        # Write your code here...
+        # remove, close connection, and print quit message in the server.
+        removed_at = channel.queue.remove(client)
+        if removed_at is not None:
+            notify_queue_positions(channel.queue, removed_at)
+        client.in_queue = False
+
+    # if client is in channel
+    if client in channel.clients:
+        # Write your code here...
+        # remove client from the channel, close connection, and broadcast quit message to all clients.
+        channel.clients.remove(client)
+    left_msg = LEFT.render(username=client.username)
+    fan_out(channel.clients, left_msg)
+    hang_up(client.connection)
+
+def disconnect_client(client, channel) -> None:
+    """
+    Removes a client whose session has ended and logs the departure on the server.
+    Args:
+        client (Client): The client that left.
+        channel (Channel): The channel the client was in.
+    """
+    quit_client(client, channel)
+    left_msg = LEFT.render(username=client.username)
+    print(left_msg)
+    
+def within_limit(client, channel, kind) -> bool:
+    """
+    Takes a token from the client's bucket for a kind of message, when the channel limits it.
+    A client out of tokens is told so once, rather than for every message it keeps sending.
+    Args:
+        client (Client): The client sending.
+        channel (Channel): The channel in which the client is.
+        kind (str): One of RATE_LIMITED.
+    Returns:
+        bool: True if the message may be handled.
+    """
+    limit = channel.limits.get(kind)
+    if limit is None:
+        return True
+    bucket = client.buckets.get(kind)
+    if bucket is None or bucket.limit != limit:
+        # first message of the kind, or the client moved to a channel with another limit
+        bucket = client.buckets[kind] = TokenBucket(limit)
+    if bucket.take():
+        return True
+    channel.throttled.add()
+    if not bucket.throttled:
+        bucket.throttled = True
+        client.send(THROTTLED.render(kind=kind, seconds=bucket.wait()))
+    return False
+
+def send_client(client, channel, args) -> None:
+    """
+    Implement file sending function, if args for /send are valid.
+    Else print appropriate message and return.
+    Status: TODO
+    Args:
+        client (Client): The sender.
+        channel (Channel): The channel in which the client is.
+        args (list): The command's arguments, the target's username and the file path.
+    """
+    # Write your code here...
+    # if in queue, do nothing
+    if client.in_queue:
+        return
+    else:
+        # if muted, send mute message to the client
+        if client.muted:
+            mute_msg = STILL_MUTED.render(seconds=client.mute_remaining())
+            client.send(mute_msg)
+            return
+        # if not muted, process the file sending
+        else:
+            if not within_limit(client, channel, "send"):
+                return
+            # validate the command structure
+            if len(args) != 2:
+                usage_msg = SEND_USAGE.render()
+                client.send(usage_msg)
+                return
+            target_username, target_file_path = args
+
+            # check for target existance
+            target = channel.clients.get(target_username)
+            target_exist = target is not None
+            if not target_exist:
+                client.send(NOT_HERE.render(username=target_username))
+
+            # check for file existence
+            file_exist = True
+            if not os.path.isfile(target_file_path):
+                file_exist = False
+                client.send(DOES_NOT_EXIST.render(name=target_file_path))
+            
+            # check if receiver is in the channel, and stream the file from disk behind its header
+            if target_exist and file_exist:
+                try:
+                    transfer = channel.transfers.create(target_file_path, client.username, target_username)
+                    segment = open_segment(transfer, target)
+                except OSError:
+                    client.send(DOES_NOT_EXIST.render(name=target_file_path))
+                    return
+                target.send_bytes(segment.announce(), droppable=False)
+                target.send_bytes(segment, droppable=False)
+                SEND_FILES.add()
+                print(SENT.render(username=client.username, path=target_file_path, target=target_username))
+                client.send(YOU_SENT.render(path=target_file_path, target=target_username))
+
+def resume_transfer(client, channel, args) -> None:
+    """
+    Restarts an interrupted transfer to its recipient from the offset the recipient already has.
+    Args:
+        client (Client): The recipient asking to resume.
+        channel (Channel): The channel in which the client is.
+        args (list): The "/resume" arguments, the transfer id and the offset as an int.
+    """
+    if client.in_queue:
+        return
+    if len(args) != 2 or not isinstance(args[1], int):
+        client.send(RESUME_USAGE.render())
+        return
+    transfer = channel.transfers.get(args[0], client.username)
+    offset = args[1]
+    # the recipient cannot hold bytes the server never streamed
+    if transfer is None or offset > transfer.streamed:
+        client.send(NO_TRANSFER.render())
+        return
+    try:
+        segment = open_segment(transfer, client, offset)
+    except OSError:
+        channel.transfers.discard(transfer)
+        client.send(NO_LONGER_AVAILABLE.render(filename=transfer.filename))
+        return
+    channel.transfers.touch(transfer)
+    client.send_bytes(segment.announce(), droppable=False)
+    client.send_bytes(segment, droppable=False)
+    print(RESUMED.render(username=client.username, filename=transfer.filename, offset=segment.start))
+
+def negotiate_compression(client, args) -> None:
+    """
+    Agrees on the first codec the client offers that the server allows, and replies with it, or
+    with "none", before anything is compressed. From then on frames to and from the client of at
+    least compress_min bytes may be compressed with it.
+    Args:
+        client (Client): The client.
+        args (list): The codecs offered, in the client's order of preference.
+    """
+    # a binary offer is a single field of space separated codecs
+    codec = next((name for arg in args for name in arg.split() if name in Client.codecs), None)
+    client.send_bytes(encode_frame(f"/compress {codec or 'none'}"), droppable=False)
+    client.codec = codec
+    client.decoder.codec = codec
+
+def negotiate_protocol(client, args) -> None:
+    """
+    Lets a client send binary frames from now on, if it asks for "binary" and the server allows
+    it, and replies with the protocol the client may use: "binary" or "text". Text frames are
+    accepted either way.
+    Args:
+        client (Client): The client.
+        args (list): The "/protocol" arguments, the name of the protocol asked for.
+    """
+    binary = Client.binary and args == ["binary"]
+    client.decoder.typed = binary
+    client.send_bytes(encode_frame(f"/protocol {'binary' if binary else 'text'}"), droppable=False)
+
+def confirm_transfer(client, channel, args) -> None:
+    """
+    Checks the checksum a recipient computed over a received file against the sender's, and
+    forgets the transfer once they match.
+    Args:
+        client (Client): The recipient.
+        channel (Channel): The channel in which the client is.
+        args (list): The "/received" arguments, the transfer id and the sha256 of the file.
+    """
+    if len(args) != 2:
+        return
+    transfer = channel.transfers.get(args[0], client.username)
+    if transfer is None:
+        return
+    if args[1] == transfer.checksum:
+        channel.transfers.discard(transfer)
+        print(VERIFIED.render(username=client.username, filename=transfer.filename))
+    else:
+        print(CORRUPT.render(username=client.username, filename=transfer.filename))
+
+def list_clients(client, channels) -> None:
+    """
+    List all channels and their capacity
+    Status: TODO
+    """
+    # Write your code here...
+    #[ Channel] < channel_name > <channel_port> Capacity: <current >/ < capacity >,Queue: < in_queue>
+    for channel in channels.values():
+        members, waiting = channel.counts()
+        msg = f"[Channel] {channel.name} {channel.port} Capacity: {members}/ {channel.capacity}, Queue: {waiting}."
+        client.send(msg)
+
+def whisper_client(client, channel, args) -> None:
+    """
+    Implement whisper function, if args for /whisper are valid.
+    Else print appropriate message and return.
+    Status: TODO
+    Args:
+        client (Client): The client whispering.
+        channel (Channel): The channel in which the client is.
+        args (list): The command's arguments, the target's username and the message.
+    """
+    # Write your code here...
+    # if in queue, do nothing
+    if client.in_queue:
+        return
+    else:
+        # if muted, send mute message to the client
+        if client.muted:
+            pass
+        elif within_limit(client, channel, "whisper"):
+            # validate the command structure
+            if len(args) != 2:
+                usage_msg = WHISPER_USAGE.render()
+                client.send(usage_msg)
+                return
+            
+            target_name, whisper = args
+            # validate if the target user is in the channel
+            target = channel.clients.get(target_name)
+            target_exist = target is not None
+            if target_exist:
+                # if target user is in the channel, send the whisper message
+                whisper_msg = f"[{client.username} whispers to you: ({timestamp()})] {whisper}"
+                target.send(whisper_msg)
+            
+            # print whisper server message
+            if target_exist:
+                print(f"[{client.username} whispers to {target.username}: ({timestamp()})] {whisper}")
+            else:
+                failed_whisper = NOT_HERE.render(username=target_name)
+                client.send(failed_whisper)
+
+def switch_channel(client, channel, args, channels) -> bool:
+    """
+    Implement channel switching function, if args for /switch are valid.
+    Else print appropriate message and return.
+    Args:
+        client (Client): The switching client.
+        channel (Channel): The channel in which the client is.
+        args (list): The command's arguments, the name of the channel to switch to.
+        channels (dict): A dictionary of all channels.
+
+    Returns:
+        bool: True if the client was told to reconnect and its session here has ended, so
+        nothing buffered behind the /switch is handled in the old channel.
+    Status: TODO
+    """
+    # Write your code here...
+    # validate the command structure
+    if len(args) != 1:
+        usage_msg = SWITCH_USAGE.render()
+        client.send(usage_msg)
+        return False
+    
+    target_channel_name = args[0]
+
+    # check if the new channel exists
+    target_channel = channels.get(target_channel_name)
+    if target_channel is None:
+        invalid_target = DOES_NOT_EXIST.render(name=target_channel_name)
+        client.send(invalid_target)
+        return False
+    # check if there is a client with the same username in the new channel, and move the client
+    # there in place unless another worker process serves it, which takes a reconnect
+    in_place = Channel.switch_in_place and target_channel.replica is None
+    with registration_lock:
+        if not check_duplicate_username(client.username, target_channel, client.connection):
+            duplicate_username = DUPLICATE_NAME.render(channel=target_channel.name, username=client.username)
+            client.send(duplicate_username)
+            return False
+        if in_place:
+            move_client(client, channel, target_channel)
+            return False
+    user_left_msg = LEFT.render(username=client.username)
+    # if all checks are correct, and client in queue
+    if client.in_queue:
+        # remove client from current channel queue
+        remove_item(channel.queue, client)
+        # broadcast queue update message to all clients in the current channel
+
+        # tell client to connect to new channel and close connection
+        switch_msg = target_channel.switch_message()
+        client.send_bytes(encode_frame(switch_msg), droppable=False)
+        client.flush()
+        client.connection.close()
+        print(user_left_msg)
+
+    # if all checks are correct, and client in channel
+    else:
+        # remove client from current channel
+        channel.clients.remove(client)
+        # tell client to connect to new channel and close connection
+        switch_msg = target_channel.switch_message()
+        client.send_bytes(encode_frame(switch_msg), droppable=False)
+        client.flush()
+        client.connection.close()
+        print(user_left_msg)
+        fan_out(channel.clients, user_left_msg)
+    return True
+
+def move_client(client, channel, target_channel) -> None:
+    """
+    Moves a client from a channel, or its queue, into another channel or that channel's queue
+    over the client's open connection, as an in-place /switch. The old channel is told the client
+    left and the client is welcomed to the new one, as if it had reconnected.
+    Args:
+        client (Client): The switching client.
+        channel (Channel): The channel the client is leaving.
+        target_channel (Channel): The channel the client is joining.
+    """
+    user_left_msg = LEFT.render(username=client.username)
+    if client.in_queue:
+        remove_item(channel.queue, client)
+    else:
+        channel.clients.remove(client)
+        fan_out(channel.clients, user_left_msg)
+    print(user_left_msg)
+    if client.idle_timer is not None:
+        client.idle_timer.cancel()
+        client.idle_timer = None
+    client.channel = target_channel
+    # a mute follows the client, and ends in the channel it is now in
+    if client.mute_timer is not None:
+        client.mute_timer.cancel()
+        remaining = max(0.0, client.mute_until - time.monotonic())
+        client.mute_timer = target_channel.scheduler.call_later(remaining, unmute_client, client, target_channel)
+    client.send(WELCOME.render(channel=target_channel.name, username=client.username))
+    position_client(target_channel, client.connection, client.username, client)
+
+def broadcast_in_channel(client, channel, msg):
+    """
+    Broadcast a message to all clients in the channel.
+    Status: TODO
+    Returns:
+        bytes: The frame that was sent, or None if the client may not broadcast.
+    """
+    # Write your code here...
+    # if in queue, do nothing
+    if client.in_queue:
+        return
+
+    # if muted, send mute message to the client
+    if client.muted:
+        mute_msg = STILL_MUTED.render(seconds=client.mute_remaining())
+        client.send(mute_msg)
+        return
+
+    # broadcast message to all clients in the channel, timing how long queueing it for everyone takes
+    start = time.perf_counter()
+    frame = fan_out(channel.clients, msg, channel.coalescer)
+    channel.fanout_latency.record(time.perf_counter() - start)
+    return frame
+
+def fan_out(recipients, msg, coalescer=None) -> bytes:
+    """
+    Sends one message to many clients. The message is framed once and every recipient's outbox
+    queues the same bytes.
+    Args:
+        recipients (iterable): The clients to send to.
+        msg (str): The message.
+        coalescer (Coalescer): The channel's coalescer, which may hold the message back.
+    Returns:
+        bytes: The frame that was sent.
+    """
+    frame = encode_frame(msg)
+    # a long message is compressed once per codec, for every recipient that negotiated it
+    large = len(frame) >= Client.compress_min
+    packed = {}
+    hold = coalescer is not None and coalescer.busy()
+    recipients = list(recipients)
+    # a large channel's writes are left to the fan-out workers, unless a batch is already open
+    pooled = not hold and FANOUT_POOL.covers(len(recipients)) and not FlushBatch.active()
+    for cl in recipients:
+        data = frame
+        if large and cl.codec is not None:
+            data = packed.get(cl.codec)
+            if data is None:
+                data = packed[cl.codec] = pack_frame(frame, cl.codec)
+        cl.send_bytes(data, deferred=hold or pooled)
+    if hold:
+        coalescer.hold(recipients, len(frame))
+    elif pooled:
+        FANOUT_POOL.flush(recipients)
+    return frame
+
+def parse_message(frame):
+    """
+    Works out which command a message from a client is, and its arguments. A text message is
+    the command whose prefix in TEXT_COMMANDS it starts with, its arguments the words after the
+    command, or chat. A binary frame names its command by opcode and its arguments are the
+    decoded fields, so chat is never taken for a command whatever it starts with.
+    Args:
+        frame (bytes): The payload of the frame.
+    Returns:
+        tuple: The name of the command and the list of its arguments, or "chat" and the message.
+        An argument that is a number in COMMANDS is an int, in either form.
+    Raises:
+        FrameError: If the frame is not UTF-8 or a binary frame is malformed.
+    """
+    try:
+        if isinstance(frame, BinaryFrame):
+            if frame[:1] == CHAT_OPCODE:
+                # the frame type of most messages, its only field is the rest of the frame
+                return "chat", frame[1:].decode()
+            return decode_command(frame)
+        msg = frame.decode()
+    except UnicodeDecodeError as e:
+        raise FrameError(f"not UTF-8: {e}")
+    if msg.startswith("/"):
+        for prefix in TEXT_COMMANDS:
+            if msg.startswith(prefix):
+                args = msg.split()[1:]
+                kinds = COMMANDS.get(prefix[1:], (None, ""))[1]
+                for index, kind in enumerate(kinds[:len(args)]):
+                    if kind == "q" and args[index].isdigit():
+                        args[index] = int(args[index])
+                return prefix[1:], args
+    return "chat", msg
+
+def quit_session(client, channel, channels, args) -> bool:
+    """
+    Handles "/quit": disconnects the client, or replies with the usage if it has arguments.
+    Returns:
+        bool: True if the client has been disconnected.
+    """
+    if args:
+        usage_msg = QUIT_USAGE.render()
+        client.send(usage_msg)
+        return False
+    disconnect_client(client, channel)
+    return True
+
+def list_command(client, channel, channels, args) -> None:
+    """
+    Handles "/list": lists the channels, or replies with the usage if it has arguments.
+    """
+    if args:
+        usage_msg = LIST_USAGE.render()
+        client.send(usage_msg)
+    else:
+        list_clients(client, channels)
+
+def say(client, channel, channels, msg) -> None:
+    """
+    Broadcasts a chat message to all clients in the channel. A client over its chat limit is
+    throttled instead of having its message fanned out.
+    """
+    if not (client.in_queue or client.muted or within_limit(client, channel, "chat")):
+        return
+    # a muted client's message is never delivered, so it is not rendered
+    b_msg = None if client.muted else f"[{client.username} ({timestamp()})] {msg}"
+    if b_msg is not None:
+        print(b_msg)
+    frame = broadcast_in_channel(client, channel, b_msg)
+    if frame is not None:
+        channel.remember(frame)
+
+# the handler of each command, called with the client, its channel, every channel and the
+# arguments parse_message decoded, the message for chat; a handler returning True has ended the
+# client's session
+COMMAND_HANDLERS = {
+    "quit": quit_session,
+    "send": lambda client, channel, channels, args: send_client(client, channel, args),
+    "resume": lambda client, channel, channels, args: resume_transfer(client, channel, args),
+    "compress": lambda client, channel, channels, args: negotiate_compression(client, args),
+    "protocol": lambda client, channel, channels, args: negotiate_protocol(client, args),
+    "received": lambda client, channel, channels, args: confirm_transfer(client, channel, args),
+    "list": list_command,
+    "whisper": lambda client, channel, channels, args: whisper_client(client, channel, args),
+    "switch": lambda client, channel, channels, args: switch_channel(client, channel, args, channels),
+    "chat": say,
+}
+
+def handle_message(client, channel, channels, frame) -> bool:
+    """
+    Dispatches a single message received from a client, a text or a binary frame, to the
+    handler of its command. Supports commands to quit, send, switch, whisper, and list channels,
+    and broadcasts chat to the channel.
+    Args:
+        client (Client): The client that sent the message.
+        channel (Channel): The channel in which the client is.
+        channels (dict): A dictionary of all channels.
+        frame (bytes): The payload of the frame.
+    Returns:
+        bool: True if the client's session has ended and it should no longer be served.
+    """
+    try:
+        command, args = parse_message(frame)
+    except FrameError as e:
+        client.send(MALFORMED.render(error=e))
+        return False
+    if COMMAND_HANDLERS[command](client, channel, channels, args):
+        return True
+
+    # reset remaining time before AFK
+    if not client.muted:
+        client.last_active = time.monotonic()
+    return False
+
+def handle_data(client, channel, channels, data) -> bool:
+    """
+    Feeds bytes received from a client into its frame decoder and dispatches every complete
+    message, so several messages read in one recv are all handled. Their output is flushed
+    together once all of them are handled. Messages after an in-place /switch are handled in
+    the channel the client moved to.
+    Args:
+        client (Client): The client that sent the data.
+        channel (Channel): The channel in which the client is, client.channel once it is registered.
+        channels (dict): A dictionary of all channels.
+        data (bytes): The bytes received.
+    Returns:
+        bool: True if the client's session has ended and it should no longer be served.
+    """
+    if data:
+        (client.channel or channel).received_bytes.add(len(data))
+    client.decoder.feed(data)
+    with FlushBatch():
+        for frame in client.decoder:
+            if handle_message(client, client.channel or channel, channels, frame):
+                return True
+    return False
+
+def client_handler(client, channel, channels) -> None:
+    """
+    Handles incoming messages from a client in a channel. Supports commands to quit, send, switch, whisper, and list channels. 
+    Manages client"s mute status and remaining time. Handles client disconnection and exceptions during message processing.
+    Status: TODO (check the "# Write your code here..." block in Exception)
+    Args:
+        client (Client): The client to handle.
+        channel (Channel): The channel the client registered in, it may /switch in place later.
+        channels (dict): A dictionary of all channels.
+    """
+    HANDLER_THREADS.add()
+    try:
+        # frames that arrived right behind the username are already buffered
+        data = b""
+        while True:
+            if client.kicked:
+                break
+            try:
+                if handle_data(client, channel, channels, data):
+                    break
+                data = client.connection.recv(65536)
+                if not data:
+                    # peer closed the connection, unless the server already dropped the client
+                    if not client.kicked:
+                        disconnect_client(client, client.channel)
+                    break
+            except EOFError:
+                continue
+            except OSError:
+                # a reset peer has left too, a socket the server closed itself has already been handled
+                if not client.kicked and client.connection.fileno() != -1:
+                    disconnect_client(client, client.channel)
+                break
+            except Exception as e:
+                print(f"Error in client handler: {e}")
+                # remove client from the channel, close connection
+                # Write your code here...
+                quit_client(client, client.channel)
+                # the connection is closed, and what is left in the decoder would fail again
+                break
+    finally:
+        HANDLER_THREADS.add(-1)
+
+def check_duplicate_username(username, channel, conn) -> bool:
+    """
+    Check if a username is already in a channel or its queue.
+    Status: TODO
+    """
+    # Write your code here...
+    if channel.replica is not None:
+        # another worker serves the channel
+        return channel.replica.state(username) is None
+    found = channel.clients.get(username) is not None or username in channel.queue
+    return not found
+
+def position_client(channel, conn, username, new_client) -> None:
+    """
+    Place a client in a channel or queue based on the channel"s capacity.
+    Status: TODO
+    """
+    # Write your code here...
+    if len(channel.clients) < channel.capacity and channel.queue.empty():
+        # put client in channel and reset remaining time before AFK
+        new_client.in_queue = False
+        channel.clients.append(new_client)
+        channel.replay(new_client)
+        start_idle_timer(new_client, channel)
+        # a client switching in place may be muted, which must not hold back its arrival
+        fan_out(channel.clients, JOINED.render(username=username))
+        print(JOINED_CHANNEL.render(username=username, channel=channel.name))
+    else:
+        # put client in queue
+        new_client.in_queue = True
+        new_client.queued_at = time.monotonic()
+        channel.queue.append(new_client)
+        msg = WAITING_ROOM.render(channel=channel.name, username=username)
+        new_client.send(msg)
+        # Message the new client its place in the queue
+        count = channel.queue.position(new_client)
+        msg = QUEUE_POSITION.render(count=count)
+        new_client.send(msg)
+
+def channel_handler(channel, channels, writer) -> None:
+    """
+    Starts a chat server, manage channels, respective queues, and incoming clients.
+    This initiates different threads for chanel queue processing and client handling.
+    Status: Given
+    Args:
+        channel (Channel): The channel for which to start the server.
+        channels (dict): A dictionary of all channels.
+        writer (OutboundWriter): The writer draining client outboxes.
+    Raises:
+        EOFError: If there is an error in the client-server communication.
+    """
+    # Initialize server socket, bind, and listen
+    server_socket = listen_on(channel.port, channel.backlog)
+
+    # launch a thread to process client queue
+    queue_thread = threading.Thread(target=process_queue, args=(channel,))
+    queue_thread.start()
+
+    accept_clients(server_socket, channels, writer, channel)
+
+def listen_on(port, backlog, reuse_port=False):
+    """
+    Opens a listening TCP socket on localhost.
+    Args:
+        port (int): The port to listen on.
+        backlog (int): The number of pending connections the kernel may hold.
+        reuse_port (bool): Whether other worker processes listen on the same port, the kernel
+        then spreads new connections across them.
+    Returns:
+        socket.socket: The listening socket.
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # connections the server closed first linger in TIME_WAIT, they must not block a restart
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind(("localhost", port))
+    server_socket.listen(backlog)
+    return server_socket
+
+def raise_file_limit(channels) -> None:
+    """
+    Raises the soft limit on open file descriptors, up to the hard limit, so every member and
+    pending connection of the channels can have a socket. A few small channels fit the default.
+    Args:
+        channels (dict): A dictionary of all channels.
+    """
+    # a socket per member and per pending connection, and some for files, logs and listeners
+    wanted = sum(channel.capacity + channel.backlog for channel in channels.values()) + 256
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        if hard != resource.RLIM_INFINITY:
+            wanted = min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+def accept_clients(server_socket, channels, writer, channel=None) -> None:
+    """
+    Accepts connections on a listening socket forever, serving each on a thread of its own.
+    Args:
+        server_socket (socket.socket): The listening socket.
+        channels (dict): A dictionary of all channels.
+        writer (OutboundWriter): The writer draining client outboxes.
+        channel (Channel): The channel the socket listens for, None for the shared port.
+    """
+    while True:
+        try:
+            # accept a client connection
+            conn, addr = server_socket.accept()
+        except OSError:
+            continue
+        # the handshake is read on the client's thread, so a client that never sends it holds up nobody else
+        client_thread = threading.Thread(target=serve_connection, args=(conn, addr, channels, writer, channel))
+        client_thread.start()
+
+# serialises registration, so two clients with the same username cannot both pass the duplicate check
+registration_lock = threading.Lock()
+
+def serve_connection(conn, addr, channels, writer, channel=None) -> None:
+    """
+    Reads a new connection's handshake, registers the client in the channel it routes to and
+    handles the client's messages until it leaves, whether it is in the channel or queue.
+    Args:
+        conn (socket.socket): The accepted connection.
+        addr (tuple): The client's address.
+        channels (dict): A dictionary of all channels.
+        writer (OutboundWriter): The writer draining client outboxes.
+        channel (Channel): The channel whose port the connection arrived on, None for the shared port.
+    """
+    decoder = FrameDecoder()
+    try:
+        handshake = read_frame(conn, decoder)
+        if handshake is None:
+            conn.close()
+            return
+        target = route_handshake(conn, handshake.decode(), channels, channel)
+    except (OSError, ValueError):
+        conn.close()
+        return
+    if target is None:
+        return
+    target_channel, username = target
+    serve_client(target_channel, conn, addr, username, decoder, writer, channels)
+
+def serve_client(channel, conn, addr, username, decoder, writer, channels) -> None:
+    """
+    Registers a client whose handshake has been read and handles its messages until it leaves.
+    Args:
+        channel (Channel): The channel the client joins.
+        conn (socket.socket): The client's connection.
+        addr (tuple): The client's address.
+        username (str): The username sent by the client.
+        decoder (FrameDecoder): The decoder that read the handshake, holding any bytes after it.
+        writer (OutboundWriter): The writer draining client outboxes.
+        channels (dict): A dictionary of all channels.
+    """
+    with registration_lock:
+        new_client = register_client(channel, conn, addr, username, decoder, writer)
+    if new_client is not None:
+        client_handler(new_client, channel, channels)
+
+def route_handshake(conn, handshake, channels, channel=None):
+    """
+    Works out which channel a new connection joins from its first message. On a channel's own
+    port the handshake is just the username; on the shared port it is "<username> <channel>".
+    A connection naming a channel that does not exist is told so and closed.
+    Args:
+        conn (socket.socket): The new connection.
+        handshake (str): The connection's first message.
+        channels (dict): A dictionary of all channels.
+        channel (Channel): The channel whose port the connection arrived on, None for the shared port.
+    Returns:
+        tuple: The (channel, username) pair, or None if the connection was turned away.
+    """
+    if channel is not None:
+        return channel, handshake
+    split_handshake = handshake.split()
+    if len(split_handshake) != 2:
+        conn.close()
+        return None
+    username, channel_name = split_handshake
+    channel = channels.get(channel_name)
+    if channel is None:
+        turn_away(conn, DOES_NOT_EXIST.render(name=channel_name))
+        return None
+    return channel, username
+
+def turn_away(conn, msg) -> None:
+    """
+    Tells a new connection why it is refused, then shuts it down and closes it.
+    Args:
+        conn (socket.socket): The connection, not registered with any selector.
+        msg (str): The reason.
+    """
+    try:
+        conn.sendall(encode_frame(msg))
+        conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    conn.close()
+
+def hang_up(conn) -> None:
+    """
+    Shuts a client's connection down before closing it. The shutdown wakes a handler thread
+    blocked in recv on it, which a plain close does not.
+    Args:
+        conn (socket.socket): The client's connection.
+    """
+    try:
+        conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    conn.close()
+
+def register_client(channel, conn, addr, username, decoder, writer):
+    """
+    Welcomes a newly connected client and places it in the channel or its queue.
+    Args:
+        channel (Channel): The channel the client connected to.
+        conn (socket.socket): The accepted connection.
+        addr (tuple): The client's address.
+        username (str): The username sent by the client.
+        decoder (FrameDecoder): The decoder that read the username, holding any bytes after it.
+        writer (OutboundWriter | SelectorWriter): The writer draining the client's outbox.
+    Returns:
+        Client: The new client, or None if the username is already taken, the connection is
+        then told so and closed, or if another worker process serves the channel, the
+        connection is then handed over to that worker.
+    """
+    if channel.replica is not None:
+        channel.replica.link.hand_off(conn, channel.name, username, decoder)
+        return None
+    # check duplicate username in channel and channel"s queue
+    is_valid = check_duplicate_username(username, channel, conn)
+    if not is_valid:
+        turn_away(conn, DUPLICATE_NAME.render(channel=channel.name, username=username))
+        return None
+
+    # chat lines leave as soon as they are flushed, batching them is up to the outbox and a
+    # coalescing channel rather than Nagle's algorithm
+    try:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+    new_client = Client(username, conn, addr, decoder, writer)
+    new_client.channel = channel
+    welcome_msg = WELCOME.render(channel=channel.name, username=username)
+    new_client.send(welcome_msg)
+
+    # position client in channel or queue
+    position_client(channel, conn, username, new_client)
+    return new_client
+
+class OutboundWriter:
+    """
+    Drains client outboxes that could not be flushed inline. A single thread waits for the
+    backlogged sockets to become writable, so a stalled client never blocks the thread that is
+    broadcasting to it.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.wake_recv.setblocking(False)
+        self.selector.register(self.wake_recv, selectors.EVENT_READ, None)
+
+    def watch(self, client) -> None:
+        """
+        Ask the writer thread to keep flushing a client's outbox until it is empty.
+        Args:
+            client (Client): The client with queued bytes.
+        """
+        with self.lock:
+            self.pending.add(client)
+        try:
+            self.wake_send.send(b"\0", socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            # a wake up is already pending
+            pass
+
+    def unwatch(self, client) -> None:
+        try:
+            self.selector.unregister(client.connection)
+        except (KeyError, ValueError):
+            pass
+
+    def run(self) -> None:
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    try:
+                        while self.wake_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                client = key.data
+                if client.outbox.flush(client.connection):
+                    self.unwatch(client)
+
+            with self.lock:
+                pending, self.pending = self.pending, set()
+            for client in pending:
+                if client.outbox.flush(client.connection):
+                    continue
+                try:
+                    self.selector.register(client.connection, selectors.EVENT_WRITE, client)
+                except KeyError:
+                    # already watched, or a stale entry for a reused file descriptor
+                    self.selector.unregister(client.connection.fileno())
+                    self.selector.register(client.connection, selectors.EVENT_WRITE, client)
+                except ValueError:
+                    # the connection has been closed
+                    pass
+
+class SelectorWriter:
+    """
+    Drains client outboxes from the event loop: a client with queued bytes is polled for
+    writability as well as readability until its outbox is empty.
+    """
+
+    def __init__(self, selector):
+        self.selector = selector
+
+    def watch(self, client) -> None:
+        try:
+            key = self.selector.get_key(client.connection)
+            self.selector.modify(client.connection, selectors.EVENT_READ | selectors.EVENT_WRITE, key.data)
+        except (KeyError, ValueError):
+            # not registered with the loop (yet), the loop checks again after registering
+            pass
+
+    def unwatch(self, client) -> None:
+        try:
+            key = self.selector.get_key(client.connection)
+            self.selector.modify(client.connection, selectors.EVENT_READ, key.data)
+        except (KeyError, ValueError):
+            pass
+
+def watch_socket(selector, sock, data) -> None:
+    """
+    Registers a socket for read events, replacing any stale registration left behind when a
+    socket with the same file descriptor was closed outside the loop (e.g. by /kick).
+    Args:
+        selector (selectors.BaseSelector): The event loop's selector.
+        sock (socket.socket): The socket to watch.
+        data (tuple): The (kind, owner) pair handed back with each event.
+    """
+    try:
+        selector.register(sock, selectors.EVENT_READ, data)
+    except KeyError:
+        selector.unregister(sock.fileno())
+        selector.register(sock, selectors.EVENT_READ, data)
+
+def serve_client_event(selector, client, channel, channels, data=None) -> None:
+    """
+    Reads and dispatches messages from a readable client socket in event loop mode,
+    unregistering the socket once the client's session has ended.
+    Args:
+        selector (selectors.BaseSelector): The event loop's selector.
+        client (Client): The client whose socket is readable.
+        channel (Channel): The channel the client registered in, it may /switch in place later.
+        channels (dict): A dictionary of all channels.
+        data (bytes): Bytes to handle instead of reading from the socket.
+    """
+    done = True
+    try:
+        received = client.connection.recv(65536) if data is None else data
+        if data is None and not received:
+            # peer closed the connection, unless the server already dropped the client
+            if not client.kicked:
+                disconnect_client(client, client.channel)
+        else:
+            done = handle_data(client, channel, channels, received)
+    except OSError:
+        if not client.kicked and client.connection.fileno() != -1:
+            disconnect_client(client, client.channel)
+    except Exception as e:
+        print(f"Error in client handler: {e}")
+        quit_client(client, client.channel)
+    if done or client.kicked or client.connection.fileno() == -1:
+        selector.unregister(client.connection)
+
+def start_client_events(selector, writer, client, channel, channels) -> None:
+    """
+    Starts serving a newly registered client from the event loop.
+    Args:
+        selector (selectors.BaseSelector): The event loop's selector.
+        writer (SelectorWriter): The writer draining client outboxes.
+        client (Client): The new client.
+        channel (Channel): The channel the client joined.
+        channels (dict): A dictionary of all channels.
+    """
+    watch_socket(selector, client.connection, ("client", (client, channel)))
+    if client.outbox.queued_bytes:
+        writer.watch(client)
+    # messages sent right behind the handshake are already buffered
+    serve_client_event(selector, client, channel, channels, b"")
+
+def serve_event_loop(channels, scheduler, link=None, admin_socket=None) -> None:
+    """
+    Serves every channel from a single thread. All listeners (one per channel, or the single
+    shared port), client sockets and stdin share one selector (epoll where available); queue
+    admission and timers (mute expiry, AFK)
+    run between events instead of on dedicated threads. Command semantics match the threaded mode.
+    Everything queued during one pass over the ready sockets is flushed at the end of the pass.
+    Args:
+        channels (dict): A dictionary of all channels.
+        scheduler (Scheduler): The channels' timer scheduler, run from the loop.
+        link (ShardLink): The control plane, in a worker process, which then only serves its own
+        channels and takes admin commands from the control plane rather than stdin.
+        admin_socket (socket.socket): The admin socket, if there is one.
+    """
+    selector = selectors.DefaultSelector()
+    writer = SelectorWriter(selector)
+    # channels whose queue or membership changed since the last pass
+    admissions = set(channels.values())
+    listeners = []
+    for channel in channels.values():
+        channel.admission_listener = admissions.add
+        if Channel.shared_port is None and channel.replica is None:
+            listeners.append((listen_on(channel.port, channel.backlog), channel))
+    if Channel.shared_port is not None:
+        listeners.append((listen_on(Channel.shared_port, socket.SOMAXCONN, link is not None), None))
+    for server_socket, channel in listeners:
+        server_socket.setblocking(False)
+        selector.register(server_socket, selectors.EVENT_READ, ("listen", channel))
+    if link is not None:
+        selector.register(link.sock, selectors.EVENT_READ, ("shard", link))
+    else:
+        try:
+            selector.register(sys.stdin, selectors.EVENT_READ, ("admin", None))
+        except (ValueError, OSError):
+            # stdin is closed or not pollable (e.g. redirected from a file)
+            pass
+    if admin_socket is not None:
+        selector.register(admin_socket, selectors.EVENT_READ, ("admin-listen", None))
+    # a timer added from another thread (a checksum that is ready) would otherwise wait out
+    # the select timeout computed before it existed
+    wake_recv, wake_send = socket.socketpair()
+    wake_recv.setblocking(False)
+    selector.register(wake_recv, selectors.EVENT_READ, ("wake", None))
+    loop_thread = threading.get_ident()
+
+    def wake() -> None:
+        if threading.get_ident() == loop_thread:
+            return
+        try:
+            wake_send.send(b"\0", socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            # a wake up is already pending
+            pass
+    scheduler.wake = wake
+
+    while True:
+        with FlushBatch():
+            for key, mask in selector.select(scheduler.next_timeout()):
+                kind, owner = key.data
+                if kind == "listen":
+                    # accept a client connection, its first message is the handshake
+                    try:
+                        conn, addr = key.fileobj.accept()
+                    except OSError:
+                        continue
+                    watch_socket(selector, conn, ("handshake", (owner, addr, FrameDecoder())))
+                elif kind == "handshake":
+                    conn = key.fileobj
+                    channel, addr, decoder = owner
+                    try:
+                        data = conn.recv(65536)
+                        if not data:
+                            selector.unregister(conn)
+                            conn.close()
+                            continue
+                        decoder.feed(data)
+                        handshake = decoder.next_frame()
+                        if handshake is None:
+                            # wait for the rest of the handshake
+                            continue
+                        selector.unregister(conn)
+                        target = route_handshake(conn, handshake.decode(), channels, channel)
+                        if target is None:
+                            continue
+                        channel, username = target
+                        new_client = register_client(channel, conn, addr, username, decoder, writer)
+                    except (OSError, ValueError):
+                        try:
+                            selector.unregister(conn)
+                        except (KeyError, ValueError):
+                            # already unregistered once the handshake was read
+                            pass
+                        conn.close()
+                        continue
+                    if new_client is not None:
+                        start_client_events(selector, writer, new_client, channel, channels)
+                elif kind == "shard":
+                    try:
+                        handoff = owner.receive()
+                    except (EOFError, OSError):
+                        # the control plane is gone, and with it the server
+                        os._exit(0)
+                    if handoff is not None:
+                        channel, conn, addr, username, decoder = handoff
+                        new_client = register_client(channel, conn, addr, username, decoder, writer)
+                        if new_client is not None:
+                            start_client_events(selector, writer, new_client, channel, channels)
+                elif kind == "client":
+                    client, channel = owner
+                    if mask & selectors.EVENT_WRITE and client.outbox.flush(client.connection):
+                        writer.unwatch(client)
+                    if mask & selectors.EVENT_READ:
+                        serve_client_event(selector, client, channel, channels)
+                elif kind == "wake":
+                    try:
+                        while wake_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif kind == "admin":
+                    command = sys.stdin.readline()
+                    if not command:
+                        # stdin closed, stop polling it
+                        selector.unregister(sys.stdin)
+                        continue
+                    dispatch_admin_command(command.rstrip("\n"), channels)
+                elif kind == "admin-listen":
+                    try:
+                        conn, _ = key.fileobj.accept()
+                    except OSError:
+                        continue
+                    selector.register(conn, selectors.EVENT_READ, ("admin-client", AdminConnection(conn)))
+                elif kind == "admin-client":
+                    try:
+                        data = key.fileobj.recv(65536)
+                    except OSError:
+                        data = b""
+                    # unregistered first, a reply that times out closes the socket
+                    selector.unregister(key.fileobj)
+                    if owner.serve(data, channels):
+                        selector.register(key.fileobj, selectors.EVENT_READ, key.data)
+
+            scheduler.run_due()
+            while admissions:
+                channel = admissions.pop()
+                while admit_next(channel):
+                    pass
+
+class ShardLink:
+    """
+    A worker process's end of the control plane. The worker publishes every membership change of
+    its channels through it, and receives the other workers' changes, the admin commands for its
+    channels, and connections handed over by workers that accepted them on the shared port.
+    """
+
+    def __init__(self, sock, channels):
+        self.sock = sock
+        self.channels = channels
+        self.lock = threading.Lock()
+
+    def send(self, message, fds=()) -> None:
+        with self.lock:
+            if fds:
+                socket.send_fds(self.sock, [message], fds)
+            else:
+                self.sock.send(message)
+
+    def publish(self, change) -> None:
+        """
+        Args:
+            change (str): A membership change of one of this worker's channels.
+        """
+        self.send(change.encode())
+
+    def hand_off(self, conn, channel_name, username, decoder) -> None:
+        """
+        Passes a connection for a channel this worker does not serve on to the worker that does,
+        with the bytes already read behind its handshake, and closes this worker's copy.
+        Args:
+            conn (socket.socket): The connection.
+            channel_name (str): The channel named in its handshake.
+            username (str): The username named in its handshake.
+            decoder (FrameDecoder): The decoder that read the handshake.
+        """
+        leftover = bytes(decoder.buffer[decoder.offset:])
+        try:
+            self.send(f"handoff {channel_name} {username}\n".encode() + leftover, [conn.fileno()])
+        except OSError:
+            pass
+        conn.close()
+
+    def receive(self):
+        """
+        Reads one message from the control plane, applying membership changes and admin commands.
+        Returns:
+            tuple: The (channel, conn, addr, username, decoder) of a handed over connection, or None.
+        Raises:
+            EOFError: If the control plane has gone away.
+        """
+        message, fds, _, _ = socket.recv_fds(self.sock, CONTROL_PACKET, 1)
+        if not message:
+            raise EOFError("control plane closed")
+        if message.startswith(b"handoff ") and fds:
+            header, _, leftover = message.partition(b"\n")
+            _, channel_name, username = header.decode().split()
+            conn = socket.socket(fileno=fds[0])
+            conn.setblocking(True)
+            decoder = FrameDecoder()
+            decoder.feed(leftover)
+            try:
+                addr = conn.getpeername()
+            except OSError:
+                addr = None
+            return self.channels[channel_name], conn, addr, username, decoder
+        for fd in fds:
+            os.close(fd)
+        text = message.decode()
+        if text.startswith("admin "):
+            # "admin <request id> <command>", request 0 is from stdin and wants no reply
+            _, request_id, command = text.split(" ", 2)
+            if request_id == "0":
+                dispatch_admin_command(command, self.channels)
+            else:
+                with AdminReply(command) as reply:
+                    reply.ok = dispatch_admin_command(command, self.channels)
+                self.send(f"reply {request_id} ".encode() + reply.encode())
+        else:
+            change = text.split()
+            channel = self.channels.get(change[1])
+            if channel is not None and channel.replica is not None:
+                channel.replica.apply(change)
+        return None
+
+def serve_shard_link(link, channels, writer) -> None:
+    """
+    Handles control plane messages in a threaded worker process, serving handed over
+    connections on threads of their own.
+    Args:
+        link (ShardLink): The worker's end of the control plane.
+        channels (dict): A dictionary of all channels.
+        writer (OutboundWriter): The writer draining client outboxes.
+    """
+    while True:
+        try:
+            handoff = link.receive()
+        except (EOFError, OSError):
+            # the control plane is gone, and with it the server
+            os._exit(0)
+        if handoff is not None:
+            channel, conn, addr, username, decoder = handoff
+            client_thread = threading.Thread(target=serve_client, args=(channel, conn, addr, username, decoder, writer, channels))
+            client_thread.start()
+
+def start_shards(channels, workers, admin_socket=None):
+    """
+    Splits the channels across worker processes, round robin in configuration order, so the
+    server is not held to one core by a single interpreter. Every worker knows every channel but
+    only serves its own; this process stays behind as the control plane.
+    Args:
+        channels (dict): A dictionary of all channels.
+        workers (int): The number of worker processes, at most one per channel.
+        admin_socket (socket.socket): The admin socket, served by the control plane.
+    Returns:
+        ShardLink: In each worker process, its end of the control plane. In the control plane
+        process this does not return.
+    """
+    names = list(channels)
+    workers = min(workers, len(names))
+    owners = {name: index % workers for index, name in enumerate(names)}
+    links = []
+    for index in range(workers):
+        parent_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        if os.fork() == 0:
+            parent_end.close()
+            for other in links:
+                other.close()
+            if admin_socket is not None:
+                admin_socket.close()
+            link = ShardLink(worker_end, channels)
+            for name, channel in channels.items():
+                if owners[name] != index:
+                    channel.replica = ShardReplica(link)
+            channels[names[0]].directory.publish = link.publish
+            return link
+        worker_end.close()
+        links.append(parent_end)
+    run_control_plane(links, owners, admin_socket)
+    os._exit(0)
+
+def relay(sock, message, fds=()) -> None:
+    """
+    Sends a control plane message to a worker, ignoring a worker that has exited.
+    """
+    try:
+        if fds:
+            socket.send_fds(sock, [message], fds)
+        else:
+            sock.send(message)
+    except OSError:
+        pass
+
+def admin_targets(command, owners, live) -> list:
+    """
+    Routes an admin command to the workers that have to run it: the worker serving the channel
+    it names, or for /empty the workers serving any of the channels it names, each given only
+    its own. /shutdown, /channels and /stats without a channel go to every worker, /where and
+    anything else to the first.
+    Args:
+        command (str): The admin command.
+        owners (dict): The index of the worker serving each channel, by channel name.
+        live (set): The indexes of the workers still running.
+    Returns:
+        list: The (worker index, command) pairs to send.
+    """
+    split_command = command.split()
+    if command == "/shutdown" or split_command in (["/stats"], ["/channels"]):
+        return [(index, command) for index in sorted(live)]
+    if split_command[:1] == ["/empty"]:
+        by_owner = {}
+        for name in split_command[1:]:
+            # a channel that does not exist is reported by the first worker
+            by_owner.setdefault(owners.get(name, min(live, default=None)), []).append(name)
+        return [(index, " ".join(["/empty"] + names)) for index, names in sorted(by_owner.items()) if index in live]
+    if len(split_command) > 1 and split_command[1] in owners and not command.startswith("/where"):
+        return [(owners[split_command[1]], command)] if owners[split_command[1]] in live else []
+    return [(index, command) for index in sorted(live)[:1]]
+
+def run_control_plane(links, owners, admin_socket=None) -> None:
+    """
+    Runs the control plane until every worker has exited. Each worker's membership changes are
+    relayed to the others, handed over connections are forwarded to the worker serving their
+    channel, and admin commands from stdin and the admin socket go to the workers admin_targets
+    picks. The replies of the workers that ran an admin socket command are merged into one.
+    Args:
+        links (list): The control plane's end of each worker's socket pair.
+        owners (dict): The index of the worker serving each channel, by channel name.
+        admin_socket (socket.socket): The admin socket, if there is one.
+    """
+    selector = selectors.DefaultSelector()
+    for index, link in enumerate(links):
+        selector.register(link, selectors.EVENT_READ, index)
+    try:
+        selector.register(sys.stdin, selectors.EVENT_READ, None)
+    except (ValueError, OSError):
+        # stdin is closed or not pollable (e.g. redirected from a file)
+        pass
+    if admin_socket is not None:
+        selector.register(admin_socket, selectors.EVENT_READ, "admin-listen")
+    live = set(range(len(links)))
+    # admin socket commands waiting for replies: request id to [client, reply, workers left]
+    requests = {}
+    request_ids = itertools.count(1)
+
+    def complete(request_id) -> None:
+        admin, _, waiting = requests[request_id]
+        if not waiting:
+            del requests[request_id]
+            flush(admin)
+
+    def flush(admin) -> None:
+        # replies are sent in the order of their commands
+        while admin.pending and admin.pending[0][1] not in requests:
+            reply, _ = admin.pending.popleft()
+            admin.respond(reply)
+
+    while live:
+        for key, _ in selector.select():
+            if key.data is None:
+                command = sys.stdin.readline()
+                if not command:
+                    # stdin closed, stop polling it
+                    selector.unregister(sys.stdin)
+                    continue
+                for index, routed in admin_targets(command.rstrip("\n"), owners, live):
+                    relay(links[index], b"admin 0 " + routed.encode())
+                continue
+            if key.data == "admin-listen":
+                try:
+                    conn, _ = key.fileobj.accept()
+                except OSError:
+                    continue
+                selector.register(conn, selectors.EVENT_READ, AdminConnection(conn))
+                continue
+            if isinstance(key.data, AdminConnection):
+                admin = key.data
+                try:
+                    data = key.fileobj.recv(65536)
+                except OSError:
+                    data = b""
+                if not data:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    continue
+                for command in admin.commands(data):
+                    reply = AdminReply(command)
+                    targets = admin_targets(command, owners, live)
+                    if command == "/shutdown":
+                        # the workers exit running it, so it is acknowledged without waiting for them
+                        request_id = 0
+                    else:
+                        request_id = next(request_ids)
+                        reply.ok = bool(targets)
+                        requests[request_id] = [admin, reply, {index for index, _ in targets}]
+                    admin.pending.append((reply, request_id))
+                    for index, routed in targets:
+                        relay(links[index], f"admin {request_id} {routed}".encode())
+                    if request_id:
+                        complete(request_id)
+                    else:
+                        flush(admin)
+                continue
+            try:
+                message, fds, _, _ = socket.recv_fds(key.fileobj, CONTROL_PACKET, 1)
+            except OSError:
+                message, fds = b"", []
+            if not message:
+                # the worker has exited, the replies still expected from it never come
+                selector.unregister(key.fileobj)
+                live.discard(key.data)
+                for request_id in list(requests):
+                    requests[request_id][2].discard(key.data)
+                    complete(request_id)
+                continue
+            if message.startswith(b"handoff "):
+                owner = owners.get(message.split()[1].decode())
+                if owner in live:
+                    relay(links[owner], message, fds)
+                for fd in fds:
+                    os.close(fd)
+            elif message.startswith(b"reply "):
+                _, request_id, part = message.split(b" ", 2)
+                if int(request_id) in requests:
+                    _, reply, waiting = requests[int(request_id)]
+                    reply.merge(json.loads(part))
+                    waiting.discard(key.data)
+                    complete(int(request_id))
+            else:
+                for index in live - {key.data}:
+                    relay(links[index], message)
+
+def remove_item(q, item_to_remove) -> WaitingRoom:
+    """
+    Remove item from queue, and tell every client that was behind it its new position.
+    Status: Given
+    Args:
+        q (WaitingRoom): The queue to remove the item from.
+        item_to_remove (Client): The item to remove from the queue.
+    Returns:
+        WaitingRoom: The queue with the item removed.
+    """
+    removed_at = q.remove(item_to_remove)
+    if removed_at is not None:
+        notify_queue_positions(q, removed_at)
+    item_to_remove.in_queue = False
+    return q
+
+def notify_queue_positions(q, start=0) -> None:
+    """
+    Send waiting clients their position in the queue.
+    Args:
+        q (WaitingRoom): The queue whose clients to notify.
+        start (int): The first position to notify, clients ahead of it have not moved.
+    """
+    for count, client in enumerate(q):
+        if count < start:
+            continue
+        msg = QUEUE_POSITION.render(count=count)
+        client.send(msg)
+
+def process_queue(channel) -> None:
+    """
+    Processes the queue of clients for a channel in an infinite loop. If the channel is not full, 
+    it dequeues a client, adds them to the channel, and updates their status. It then sends updates 
+    to all clients in the channel and queue. The function handles EOFError exceptions and sleeps on
+    the channel's admission condition until a client is waiting and a slot is free.
+    Status: TODO
+    Args:
+        channel (Channel): The channel whose queue to process.
+    Returns:
+        None
+    """
+    # Write your code here...
+    while True:
+        try:
+            with channel.admission:
+                channel.admission.wait_for(channel.can_admit)
+            admit_next(channel)
+        except EOFError:
+            continue
+
+def admit_next(channel) -> bool:
+    """
+    Moves the client at the head of a channel's queue into the channel if there is space,
+    announcing the join and sending updated positions to everyone still waiting.
+    Args:
+        channel (Channel): The channel whose queue to process.
+    Returns:
+        bool: True if a client was admitted.
+    """
+    # a client registering at the same time checks the capacity under the same lock, so the
+    # channel cannot be filled past it by both
+    with registration_lock:
+        if not channel.can_admit():
+            return False
+        # Dequeue a client from the queue and add them to the channel
+        new_client = channel.queue.popleft()
+        if new_client is None:
+            return False
+        new_client.in_queue = False
+        channel.clients.append(new_client)
+    channel.queue_wait.record(time.monotonic() - new_client.queued_at)
+    # Send join message to all clients in the channel
+    channel.replay(new_client)
+    fan_out(channel.clients, JOINED.render(username=new_client.username))
+    
+    print(JOINED_ROOM.render(username=new_client.username, channel=channel.name))
+    # Update the queue messages for remaining clients in the queue
+    notify_queue_positions(channel.queue)
+    # Reset the remaining time before AFK
+    start_idle_timer(new_client, channel)
+    return True
+
+def kick_user(command, channels) -> None:
+    """
+    Implement /kick function
+    Status: TODO
+    Args:
+        command (str): The command to kick one or more users from a channel,
+        "/kick <channel> <username> [username ...]".
+        channels (dict): A dictionary of all channels.
+    Returns:
+        None
+    """
+    # Write your code here...
+    # validate command structure, several users of a channel may be kicked at once
+    cmd_split = command.split()
+    if len(cmd_split) < 3:
+        return
+    target_channel_name = cmd_split[1]
+    # Check if the channel exists in the dictionary
+    if target_channel_name not in channels:
+        report(DOES_NOT_EXIST.render(name=target_channel_name))
+        return
+    target_channel = channels[target_channel_name]
+    for target_name in cmd_split[2:]:
+        # Check if the user is in the channel
+        target_client = target_channel.clients.get(target_name)
+        if target_client is None:
+            report(NOT_IN_CHANNEL.render(username=target_name, channel=target_channel_name))
+            continue
+        # Kick the user, its handler must not take the hang-up for the client leaving again
+        target_client.kicked = True
+        quit_client(target_client, target_channel)
+        report(KICKED.render(username=target_name))
+
+def empty(command, channels) -> None:
+    """
+    Implement /empty function
+    Status: TODO
+    Args:
+        command (str): The command to empty one or more channels, "/empty <channel> [channel ...]".
+        channels (dict): A dictionary of all channels.
+    """
+    # Write your code here...
+    # validate the command structure, several channels may be emptied at once
+    split_command = command.split()
+    if len(split_command) < 2:
+        return
+    for target_channel_name in split_command[1:]:
+        # check if the channel exists in the server
+        if target_channel_name not in channels:
+            report(DOES_NOT_EXIST.render(name=target_channel_name))
+            continue
+        target_channel = channels[target_channel_name]
+
+        # if the channel exists, close connections of all clients in the channel
+        waiting = target_channel.queue.popleft()
+        # their handlers must not take the hang-up for the clients leaving on their own
+        while waiting is not None:
+            waiting.kicked = True
+            hang_up(waiting.connection)
+            waiting = target_channel.queue.popleft()
+        for client in target_channel.clients:
+            client.kicked = True
+            target_channel.clients.remove(client)
+            hang_up(client.connection)
+        report(EMPTIED.render(channel=target_channel_name))
+
+def mute_user(command, channels) -> None:
+    """
+    Implement /mute function
+    Status: TODO
+    Args:
+        command (str): The command to mute one or more users in a channel,
+        "/mute <channel> <username> [username ...] <seconds>".
+        channels (dict): A dictionary of all channels.
+    """
+    # Write your code here...
+    # validate the command structure
+    split_command = command.split()
+    if len(split_command) < 4:
+        return
+    _, target_channel_name, *target_usernames, mutetime = split_command
+    # check if the mute time is valid
+    try:
+        mute_time = int(mutetime)
+    except ValueError:
+        report(INVALID_MUTE.render())
+        return
+    if mute_time <= 0:
+        report(INVALID_MUTE.render())
+        return
+    # check if the channel exists in the server
+    target_channel = channels.get(target_channel_name)
+    for target_username in target_usernames:
+        # if the channel exists, check if the user is in the channel
+        target_client = None
+        if target_channel is not None:
+            target_client = target_channel.clients.get(target_username)
+
+        # if user is in the channel, mute it and send messages to all clients
+        if target_client is not None:
+            if target_client.mute_timer is not None:
+                target_client.mute_timer.cancel()
+            target_client.muted = True
+            target_client.mute_until = time.monotonic() + mute_time
+            target_client.mute_timer = target_channel.scheduler.call_later(mute_time, unmute_client, target_client, target_channel)
+            report(MUTED_LOG.render(username=target_client.username, seconds=mute_time))
+            mute_msg = YOU_MUTED.render(seconds=mute_time)
+            target_client.send(mute_msg)
+            server_mute_msg = MUTED.render(username=target_client.username, seconds=mute_time)
+            # broadcast_in_channel(target_client, target_channel, server_mute_msg)
+            fan_out((cl for cl in target_channel.clients if cl.username != target_client.username), server_mute_msg)
+        # if user is not in the channel, print error message
+        else:
+            report(NOT_HERE.render(username=target_username))
+
+def shutdown(channels) -> None:
+    """
+    Implement /shutdown function
+    Status: TODO
+    Args:
+        channels (dict): A dictionary of all channels.
+    """
+    # Write your code here...
+    # close connections of all clients in all channels and exit the server
+    for channel in channels.values():
+        # Close connections for all clients in the channel
+        for client in channel.clients:
+            client.connection.close()
+        
+        # Close connections for all clients in the queue
+        while not channel.queue.empty():
+            client = channel.queue.popleft()
+            client.connection.close()
+    # messages not yet committed to the logs
+    for channel in channels.values():
+        if channel.log_writer is not None:
+            channel.log_writer.commit()
+            break
+    # end of code insertion, keep the os._exit(0) as it is
+    os._exit(0)
+
+def server_commands(channels) -> None:
+    """
+    Implement commands to kick a user, empty a channel, mute a user, and shutdown the server.
+    Each command has its own validation and error handling. 
+    Status: Given
+    Args:
+        channels (dict): A dictionary of all channels.
+    Returns:
+        None
+    """
+    while True:
+        try:
+            command = input()
+            dispatch_admin_command(command, channels)
+        except EOFError:
+            # stdin is closed, e.g. under a supervisor, nothing more will come; the admin socket
+            # is the way in now
+            return
+        except Exception as e:
+            print(f"{e}")
+            sys.exit(1)
+
+def show_backlog(command, channels) -> None:
+    """
+    Prints each member's outbound backlog for a channel, largest first, to find the clients
+    slowing its fan-out down.
+    Args:
+        command (str): The command naming the channel.
+        channels (dict): A dictionary of all channels.
+    """
+    split_command = command.split()
+    if len(split_command) != 2:
+        return
+    target_channel_name = split_command[1]
+    if target_channel_name not in channels:
+        report(DOES_NOT_EXIST.render(name=target_channel_name))
+        return
+    members = sorted(channels[target_channel_name].clients, key=lambda c: c.outbox.queued_bytes, reverse=True)
+    for client in members:
+        outbox = client.outbox
+        report(BACKLOG.render(username=client.username, queued=outbox.queued_bytes, peak=outbox.peak_bytes,
+                             dropped=outbox.dropped_messages))
+
+def where_user(command, channels) -> None:
+    """
+    Prints every channel a username is in or waiting for, using the server-wide index.
+    Args:
+        command (str): The command naming the user.
+        channels (dict): A dictionary of all channels.
+    """
+    split_command = command.split()
+    if len(split_command) != 2 or not channels:
+        return
+    target_username = split_command[1]
+    places = next(iter(channels.values())).directory.find(target_username)
+    states = {channel_name: "waiting for" if client.in_queue else "in" for channel_name, client in places.items()}
+    # channels served by other worker processes
+    for channel in channels.values():
+        if channel.replica is not None and channel.replica.state(target_username) is not None:
+            states[channel.name] = channel.replica.state(target_username)
+    if not states:
+        report(NOT_HERE.render(username=target_username))
+        return
+    for channel_name, state in states.items():
+        report(WHERE.render(username=target_username, state=state, channel=channel_name))
+
+def export_log(command, channels) -> None:
+    """
+    Writes every logged message of a channel to a text file, one message per line, after
+    committing what is still queued.
+    Args:
+        command (str): The "/export <channel> <file>" command.
+        channels (dict): A dictionary of all channels.
+    """
+    split_command = command.split()
+    if len(split_command) != 3:
+        return
+    _, target_channel_name, path = split_command
+    channel = channels.get(target_channel_name)
+    if channel is None:
+        report(DOES_NOT_EXIST.render(name=target_channel_name))
+        return
+    if channel.log is None:
+        report(NOT_LOGGED.render(channel=target_channel_name))
+        return
+    channel.log_writer.commit()
+    count = 0
+    try:
+        with open(path, "w") as out:
+            for frame in channel.log.frames():
+                out.write(frame[HEADER.size:].decode(errors="replace") + "\n")
+                count += 1
+    except OSError as e:
+        report(f"{e}")
+        return
+    report(EXPORTED.render(count=count, channel=target_channel_name, path=path))
+
+def served_metrics(channels) -> list:
+    """
+    Returns:
+        list: The metric name prefixes of this process and of every channel it serves.
+    """
+    return ["server."] + [channel.metrics_prefix for channel in channels.values() if channel.replica is None]
+
+def show_stats(command, channels) -> None:
+    """
+    Prints a snapshot of the server's metrics, or of one channel's, with each counter's rate
+    since the previous /stats.
+    Args:
+        command (str): The "/stats [channel]" command.
+        channels (dict): A dictionary of all channels.
+    """
+    split_command = command.split()
+    if len(split_command) > 2:
+        return
+    if len(split_command) == 2:
+        channel = channels.get(split_command[1])
+        if channel is None:
+            report(DOES_NOT_EXIST.render(name=split_command[1]))
+            return
+        prefixes = [channel.metrics_prefix]
+    else:
+        prefixes = served_metrics(channels)
+        report(STATS_UPTIME.render(seconds=time.monotonic() - METRICS.started, threads=threading.active_count()))
+    now = time.monotonic()
+    for name, value in METRICS.snapshot(prefixes).items():
+        if isinstance(value, dict):
+            report(STAT_LATENCY.render(name=name, rate=METRICS.rate(name, value["count"], now), **value), {name: value})
+        elif isinstance(METRICS.metrics[name], Counter):
+            report(STAT_COUNT.render(name=name, value=value, rate=METRICS.rate(name, value, now)), {name: value})
+        else:
+            report(STAT_LEVEL.render(name=name, value=value), {name: value})
+
+def dump_stats(channels, scheduler, path, interval) -> None:
+    """
+    Appends a snapshot of the metrics to a file as one JSON object per line, and schedules the
+    next one, so the file records how the server's load changes over time.
+    Args:
+        channels (dict): A dictionary of all channels.
+        scheduler (Scheduler): The scheduler running the dumps.
+        path (str): The file to append to.
+        interval (float): Seconds between snapshots.
+    """
+    scheduler.call_later(interval, dump_stats, channels, scheduler, path, interval)
+    record = {"time": time.time(), "pid": os.getpid(), "uptime": time.monotonic() - METRICS.started,
+              "metrics": METRICS.snapshot(served_metrics(channels))}
+    try:
+        with open(path, "a") as out:
+            out.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(STATS_FAILED.render(path=path, error=e))
+
+class AdminReply:
+    """
+    The output of one admin command run for an admin socket client. What the command reports
+    is printed as usual and collected here too, so it can be sent back as a JSON object:
+    {"command": ..., "ok": ..., "output": [lines], "data": ...}, with data only from queries.
+    """
+    local = threading.local()
+
+    def __init__(self, command):
+        self.command = command
+        self.ok = True
+        self.output = []
+        self.data = None
+
+    def __enter__(self):
+        AdminReply.local.current = self
+        return self
+
+    def __exit__(self, *exc_info):
+        AdminReply.local.current = None
+
+    def merge(self, part) -> None:
+        """
+        Adds the reply of one worker process to the reply for a command several workers ran.
+        Args:
+            part (dict): The decoded reply of the worker.
+        """
+        self.ok = self.ok and part["ok"]
+        self.output.extend(part["output"])
+        if isinstance(part.get("data"), list):
+            self.data = (self.data or []) + part["data"]
+        elif "data" in part:
+            self.data = part["data"]
+
+    def encode(self) -> bytes:
+        reply = {"command": self.command, "ok": self.ok, "output": self.output}
+        if self.data is not None:
+            reply["data"] = self.data
+        return (json.dumps(reply) + "\n").encode()
+
+def report(text, data=None) -> None:
+    """
+    Prints an admin command's output, adding it to the reply being collected on this thread.
+    Args:
+        text (str): A line of output.
+        data (object): The structured result of a query, for the reply.
+    """
+    print(text)
+    reply = getattr(AdminReply.local, "current", None)
+    if reply is not None:
+        reply.output.append(text)
+        if data is not None:
+            reply.data = (reply.data or []) + [data]
+
+def list_channels(command, channels) -> None:
+    """
+    Reports every channel this process serves with its occupancy.
+    Args:
+        command (str): The "/channels" command.
+        channels (dict): A dictionary of all channels.
+    """
+    if len(command.split()) != 1:
+        return
+    for channel in channels.values():
+        if channel.replica is not None:
+            continue
+        members, waiting = channel.counts()
+        report(f"[Channel] {channel.name} {channel.port} Capacity: {members}/ {channel.capacity}, Queue: {waiting}.",
+               {"channel": channel.name, "port": channel.port, "capacity": channel.capacity, "members": members,
+                "waiting": waiting, "history": channel.history.maxlen if channel.history is not None else 0,
+                "logged": channel.log is not None})
+
+def list_users(command, channels) -> None:
+    """
+    Reports the members of a channel and then the clients waiting for it, in queue order.
+    Args:
+        command (str): The "/users <channel>" command.
+        channels (dict): A dictionary of all channels.
+    """
+    split_command = command.split()
+    if len(split_command) != 2:
+        return
+    channel = channels.get(split_command[1])
+    if channel is None:
+        report(DOES_NOT_EXIST.render(name=split_command[1]))
+        return
+    for client in list(channel.clients) + list(channel.queue):
+        state = "waiting for" if client.in_queue else "in"
+        report(WHERE.render(username=client.username, state=state, channel=channel.name),
+               {"username": client.username, "channel": channel.name, "waiting": client.in_queue,
+                "muted_seconds": client.mute_remaining(), "queued_bytes": client.outbox.queued_bytes})
+
+# serialises admin commands from stdin and from every admin socket client
+admin_lock = threading.Lock()
+
+def dispatch_admin_command(command, channels) -> bool:
+    """
+    Runs a single admin command against the server.
+    Args:
+        command (str): The command line entered by the operator.
+        channels (dict): A dictionary of all channels.
+    Returns:
+        bool: False if the command is not an admin command.
+    """
+    with admin_lock:
+        return run_admin_command(command, channels)
+
+def run_admin_command(command, channels) -> bool:
+    if command.startswith("/kick"):
+        kick_user(command, channels)
+    elif command.startswith("/empty"):
+        empty(command, channels)
+    elif command.startswith("/mute"):
+        mute_user(command, channels)
+    elif command.startswith("/backlog"):
+        show_backlog(command, channels)
+    elif command.startswith("/where"):
+        where_user(command, channels)
+    elif command.startswith("/export"):
+        export_log(command, channels)
+    elif command.startswith("/stats"):
+        show_stats(command, channels)
+    elif command.startswith("/channels"):
+        list_channels(command, channels)
+    elif command.startswith("/users"):
+        list_users(command, channels)
+    elif command == "/shutdown":
+        shutdown(channels)
+    else:
+        if command:
+            report(UNKNOWN_COMMAND.render(command=command))
+        return False
+    return True
+
+class AdminConnection:
+    """
+    A client of the admin socket, such as an operator tool. Commands arrive one per line, and
+    each is answered with one line holding its AdminReply.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.buffer = b""
+        # in the control plane, the replies still being collected from workers, in command order
+        self.pending = collections.deque()
+        # only sending is bounded, the client may take as long as it likes between commands
+        seconds, fraction = divmod(ADMIN_REPLY_TIMEOUT, 1)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", int(seconds), int(fraction * 1e6)))
+
+    def commands(self, data):
+        """
+        Args:
+            data (bytes): Bytes received from the client.
+        Yields:
+            str: Every command completed by them.
+        """
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\n")
+        for line in lines:
+            command = line.decode(errors="replace").strip()
+            if command:
+                yield command
+
+    def respond(self, reply) -> bool:
+        """
+        Returns:
+            bool: False if the client did not take the reply, it is then disconnected.
+        """
+        try:
+            self.conn.sendall(reply.encode())
+            return True
+        except OSError:
+            self.conn.close()
+            return False
+
+    def serve(self, data, channels) -> bool:
+        """
+        Runs the commands completed by data, replying to each.
+        Args:
+            data (bytes): Bytes received from the client, empty once it has closed.
+            channels (dict): A dictionary of all channels.
+        Returns:
+            bool: False once the client is gone.
+        """
+        if not data:
+            self.conn.close()
+            return False
+        for command in self.commands(data):
+            reply = AdminReply(command)
+            if command == "/shutdown":
+                # the server exits running it, so it is acknowledged first
+                self.respond(reply)
+            with reply:
+                reply.ok = dispatch_admin_command(command, channels)
+            if not self.respond(reply):
+                return False
+        return True
+
+def open_admin_socket(path):
+    """
+    Listens for admin clients on a Unix domain socket only the server's user may connect to,
+    replacing the socket file a previous server left behind.
+    Args:
+        path (str): The socket's path.
+    Returns:
+        socket.socket: The listening socket.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    os.chmod(path, 0o600)
+    listener.listen(socket.SOMAXCONN)
+    return listener
+
+def serve_admin_socket(listener, channels) -> None:
+    """
+    Accepts admin clients in threaded mode, serving each on a thread of its own.
+    Args:
+        listener (socket.socket): The admin socket.
+        channels (dict): A dictionary of all channels.
+    """
+    while True:
+        conn, _ = listener.accept()
+        threading.Thread(target=serve_admin_client, args=(AdminConnection(conn), channels), daemon=True).start()
+
+def serve_admin_client(admin, channels) -> None:
+    """
+    Runs one admin client's commands until it disconnects.
+    Args:
+        admin (AdminConnection): The client.
+        channels (dict): A dictionary of all channels.
+    """
+    while True:
+        try:
+            data = admin.conn.recv(65536)
+        except OSError:
+            data = b""
+        if not admin.serve(data, channels):
+            return
+
+def start_idle_timer(client, channel) -> None:
+    """
+    Resets a client's AFK countdown and makes sure an idle check is scheduled for it. Activity
+    afterwards only moves client.last_active; the pending check reschedules itself if it fires
+    early, so a chatting client costs no timer operations per message.
+    Args:
+        client (Client): The client admitted to the channel.
+        channel (Channel): The channel the client is in.
+    """
+    client.last_active = time.monotonic()
+    if client.idle_timer is not None:
+        client.idle_timer.cancel()
+    client.idle_timer = channel.scheduler.call_later(client.afk_timeout, check_inactive_client, client, channel)
+
+def check_inactive_client(client, channel) -> None:
+    """
+    Runs when a client's AFK deadline may have passed. A client that was active since the check
+    was scheduled gets a new check at its new deadline. Muted or queued clients are left alone
+    (unmuting restarts the countdown). Otherwise the client is removed from the channel, its
+    connection is closed and the channel is told it went AFK.
+    Args:
+        client (Client): The client to check.
+        channel (Channel): The channel the client is in.
+    """
+    client.idle_timer = None
+    # if client is muted or in queue, or has already left, do nothing
+    if client.in_queue or client.muted or client not in channel.clients:
+        return
+    remaining = client.last_active + client.afk_timeout - time.monotonic()
+    if remaining > 0:
+        client.idle_timer = channel.scheduler.call_later(remaining, check_inactive_client, client, channel)
+        return
+    # remove client from the channel and close connection, print AFK message
+    channel.clients.remove(client)
+    client.kicked = True
+    afk_msg = AFK.render(username=client.username)
+    print(afk_msg)
+    broadcast_in_channel(client, channel, afk_msg)
+    hang_up(client.connection)
+
+def unmute_client(client, channel) -> None:
+    """
+    Lifts a client's mute when it expires and restarts its AFK countdown.
+    Args:
+        client (Client): The muted client.
+        channel (Channel): The channel the client was muted in.
+    """
+    client.muted = False
+    client.mute_until = 0
+    client.mute_timer = None
+    if client in channel.clients:
+        start_idle_timer(client, channel)
+
+def parse_options(args) -> dict:
+    """
+    Parses the optional "--name=value" flags that follow the configuration file.
+    Args:
+        args (list): The command line arguments after the configuration file.
+    Returns:
+        dict: The server options, with defaults filled in for any flag not given.
+    Raises:
+        SystemExit: If a flag is unknown or has an invalid value.
+    """
+    options = dict(DEFAULT_OPTIONS)
+    for arg in args:
+        name, sep, value = arg.partition("=")
+        name = name[2:]
+        if not arg.startswith("--") or not sep or name not in options:
+            sys.exit(1)
+        options[name] = value
+    if options["mode"] not in SERVER_MODES or options["slow-policy"] not in SLOW_POLICIES:
+        sys.exit(1)
+    if options["switch"] not in SWITCH_MODES or options["binary"] not in BINARY_MODES:
+        sys.exit(1)
+    try:
+        high, low = int(options["outbox-high"]), int(options["outbox-low"])
+        grace = float(options["slow-grace"])
+        afk_timeout = float(options["afk-timeout"])
+        transfer_ttl = float(options["transfer-ttl"])
+        listen_port = int(options["listen-port"])
+        workers = int(options["workers"])
+        log_settings = [int(options[name]) for name in
+                        ("log-sync-ms", "log-sync-messages", "log-segment-bytes", "log-retain-bytes")]
+        stats_interval = float(options["stats-interval"])
+        coalesce_bytes = int(options["coalesce-bytes"])
+        compress_min = int(options["compress-min"])
+        max_capacity = int(options["max-capacity"])
+        fanout_workers, fanout_min = int(options["fanout-workers"]), int(options["fanout-min"])
+    except ValueError:
+        sys.exit(1)
+    if stats_interval <= 0 or coalesce_bytes < 1 or compress_min < 0:
+        sys.exit(1)
+    if max_capacity < 1 or max_capacity > MAX_LARGE_CAPACITY or fanout_workers < 0 or fanout_min < 1:
+        sys.exit(1)
+    if any(codec not in CODECS for codec in options["compress"].split(",") if codec):
+        sys.exit(1)
+    if min(log_settings) < 1 or log_settings[3] < log_settings[2]:
+        sys.exit(1)
+    if low < 0 or high < low or grace < 0 or afk_timeout <= 0 or transfer_ttl <= 0:
+        sys.exit(1)
+    if listen_port < 0 or listen_port > 65535 or workers < 1:
+        sys.exit(1)
+    return options
+
+def configure_outboxes(options) -> None:
+    """
+    Applies the outbound buffer, compression, protocol and fan-out options to every client
+    outbox, channel coalescer, client and the fan-out workers.
+    Args:
+        options (dict): The server options.
+    """
+    Outbox.high_watermark = int(options["outbox-high"])
+    Outbox.low_watermark = int(options["outbox-low"])
+    Outbox.policy = options["slow-policy"]
+    Outbox.grace = float(options["slow-grace"])
+    Coalescer.max_bytes = int(options["coalesce-bytes"])
+    Client.codecs = tuple(codec for codec in options["compress"].split(",") if codec)
+    Client.compress_min = int(options["compress-min"])
+    Client.binary = options["binary"] == "on"
+    FanoutPool.workers = int(options["fanout-workers"]) if options["mode"] == "threaded" else 0
+    FanoutPool.min_members = int(options["fanout-min"])
+
+def start_logs(channels, options) -> None:
+    """
+    Opens the log of every channel this process serves and starts the thread committing them.
+    Args:
+        channels (dict): A dictionary of all channels.
+        options (dict): The server options.
+    """
+    LogWriter.sync_interval = int(options["log-sync-ms"]) / 1000
+    LogWriter.sync_messages = int(options["log-sync-messages"])
+    ChannelLog.segment_bytes = int(options["log-segment-bytes"])
+    ChannelLog.retain_bytes = int(options["log-retain-bytes"])
+    writer = LogWriter(options["log-dir"])
+    for channel in channels.values():
+        if channel.replica is None:
+            channel.start_log(writer)
+    threading.Thread(target=writer.run, daemon=True).start()
+
+def main():
+    try:
+        if len(sys.argv) < 2:
+            print("Usage: python3 chatserver.py configfile [--mode=threaded|eventloop] [--outbox-high=bytes] "
+                  "[--outbox-low=bytes] [--slow-policy=drop|disconnect] [--slow-grace=seconds] "
+                  "[--afk-timeout=seconds] [--transfer-ttl=seconds] [--listen-port=port] [--workers=count] "
+                  "[--switch=reconnect|inplace] [--log-dir=path] [--log-sync-ms=ms] [--log-sync-messages=count] "
+                  "[--log-segment-bytes=bytes] [--log-retain-bytes=bytes] [--stats-file=path] "
+                  "[--stats-interval=seconds] [--admin-socket=path] [--coalesce-bytes=bytes] "
+                  "[--compress=codec,...] [--compress-min=bytes] [--binary=on|off] [--max-capacity=count] "
+                  "[--fanout-workers=count] [--fanout-min=members]")
+            sys.exit(1)
+
+        config_file = sys.argv[1]
+        options = parse_options(sys.argv[2:])
+
+        # parsing and creating channels
+        parsed_lines = parse_config(config_file, int(options["max-capacity"]))
+        scheduler = Scheduler()
+        channels = get_channels_dictionary(parsed_lines, scheduler)
+        raise_file_limit(channels)
+        configure_outboxes(options)
+        Client.afk_timeout = float(options["afk-timeout"])
+        TransferRegistry.ttl = float(options["transfer-ttl"])
+        Channel.switch_in_place = options["switch"] == "inplace"
+        # a listen port serves every channel on that one port instead of each on its own
+        if int(options["listen-port"]):
+            Channel.shared_port = int(options["listen-port"])
+
+        admin_socket = None
+        if options["admin-socket"]:
+            admin_socket = open_admin_socket(options["admin-socket"])
+
+        link = None
+        if int(options["workers"]) > 1:
+            # only worker processes return, each serving its share of the channels
+            link = start_shards(channels, int(options["workers"]), admin_socket)
+            # the control plane serves the admin socket
+            admin_socket = None
+
+        if options["log-dir"]:
+            start_logs(channels, options)
+        if options["stats-file"]:
+            interval = float(options["stats-interval"])
+            scheduler.call_later(interval, dump_stats, channels, scheduler, options["stats-file"], interval)
+
+        if options["mode"] == "eventloop":
+            serve_event_loop(channels, scheduler, link, admin_socket)
+            return
+
+        # creating individual threads to handle channels connections
+        threads = []
+        writer = OutboundWriter()
+        writer_thread = threading.Thread(target=writer.run)
+        writer_thread.start()
+        threads.append(writer_thread)
+        served = [channel for channel in channels.values() if channel.replica is None]
+        if Channel.shared_port is None:
+            for channel in served:
+                thread = threading.Thread(target=channel_handler, args=(channel, channels, writer))
+                thread.start()
+                threads.append(thread)
+        else:
+            # a single accept thread routes connections, each channel still admits its own queue
+            for channel in served:
+                thread = threading.Thread(target=process_queue, args=(channel,))
+                thread.start()
+                threads.append(thread)
+            server_socket = listen_on(Channel.shared_port, socket.SOMAXCONN, link is not None)
+            thread = threading.Thread(target=accept_clients, args=(server_socket, channels, writer))
+            thread.start()
+            threads.append(thread)
+
+        if link is None:
+            server_commands_thread = threading.Thread(target=server_commands, args=(channels,))
+        else:
+            # admin commands arrive through the control plane
+            server_commands_thread = threading.Thread(target=serve_shard_link, args=(link, channels, writer))
+        server_commands_thread.start()
+        threads.append(server_commands_thread)
+        if admin_socket is not None:
+            admin_thread = threading.Thread(target=serve_admin_socket, args=(admin_socket, channels))
+            admin_thread.start()
+            threads.append(admin_thread)
+
+        # mute expiry and AFK checks
+        scheduler_thread = threading.Thread(target=scheduler.run)
+        scheduler_thread.start()
+        threads.append(scheduler_thread)
+
+        # Wait for all threads to complete
+        for thread in threads:
+            thread.join()
+
+    except KeyboardInterrupt:
+        print("Ctrl + C Pressed. Exiting...")
+        os._exit(0)
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        os._exit(1)
+
+
+if __name__ == "__main__":
+    main()